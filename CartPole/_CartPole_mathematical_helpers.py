@@ -21,6 +21,19 @@ def wrap_angle_rad(angle: float) -> float:
     return angle
 
 
+# wrap_angle_rad for functions compiled with numba, which does not support math.fmod
+@jit(nopython=True, nogil=True, cache=True, fastmath=True)
+def wrap_angle_rad_numba(angle: float) -> float:
+    Modulo = np.fmod(angle, 2 * np.pi)  # positive modulo
+    if Modulo < -np.pi:
+        angle = Modulo + 2 * np.pi
+    elif Modulo > np.pi:
+        angle = Modulo - 2 * np.pi
+    else:
+        angle = Modulo
+    return angle
+
+
 def wrap_angle_rad_inplace(angle: np.ndarray) -> None:
     Modulo = np.fmod(angle, 2 * np.pi)  # positive modulo
     neg_wrap, pos_wrap = Modulo < -np.pi, Modulo > np.pi
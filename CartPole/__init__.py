@@ -33,9 +33,11 @@ from tqdm import trange
 
 from CartPole._CartPole_mathematical_helpers import wrap_angle_rad
 
+from CartPole.async_controller import AsyncControllerRunner
 from CartPole.latency_adder import LatencyAdder
 from CartPole.load import get_full_paths_to_csvs, load_csv_recording
 from CartPole.noise_adder import NoiseAdder
+from CartPole.sensor_quantizer import SensorQuantizer
 from CartPole.state_utilities import (ANGLE_COS_IDX, ANGLE_IDX, ANGLE_SIN_IDX,
                                       ANGLED_IDX, POSITION_IDX, POSITIOND_IDX)
 from CartPole.state_utilities import create_cartpole_state
@@ -61,7 +63,6 @@ from matplotlib import animation, rc, transforms
 from matplotlib.patches import (Circle, FancyArrowPatch, FancyBboxPatch,
                                 Rectangle)
 
-from random import random
 
 # Angle convention to rotate the mast in right direction - depends on used Equation
 from CartPole.cartpole_equations import ANGLE_CONVENTION, CartPoleEquations
@@ -134,12 +135,17 @@ class CartPole(EnvironmentBatched):
         self.latency = self.config["latency"]
         self.LatencyAdderInstance = LatencyAdder(latency=self.latency, dt_sampling=0.002)
         self.NoiseAdderInstance = NoiseAdder()
+        self.SensorQuantizerInstance = SensorQuantizer()
         self.s_with_noise_and_latency = np.copy(self.s)
         self.zero_angle_shift_init = np.deg2rad(self.config['zero_angle_shift']['init'])
         self.zero_angle_shift = self.zero_angle_shift_init
         self.zero_angle_shift_mode = self.config['zero_angle_shift']['mode']
         self.zero_angle_shift_increment = np.deg2rad(self.config['zero_angle_shift']['increment'])
 
+        self.controller_execution_mode = self.config['controller_execution']['mode']
+        self.computation_time_scale = self.config['controller_execution']['computation_time_scale']
+        self.AsyncControllerRunnerInstance = None
+
         # region Time scales for simulation step, controller update and saving data
         # See last paragraph of "Time scales" section for explanations
         # ∆t in number of steps (related to simulation time step)
@@ -346,11 +352,13 @@ class CartPole(EnvironmentBatched):
     def add_noise_and_latency(self):
         self.LatencyAdderInstance.add_current_state_to_latency_buffer(self.s)
         s_delayed = self.LatencyAdderInstance.get_interpolated_delayed_state()
-        self.s_with_noise_and_latency = self.NoiseAdderInstance.add_noise_to_measurement(s_delayed, copy=False)
+        # cos and sin of the angle are recalculated in update_zero_angle_shift
+        self.s_with_noise_and_latency = self.NoiseAdderInstance.add_noise_to_measurement(s_delayed, copy=False, update_cos_sin=False)
         self.s_with_noise_and_latency = self.update_zero_angle_shift(self.s_with_noise_and_latency)
+        self.s_with_noise_and_latency = self.SensorQuantizerInstance.quantize_measurement(self.s_with_noise_and_latency, copy=False)
 
     def cartpole_ode(self):
-        self.angleDD, self.positionDD = self.cpe.cartpole_ode_interface(self.s, self.u, L=float(L))
+        self.angleDD, self.positionDD = self.cpe.cartpole_ode_interface(self.s, self.u, L=float(CP_PARAMETERS_DEFAULT.L))
 
     def Q2u(self):
         self.u = self.cpe.Q2u(self.Q)
@@ -358,8 +366,8 @@ class CartPole(EnvironmentBatched):
     def update_zero_angle_shift(self, s):
         if self.zero_angle_shift_mode == 'constant':
             da = 0.0
-        elif self.zero_angle_shift_mode == 'random walk':
-            da  = (1.0 if random() < 0.5 else -1.0)*self.zero_angle_shift_increment
+        elif self.zero_angle_shift_mode == 'random walk' or self.zero_angle_shift_mode == 'random_walk':
+            da = self.NoiseAdderInstance.get_random_sign()*self.zero_angle_shift_increment
         elif self.zero_angle_shift_mode == 'increase':
             self.zero_angle_shift_increment *= 1.000
             da = self.zero_angle_shift_increment
@@ -516,7 +524,7 @@ class CartPole(EnvironmentBatched):
             self.s[POSITION_IDX],
             self.s[POSITIOND_IDX],
             self.dt_simulation,
-            L=float(L),
+            L=float(CP_PARAMETERS_DEFAULT.L),
         )
 
     # Determine the dimensionless [-1,1] value of the motor power Q
@@ -527,6 +535,10 @@ class CartPole(EnvironmentBatched):
         # The counter should be initialized at max-1 to start with a control input update
         self.dt_controller_steps_counter += 1
 
+        if self.AsyncControllerRunnerInstance is not None:
+            self.Update_Q_async()
+            return
+
         # If update time interval elapsed update control input and zero the counter
         if self.dt_controller_steps_counter == self.dt_controller_number_of_steps:
 
@@ -546,22 +558,44 @@ class CartPole(EnvironmentBatched):
             self.Q = self.Q_applied
             self.dt_controller_steps_counter = 0
 
+    # Counterpart of Update_Q for controller_execution mode 'async'
+    # The control input computed from the state at a control tick is applied after the controller's computation time
+    def Update_Q_async(self):
+        result = self.AsyncControllerRunnerInstance.poll(self.time)
+        if result is not None:
+            Q_calculated, self.Q_update_time = result
+            self.Q_calculated = float(Q_calculated)
+            self.Q_applied = self.Q_calculated + controlDisturbance * rng.standard_normal(size=np.shape(self.Q_calculated), dtype=np.float32) + controlBias
+            self.Q = self.Q_applied
+
+        if self.dt_controller_steps_counter >= self.dt_controller_number_of_steps:
+            # If the previous computation is still running this control tick is skipped
+            if not self.AsyncControllerRunnerInstance.busy:
+                self.AsyncControllerRunnerInstance.submit(
+                    self.s_with_noise_and_latency,
+                    self.time,
+                    {"target_position": self.target_position, "target_equilibrium": self.target_equilibrium, 'L': float(self.L_for_controller)}
+                )
+            self.dt_controller_steps_counter = 0
+
+    # The parameters are changed in place with set_parameters, see CartPoleParameters,
+    # the global L is the L of CP_PARAMETERS_DEFAULT
     def update_parameters(self):
-        global L
+        L = CP_PARAMETERS_DEFAULT.L
         if self.time_last_L_change is None:
             self.time_last_L_change = self.time
         else:
             if (self.time-self.time_last_L_change) > self.change_L_every_x_second:
                 self.time_last_L_change = self.time
                 if self.L_change_mode == 'uniform':
-                    L[...] = np.random.uniform(*self.L_range)
+                    CP_PARAMETERS_DEFAULT.set_parameters(L=np.random.uniform(*self.L_range))
                 elif self.L_change_mode == 'step':
                     if L + self.L_step > self.L_range[1] or L + self.L_step < self.L_range[0]:
                         self.L_step *= -1.0
-                    L[...] = L + self.L_step
+                    CP_PARAMETERS_DEFAULT.set_parameters(L=L + self.L_step)
 
             else:
-                L[...] = L * self.L_discount_factor
+                CP_PARAMETERS_DEFAULT.set_parameters(L=L * self.L_discount_factor)
 
 
 
@@ -910,7 +944,7 @@ class CartPole(EnvironmentBatched):
         # Reset variables
         self.set_cartpole_state_at_t0(reset_mode=2, s=self.s, target_position=self.target_position)
 
-        L[...] = float(self.L_initial)
+        CP_PARAMETERS_DEFAULT.set_parameters(L=float(self.L_initial))
 
     # Runs a random experiment with parameters set with setup_cartpole_random_experiment
     # And saves the experiment recording to csv file
@@ -1001,6 +1035,10 @@ class CartPole(EnvironmentBatched):
         self.controller_name, self.controller_idx = get_controller_name(
             controller_name=controller_name, controller_idx=controller_idx
         )
+
+        if self.AsyncControllerRunnerInstance is not None:
+            self.AsyncControllerRunnerInstance.stop()
+            self.AsyncControllerRunnerInstance = None
         
         if self.controller_name != 'manual-stabilization':
             Controller: "type[template_controller]" = import_controller_by_name(self.controller_name)
@@ -1023,6 +1061,9 @@ class CartPole(EnvironmentBatched):
 
             else:
                 self.controller.configure()
+
+            if self.controller_execution_mode == 'async':
+                self.AsyncControllerRunnerInstance = AsyncControllerRunner(self.controller, self.computation_time_scale)
             
                 
         # Set the maximal allowed value of the slider - relevant only for GUI
@@ -1045,6 +1086,10 @@ class CartPole(EnvironmentBatched):
     # provide by user (reset_mode = 1), by giving s, Q and target_position
     def set_cartpole_state_at_t0(self, reset_mode=1, s=None, target_position=None, reset_dict_history=True):
 
+        # A computation started in the previous experiment must not be applied in the new one
+        if self.AsyncControllerRunnerInstance is not None:
+            self.AsyncControllerRunnerInstance.cancel()
+
         # Some controllers may need reset before being reused in the next experiment without reloading
         try:
             self.controller.controller_reset()
@@ -1110,7 +1155,7 @@ class CartPole(EnvironmentBatched):
 
             self.Q = self.Q_applied
             self.u = self.cpe.Q2u(self.Q)  # Calculate CURRENT control input
-            self.angleDD, self.positionDD = self.cpe.cartpole_ode_interface(self.s, self.u, L=float(L))  # Calculate CURRENT second derivatives
+            self.angleDD, self.positionDD = self.cpe.cartpole_ode_interface(self.s, self.u, L=float(CP_PARAMETERS_DEFAULT.L))  # Calculate CURRENT second derivatives
 
         # Reset the dict keeping the experiment history and save the state for t = 0
         self.dt_save_steps_counter = 0
@@ -0,0 +1,129 @@
+"""
+Runs the controller in a background thread, so that the simulation continues while the next control input is computed.
+
+A computation is started at a control tick with the state measured at that time.
+Its (scaled) computation time is treated as actuation latency:
+the result is applied at the first simulation step at which
+the simulation time elapsed since the start of the computation is at least this duration.
+The computation time is the CPU time of the controller thread, not wall-clock time,
+which would include the time the thread waits for the simulation thread (the GIL, other processes).
+Computations the controller hands over to other threads (parallel numba kernels, Tensorflow thread pools)
+are not included, use computation_time_scale to account for them.
+The numba kernels of the controllers and of the cartpole equations are compiled with nogil=True,
+so that they run while the simulation thread continues.
+The simulation only waits for the controller if the result might already be due,
+so physics and control overlap while the applied inputs stay independent of how fast the simulation itself runs.
+If a computation is still pending at the next control tick, this tick is skipped, as on the physical cartpole.
+"""
+
+import threading
+import time as clock
+
+import numpy as np
+
+
+class AsyncControllerRunner:
+    def __init__(self, controller, computation_time_scale=1.0):
+        """
+        :param controller: Controller whose step(s, time, updated_attributes) is run in the background
+        :param computation_time_scale: Factor applied to the measured computation (CPU) time,
+            e.g. to emulate a slower computer than the one running the simulation
+        """
+        self.controller = controller
+        self.computation_time_scale = computation_time_scale
+
+        self.request = None
+        self.request_time = None  # Simulation time at which the pending computation was started, None if idle
+        self.worker_clock = None  # CPU time clock of the worker thread, if it can be read from other threads
+        self.worker_start_time = None  # CPU time of the worker thread at the start of the computation
+
+        self.result = None
+        self.error = None
+        self.computation_time = None
+
+        self.new_request = threading.Event()
+        self.done = threading.Event()
+        self.done.set()
+        self.stopped = False
+
+        self.thread = threading.Thread(target=self.worker, daemon=True)
+        self.thread.start()
+
+    @property
+    def busy(self):
+        return self.request_time is not None
+
+    def worker(self):
+        if hasattr(clock, 'pthread_getcpuclockid'):  # Unix
+            self.worker_clock = clock.pthread_getcpuclockid(threading.get_ident())
+        while True:
+            self.new_request.wait()
+            self.new_request.clear()
+            if self.stopped:
+                return
+            s, time, updated_attributes = self.request
+            start = clock.thread_time()
+            self.worker_start_time = start
+            try:
+                self.result = self.controller.step(s, time, updated_attributes)
+            except Exception as e:
+                self.error = e
+            self.computation_time = (clock.thread_time() - start) * self.computation_time_scale
+            self.done.set()
+
+    def computation_time_so_far(self):
+        """Scaled CPU time of the pending computation until now, 0.0 if it cannot be read"""
+        start = self.worker_start_time
+        if self.worker_clock is None or start is None:
+            return 0.0
+        return (clock.clock_gettime(self.worker_clock) - start) * self.computation_time_scale
+
+    def submit(self, s, time, updated_attributes):
+        """Starts computing the control input for state s measured at simulation time time."""
+        if self.busy:
+            raise RuntimeError('A controller computation is already pending.')
+        self.request = (np.copy(s), time, dict(updated_attributes))
+        self.request_time = time
+        self.result = None
+        self.error = None
+        self.worker_start_time = None
+        self.done.clear()
+        self.new_request.set()
+
+    def poll(self, time):
+        """
+        Returns (Q, computation time) if the pending control input is due at simulation time time, otherwise None.
+        Waits for the controller only if the computation might end before time in simulation time.
+        """
+        if not self.busy:
+            return None
+
+        elapsed_simulation_time = time - self.request_time
+        if not self.done.is_set():
+            if elapsed_simulation_time < self.computation_time_so_far():
+                return None  # The computation takes longer than the CPU time it used so far in any case
+            self.done.wait()
+
+        if self.error is not None:
+            error, self.error = self.error, None
+            self.request_time = None
+            raise error
+
+        if elapsed_simulation_time < self.computation_time:
+            return None
+
+        self.request_time = None
+        return self.result, self.computation_time
+
+    def cancel(self):
+        """Waits for a pending computation to finish and discards its result."""
+        self.done.wait()
+        self.request_time = None
+        self.result = None
+        self.error = None
+
+    def stop(self):
+        self.cancel()
+        self.stopped = True
+        self.new_request.set()
+        self.thread.join()
@@ -101,6 +101,44 @@ def _cartpole_ode(ca, sa, angleD, positionD, u,
     return angleDD, positionDD
 
 
+def _cartpole_ode_partials(ca, sa, angleD, positionD, u,
+                           k, m_cart, m_pole, g, J_fric, M_fric, L):
+    """
+    Partial derivatives of angleDD and positionDD from _cartpole_ode
+    with respect to ca, sa, angleD, positionD and u, derived by hand from the equations above.
+    The parameters are treated as constants.
+
+    :returns: angleDD, positionDD,
+        (d angleDD / d ca, d angleDD / d sa, d angleDD / d angleD, d angleDD / d positionD, d angleDD / d u),
+        (d positionDD / d ca, ... same order)
+    """
+    angleDD, positionDD = _cartpole_ode(ca, sa, angleD, positionD, u, k, m_cart, m_pole, g, J_fric, M_fric, L)
+
+    A = (k + 1) * (m_cart + m_pole) - m_pole * (ca ** 2)
+    T_fric = - J_fric * angleD
+
+    # positionDD = numerator / A, the derivative of A with respect to ca is -2 * m_pole * ca
+    positionDD_ca = (m_pole * g * sa + T_fric / L + 2.0 * m_pole * ca * positionDD) / A
+    positionDD_sa = (m_pole * g * ca - (k + 1) * m_pole * L * (angleD ** 2)) / A
+    positionDD_angleD = (- J_fric * ca / L - 2.0 * (k + 1) * m_pole * L * angleD * sa) / A
+    positionDD_positionD = - (k + 1) * M_fric / A
+    positionDD_u = (k + 1) / A
+
+    # angleDD = (g * sa + positionDD * ca + T_fric / (m_pole * L)) / ((k + 1) * L)
+    c = 1.0 / ((k + 1) * L)
+    angleDD_ca = c * (positionDD + ca * positionDD_ca)
+    angleDD_sa = c * (g + ca * positionDD_sa)
+    angleDD_angleD = c * (ca * positionDD_angleD - J_fric / (m_pole * L))
+    angleDD_positionD = c * ca * positionDD_positionD
+    angleDD_u = c * ca * positionDD_u
+
+    return (
+        angleDD, positionDD,
+        (angleDD_ca, angleDD_sa, angleDD_angleD, angleDD_positionD, angleDD_u),
+        (positionDD_ca, positionDD_sa, positionDD_angleD, positionDD_positionD, positionDD_u),
+    )
+
+
 def Q2u(Q, u_max):
     """
     Converts dimensionless motor power [-1,1] to a physical force acting on a cart.
@@ -230,6 +268,73 @@ class CartPoleEquations:
 
         return angle, angleD, position, positionD, angle_cos, angle_sin
 
+    def cartpole_fine_integration_vjp(self, s, u, t_step, intermediate_steps, grad_s_next, **kwargs):
+        """
+        Adjoint (backward) pass of cartpole_fine_integration with the partial derivatives from _cartpole_ode_partials.
+        Given the gradient of a scalar with respect to s_next, returns its gradient with respect to s and u.
+        The substeps are recomputed, so the forward pass does not need to keep any intermediate results.
+        The edge bounce is not modeled, as in cartpole_fine_integration.
+
+        :param intermediate_steps: Python integer, the substeps are unrolled
+        :returns: gradient with respect to s (same shape as s), gradient with respect to u (same shape as u)
+        """
+        k = kwargs.get('k', self.params.k)
+        m_cart = kwargs.get('m_cart', self.params.m_cart)
+        m_pole = kwargs.get('m_pole', self.params.m_pole)
+        g = kwargs.get('g', self.params.g)
+        J_fric = kwargs.get('J_fric', self.params.J_fric)
+        M_fric = kwargs.get('M_fric', self.params.M_fric)
+        L = kwargs.get('L', self.params.L)
+
+        angle = s[..., ANGLE_IDX]
+        angleD = s[..., ANGLED_IDX]
+        positionD = s[..., POSITIOND_IDX]
+        angle_cos = s[..., ANGLE_COS_IDX]
+        angle_sin = s[..., ANGLE_SIN_IDX]
+
+        # Forward: keep the inputs of the ODE at every substep and cos/sin of the angle after the last one
+        substeps = []
+        for _ in range(intermediate_steps):
+            substeps.append((angle_cos, angle_sin, angleD, positionD))
+            angleDD, positionDD = self._cartpole_ode(angle_cos, angle_sin, angleD, positionD, u,
+                                                     k, m_cart, m_pole, g, J_fric, M_fric, L)
+            angle = angle + angleD * t_step
+            angleD = angleD + angleDD * t_step
+            positionD = positionD + positionDD * t_step
+            angle_cos = self.lib.cos(angle)
+            angle_sin = self.lib.sin(angle)
+        cos_sin_after = [(ca, sa) for ca, sa, _, _ in substeps[1:]] + [(angle_cos, angle_sin)]
+
+        # Backward
+        g_angle = grad_s_next[..., ANGLE_IDX]
+        g_angleD = grad_s_next[..., ANGLED_IDX]
+        g_angle_cos = grad_s_next[..., ANGLE_COS_IDX]
+        g_angle_sin = grad_s_next[..., ANGLE_SIN_IDX]
+        g_position = grad_s_next[..., POSITION_IDX]
+        g_positionD = grad_s_next[..., POSITIOND_IDX]
+        g_u = self.lib.zeros_like(u)
+        for i in reversed(range(intermediate_steps)):
+            # cos, sin and the wrapped angle after the substep are functions of the integrated angle
+            ca_after, sa_after = cos_sin_after[i]
+            g_angle = g_angle - sa_after * g_angle_cos + ca_after * g_angle_sin
+
+            ca, sa, angleD_i, positionD_i = substeps[i]
+            _, _, angleDD_partials, positionDD_partials = _cartpole_ode_partials(
+                ca, sa, angleD_i, positionD_i, u, k, m_cart, m_pole, g, J_fric, M_fric, L
+            )
+            g_ode = [t_step * (g_angleD * dA + g_positionD * dP)
+                     for dA, dP in zip(angleDD_partials, positionDD_partials)]
+
+            g_angle_cos, g_angle_sin = g_ode[0], g_ode[1]
+            g_angleD, g_positionD = (
+                g_angleD + t_step * g_angle + g_ode[2],
+                g_positionD + t_step * g_position + g_ode[3],
+            )
+            g_u = g_u + g_ode[4]
+
+        grad_s = self.lib.stack([g_angle, g_angleD, g_angle_cos, g_angle_sin, g_position, g_positionD], axis=-1)
+        return grad_s, g_u
+
     @CompileAdaptive
     def _cartpole_integration(self, angle, angleD, angleDD, position, positionD, positionDD, t_step):
         angle_next = self.euler_step(angle, angleD, t_step)
@@ -285,12 +390,12 @@ def edge_bounce(angle, angle_cos, angleD, position, positionD, t_step, L):
 
 
 from numba import jit
-_cartpole_ode_numba = jit(_cartpole_ode, nopython=True, cache=True, fastmath=True)
-euler_step_numba = jit(euler_step, nopython=True, cache=True, fastmath=True)
-edge_bounce_numba = jit(edge_bounce, nopython=True, cache=True, fastmath=True)
+_cartpole_ode_numba = jit(_cartpole_ode, nopython=True, nogil=True, cache=True, fastmath=True)
+euler_step_numba = jit(euler_step, nopython=True, nogil=True, cache=True, fastmath=True)
+edge_bounce_numba = jit(edge_bounce, nopython=True, nogil=True, cache=True, fastmath=True)
 
 
-@jit(nopython=True, cache=True, fastmath=True)
+@jit(nopython=True, nogil=True, cache=True, fastmath=True)
 def cartpole_integration_numba(angle, angleD, angleDD, position, positionD, positionDD, t_step, ):
     angle_next = euler_step_numba(angle, angleD, t_step)
     angleD_next = euler_step_numba(angleD, angleDD, t_step)
@@ -1,10 +1,10 @@
-from numba import jit
+from numba import jit, prange
 import numpy as np
 
 from CartPole.cartpole_equations import edge_bounce_numba, _cartpole_ode_numba, cartpole_integration_numba
 
 from CartPole.state_utilities import ANGLE_IDX, ANGLE_SIN_IDX, ANGLE_COS_IDX, ANGLED_IDX, POSITION_IDX, POSITIOND_IDX
-from CartPole._CartPole_mathematical_helpers import wrap_angle_rad_inplace
+from CartPole._CartPole_mathematical_helpers import wrap_angle_rad_inplace, wrap_angle_rad_numba
 
 
 def cartpole_fine_integration_numba_interface(s, u, t_step, intermediate_steps, params, **kwargs):
@@ -41,10 +41,10 @@ def cartpole_fine_integration_numba_interface(s, u, t_step, intermediate_steps,
     return s_next
 
 
-wrap_angle_rad_inplace_numba = jit(wrap_angle_rad_inplace, nopython=True, cache=True, fastmath=True)
+wrap_angle_rad_inplace_numba = jit(wrap_angle_rad_inplace, nopython=True, nogil=True, cache=True, fastmath=True)
 
 
-@jit(nopython=True, cache=True, fastmath=True)
+@jit(nopython=True, nogil=True, cache=True, fastmath=True)
 def edge_bounce_wrapper_numba(angle, angle_cos, angleD, position, positionD, t_step, L):
     for i in range(position.size):
         angle[i], angleD[i], position[i], positionD[i] = edge_bounce_numba(
@@ -76,3 +76,45 @@ def cartpole_fine_integration_numba(angle, angleD, angle_cos, angle_sin, positio
         angle_sin = np.sin(angle)
 
     return angle, angleD, position, positionD, angle_cos, angle_sin
+
+
+def _cartpole_horizon_integration(s0, Q, out, u_max, t_step, intermediate_steps,
+                                  k, m_cart, m_pole, g, J_fric, M_fric, L, termination_position=np.inf):
+    """
+    Integrates whole trajectories in one call: for each rollout i and horizon step j
+    the same fine integration as cartpole_fine_integration_numba (incl. edge bounce) with input u_max * Q[i, j, 0].
+    Once |position| exceeds termination_position the rollout is no longer integrated, its state is repeated until the end.
+
+    :param s0: Initial states, shape (batch_size x STATE_VARIABLES)
+    :param Q: Normed control inputs, shape (batch_size x horizon x 1)
+    :param out: Output buffer, shape (batch_size x (horizon + 1) x STATE_VARIABLES), filled with the initial and predicted states
+    """
+    for i in prange(Q.shape[0]):
+        angle, angleD = s0[i, ANGLE_IDX], s0[i, ANGLED_IDX]
+        position, positionD = s0[i, POSITION_IDX], s0[i, POSITIOND_IDX]
+        angle_cos, angle_sin = s0[i, ANGLE_COS_IDX], s0[i, ANGLE_SIN_IDX]
+        out[i, 0, :] = s0[i, :]
+        for j in range(Q.shape[1]):
+            u = u_max * Q[i, j, 0]
+            if np.abs(position) <= termination_position:  # Otherwise dead, the state is frozen
+                for _ in range(intermediate_steps):
+                    angleDD, positionDD = _cartpole_ode_numba(angle_cos, angle_sin, angleD, positionD, u,
+                                                              k, m_cart, m_pole, g, J_fric, M_fric, L)
+                    angle, angleD, position, positionD = cartpole_integration_numba(angle, angleD, angleDD,
+                                                                                    position, positionD, positionDD, t_step)
+                    angle_cos = np.cos(angle)
+                    angle, angleD, position, positionD = edge_bounce_numba(angle, angle_cos, angleD, position, positionD,
+                                                                           t_step, L)
+                    angle = wrap_angle_rad_numba(angle)
+                    angle_cos = np.cos(angle)
+                    angle_sin = np.sin(angle)
+
+            out[i, j + 1, ANGLE_IDX], out[i, j + 1, ANGLED_IDX] = angle, angleD
+            out[i, j + 1, POSITION_IDX], out[i, j + 1, POSITIOND_IDX] = position, positionD
+            out[i, j + 1, ANGLE_COS_IDX], out[i, j + 1, ANGLE_SIN_IDX] = angle_cos, angle_sin
+    return out
+
+
+cartpole_horizon_integration_numba = jit(_cartpole_horizon_integration, nopython=True, nogil=True, cache=True, fastmath=True)
+cartpole_horizon_integration_numba_parallel = jit(_cartpole_horizon_integration, nopython=True, parallel=True, nogil=True,
+                                                  cache=True, fastmath=True)
@@ -3,6 +3,11 @@ from ruamel.yaml import YAML
 
 from others.globals_and_utils import load_config
 
+# Parameters of the ODE which may change during a run, e.g. the pole length with change_L_every_x_second.
+# With a library other than numpy they are held in variables:
+# compiled functions read their current values instead of being retraced for every new value.
+TIME_VARYING_PARAMETERS = ['k', 'm_cart', 'm_pole', 'g', 'J_fric', 'M_fric', 'L']
+
 
 class CartPoleParameters:
     def __init__(self, lib=NumpyLibrary, get_parameters_from=None):
@@ -20,9 +25,24 @@ class CartPoleParameters:
             if key in ['k', 'm_cart', 'm_pole', 'g', 'J_fric', 'M_fric', 'L', 'v_max', 'u_max',
                        'controlDisturbance', 'controlBias', 'TrackHalfLength']:
                 value = lib.to_tensor(value, dtype=lib.float32)
+            if key in TIME_VARYING_PARAMETERS and lib is not NumpyLibrary:
+                value = lib.to_variable(value, lib.float32)
             setattr(self, key, value)
             setattr(self, 'TrackHalfLength', lib.to_tensor((parameters['track_length']-parameters['cart_length'])/2.0, dtype=lib.float32))
 
+    def set_parameters(self, **parameters):
+        """
+        Updates the given parameters in place, e.g. set_parameters(L=0.4).
+        Variables are assigned and numpy arrays overwritten, so that compiled functions see the new values without retracing.
+        """
+        for key, value in parameters.items():
+            if key not in TIME_VARYING_PARAMETERS:
+                raise ValueError(f'{key} is not a time-varying parameter, possible are {TIME_VARYING_PARAMETERS}')
+            if self.lib is NumpyLibrary:
+                getattr(self, key)[...] = value
+            else:
+                self.lib.assign(getattr(self, key), self.lib.to_tensor(value, dtype=self.lib.float32))
+
     def save_parameters(self, filepath='cartpole_parameters.yml'):
         # Convert SimpleNamespace to a dictionary
         params_dict = {param_name: getattr(self, param_name) for param_name in self.__dict__ if param_name != 'lib'}
@@ -1,37 +1,56 @@
 import numpy as np
 
-from CartPole.state_utilities import STATE_VARIABLES, \
-    ANGLE_IDX, ANGLED_IDX, POSITION_IDX, POSITIOND_IDX, ANGLE_COS_IDX, ANGLE_SIN_IDX
+from CartPole.state_utilities import STATE_VARIABLES, ANGLE_COS_IDX
 
 from tqdm import trange
 
-MAX_LATENCY_LEN = 200  # Total size of latency buffer.
+MAX_LATENCY_LEN = 200  # Initial size of latency buffer, it is enlarged if a bigger latency is set.
+
 
 class LatencyAdder():
+    """
+    Delays the state by a latency, which need not be a multiple of dt_sampling (linear interpolation in between).
+    The states are kept in a circular buffer, the position of the delayed state is found with modular arithmetic.
+
+    latency can be
+     - a single value for all state variables
+     - an array with one value per state variable (order of STATE_VARIABLES)
+     - a dict {state variable name: latency}, state variables which are not listed are not delayed
+
+    If batch_size is given the adder works on batches of states [batch_size, len(STATE_VARIABLES)].
+    """
     def __init__(self,
-                 latency: float,
+                 latency,
                  dt_sampling: float,
+                 batch_size: int = None,
                  ):
 
         self.dt_sampling = dt_sampling
         self.latency = latency
+        self.batch_size = batch_size
+
+        if batch_size is None:
+            self.state_shape = (len(STATE_VARIABLES),)
+        else:
+            self.state_shape = (batch_size, len(STATE_VARIABLES))
+
+        self.latency_buffer_len = MAX_LATENCY_LEN+2
+        self.latency_buffer = self.empty_latency_buffer(self.latency_buffer_len)
+        self.latency_buffer_current_index = 0
+
+        self.channels = np.arange(len(STATE_VARIABLES))
 
         self.latency_len = None
         self.latency_len_int = None
         self.latency_len_fraction = None
+        self.per_channel = False
         self.max_latency = None
         self.set_latency(latency)
-        self.latency_buffer_len = MAX_LATENCY_LEN+2
-        self.latency_buffer = np.zeros((self.latency_buffer_len, len(STATE_VARIABLES)))
-        self.latency_buffer[:, ANGLE_COS_IDX] = 1.0
-
-        self.latency_buffer_current_index = 0
 
-        # The below array allows for fast lookup where is the value laying a predifined
-        self.latency_buffer_lookup = np.zeros((self.latency_buffer_len, self.latency_buffer_len), dtype=np.short)
-        for i in range(self.latency_buffer_len):
-            for j in range(self.latency_buffer_len):
-                self.latency_buffer_lookup[i, j] = self.access_past_value(i, j)
+    def empty_latency_buffer(self, latency_buffer_len):
+        latency_buffer = np.zeros((latency_buffer_len,) + self.state_shape)
+        latency_buffer[..., ANGLE_COS_IDX] = 1.0
+        return latency_buffer
 
     def add_current_state_to_latency_buffer(self, s):
         """
@@ -39,51 +58,83 @@ class LatencyAdder():
         and shift the index pointing to the next position in the buffer to be filled
         (the oldest position)
         """
-        self.latency_buffer[self.latency_buffer_current_index, :] = s
+        self.latency_buffer[self.latency_buffer_current_index, ...] = s
 
-        if self.latency_buffer_current_index == self.latency_buffer_len-1:
+        self.latency_buffer_current_index += 1
+        if self.latency_buffer_current_index == self.latency_buffer_len:
             self.latency_buffer_current_index = 0
-        else:
-            self.latency_buffer_current_index += 1
 
     def access_past_value(self, latency_buffer_current_index, i):
         """
-        i gives how many steps in the past lays the requested state
+        i gives how many steps in the past lays the requested state (integer or array of integers)
         the function than returns the index in the circular buffer where this state can be found
         """
-        if i < 0:
-            raise('i must be positive!')
-
-        index = latency_buffer_current_index-1-i
-        if index < 0:
-            index += self.latency_buffer_len
-            if index < 0:
-                raise('Requested point to far in the past - not more in the buffer')
+        if np.any(np.asarray(i) < 0):
+            raise ValueError('i must be positive!')
+        if np.any(np.asarray(i) >= self.latency_buffer_len):
+            raise ValueError('Requested point to far in the past - not more in the buffer')
 
-        return index
+        return (latency_buffer_current_index-1-i) % self.latency_buffer_len
 
     def get_delayed_state(self, i):
-        return self.latency_buffer_lookup(self.latency_buffer_current_index, i)
+        return self.latency_buffer[self.access_past_value(self.latency_buffer_current_index, i), ...]
+
+    def get_interpolated_delayed_state(self, out=None):
+        index_1 = (self.latency_buffer_current_index-1-self.latency_len_int) % self.latency_buffer_len
+        index_2 = (index_1-1) % self.latency_buffer_len
+        if self.per_channel:
+            s1 = np.moveaxis(self.latency_buffer[index_1, ..., self.channels], 0, -1)
+            s2 = np.moveaxis(self.latency_buffer[index_2, ..., self.channels], 0, -1)
+        else:
+            s1 = self.latency_buffer[index_1, ...]
+            s2 = self.latency_buffer[index_2, ...]
 
-    def get_interpolated_delayed_state(self):
-        s1 = self.latency_buffer[self.latency_buffer_lookup[self.latency_buffer_current_index, self.latency_len_int], :]
-        s2 = self.latency_buffer[self.latency_buffer_lookup[self.latency_buffer_current_index, self.latency_len_int+1], :]
+        out = np.subtract(s2, s1, out=out)
+        out *= self.latency_len_fraction
+        out += s1
+        return out
 
-        return s1+self.latency_len_fraction*(s2-s1)
-            
     def set_latency(self, latency):
         self.latency = latency
-        self.latency_len = latency/self.dt_sampling
-        if self.latency_len > MAX_LATENCY_LEN:
-            raise ValueError ('Not possible to add so much latency!')
-        self.latency_len_int = int(self.latency_len)
+        if isinstance(latency, dict):
+            latency = [latency.get(name, 0.0) for name in STATE_VARIABLES]
+        self.latency_len = np.asarray(latency, dtype=np.float64)/self.dt_sampling
+        if np.any(self.latency_len < 0):
+            raise ValueError('Latency must be positive!')
+
+        self.per_channel = self.latency_len.ndim > 0
+        if self.per_channel:
+            self.latency_len = np.broadcast_to(self.latency_len, (len(STATE_VARIABLES),))
+            self.latency_len_int = self.latency_len.astype(np.int64)
+        else:
+            self.latency_len = float(self.latency_len)
+            self.latency_len_int = int(self.latency_len)
         self.latency_len_fraction = self.latency_len-self.latency_len_int
-        self.max_latency = MAX_LATENCY_LEN*self.dt_sampling
+
+        # Two points in the past are needed for interpolation
+        required_latency_buffer_len = int(np.max(self.latency_len_int))+2
+        if required_latency_buffer_len > self.latency_buffer_len:
+            self.resize_latency_buffer(required_latency_buffer_len)
+
+        self.max_latency = (self.latency_buffer_len-2)*self.dt_sampling
+
+    def resize_latency_buffer(self, new_latency_buffer_len):
+        """
+        Enlarges the circular buffer keeping the stored history.
+        The oldest states are at the beginning of the new buffer, the newest at its end,
+        the additional older places are filled as at initialization.
+        """
+        latency_buffer_chronological = np.roll(self.latency_buffer, -self.latency_buffer_current_index, axis=0)
+        self.latency_buffer = self.empty_latency_buffer(new_latency_buffer_len)
+        self.latency_buffer[new_latency_buffer_len-self.latency_buffer_len:, ...] = latency_buffer_chronological
+        self.latency_buffer_len = new_latency_buffer_len
+        self.latency_buffer_current_index = 0
+
 
 if __name__ == '__main__':
     from CartPole.state_utilities import create_cartpole_state
 
-    LatencyAdderInstance = LatencyAdder()
+    LatencyAdderInstance = LatencyAdder(latency=0.0, dt_sampling=0.002)
     s = create_cartpole_state()
 
     LatencyAdderInstance.set_latency(0.01)
@@ -100,3 +151,17 @@ if __name__ == '__main__':
         print(s_delayed)
         s+=1
 
+    LatencyAdderInstance.set_latency({'angle': 0.006, 'angle_cos': 0.006, 'angle_sin': 0.006})
+    for i in trange(10):
+        LatencyAdderInstance.add_current_state_to_latency_buffer(s)
+        s_delayed = LatencyAdderInstance.get_interpolated_delayed_state()
+        print(s_delayed)
+        s+=1
+
+    BatchedLatencyAdderInstance = LatencyAdder(latency=0.005, dt_sampling=0.002, batch_size=4)
+    s_batch = np.tile(create_cartpole_state(), (4, 1))
+    for i in trange(10):
+        BatchedLatencyAdderInstance.add_current_state_to_latency_buffer(s_batch)
+        s_delayed = BatchedLatencyAdderInstance.get_interpolated_delayed_state()
+        print(s_delayed)
+        s_batch += 1
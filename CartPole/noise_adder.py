@@ -1,8 +1,9 @@
 import numpy as np
 from others.globals_and_utils import create_rng, load_config
+from scipy.signal import lfilter
 from tqdm import trange
 
-from CartPole._CartPole_mathematical_helpers import wrap_angle_rad
+from CartPole._CartPole_mathematical_helpers import wrap_angle_rad, wrap_angle_rad_inplace
 from CartPole.state_utilities import (ANGLE_COS_IDX, ANGLE_IDX, ANGLE_SIN_IDX,
                                       ANGLED_IDX, POSITION_IDX, POSITIOND_IDX)
 
@@ -48,8 +49,29 @@ sigma_positionD = config["cartpole"]["noise"]["sigma_positionD"]
 
 NOISE_MODE = config["cartpole"]["noise"]["noise_mode"]
 
+NOISE_BLOCK_SIZE = 10000  # Number of time steps for which the noise is drawn at once
+
+# Measurement noise is added to these state variables, the sigmas and smoothing factors follow the same order
+NOISE_INDICES = np.array([ANGLE_IDX, POSITION_IDX, ANGLED_IDX, POSITIOND_IDX])
+NOISE_SMOOTHING = np.array([angle_smoothing, position_smoothing, angle_smoothing, position_smoothing])
+
+
 class NoiseAdder:
-    def __init__(self):
+    """
+    Adds measurement noise to the cartpole state.
+
+    noise_mode:
+     - 'OFF' - no noise
+     - 'ON' - white gaussian noise
+     - 'IIR' - colored noise, white noise smoothed with the IIR filter y_k = a*x_k + (1-a)*y_(k-1)
+               with the smoothing factors a from the top of this file;
+               the std of the input is scaled with _noise_iir_factor so that the output has the std set in config
+
+    The noise is drawn from the rng in blocks of NOISE_BLOCK_SIZE time steps with unit variance
+    and scaled with the current sigmas when added, so the sigmas can be changed on the fly (e.g. from GUI).
+    If batch_size is given the noise is added to batches of states [batch_size, 6], each state with independent noise.
+    """
+    def __init__(self, batch_size=None, noise_block_size=NOISE_BLOCK_SIZE):
 
         global sigma_angle, sigma_position, sigma_angleD, sigma_positionD
 
@@ -59,7 +81,62 @@ class NoiseAdder:
 
         self.sigma_Q = sigma_Q
 
-    def add_noise_to_measurement(self, s, copy=True):
+        self.batch_size = batch_size
+        if batch_size is None:
+            self.batch_shape = ()
+        else:
+            self.batch_shape = (batch_size,)
+
+        self.noise_block_size = noise_block_size
+        self.noise_block = None
+        self.noise_block_mode = None
+        self.noise_block_index = 0
+        self.iir_state = np.zeros((1,) + self.batch_shape + (len(NOISE_INDICES),), dtype=np.float32)
+
+        self.random_signs_block = None
+        self.random_signs_block_index = 0
+
+        self.sigmas = np.zeros(len(NOISE_INDICES), dtype=np.float32)
+
+    def generate_noise_block(self):
+        """Draws unit variance noise for the next noise_block_size time steps, filtered if noise_mode is 'IIR'."""
+        self.noise_block = self.rng_noise_adder.standard_normal(
+            size=(self.noise_block_size,) + self.batch_shape + (len(NOISE_INDICES),), dtype=np.float32)
+
+        if self.noise_mode == 'IIR':
+            if self.noise_block_mode != 'IIR':
+                self.iir_state[...] = 0.0
+            for i, a in enumerate(NOISE_SMOOTHING):
+                if a == 1.0:
+                    continue
+                self.noise_block[..., i], self.iir_state[..., i] = lfilter(
+                    [a], [1.0, a - 1.0],
+                    self.noise_block[..., i] / _noise_iir_factor(a),
+                    axis=0, zi=self.iir_state[..., i])
+
+        self.noise_block_mode = self.noise_mode
+        self.noise_block_index = 0
+
+    def get_noise_sample(self):
+        if self.noise_block is None or self.noise_block_index == self.noise_block_size or self.noise_block_mode != self.noise_mode:
+            self.generate_noise_block()
+        noise_sample = self.noise_block[self.noise_block_index]
+        self.noise_block_index += 1
+        return noise_sample
+
+    def get_random_sign(self):
+        """Returns +1.0 or -1.0 with equal probability, drawn from a pregenerated block."""
+        if self.random_signs_block is None or self.random_signs_block_index == self.noise_block_size:
+            self.random_signs_block = 2.0 * self.rng_noise_adder.integers(0, 2, size=self.noise_block_size) - 1.0
+            self.random_signs_block_index = 0
+        random_sign = self.random_signs_block[self.random_signs_block_index]
+        self.random_signs_block_index += 1
+        return random_sign
+
+    def add_noise_to_measurement(self, s, copy=True, update_cos_sin=True):
+        """
+        update_cos_sin can be set to False if angle_cos and angle_sin are anyway recalculated afterwards
+        """
 
         if copy == True:
             s_noisy = np.copy(s)
@@ -69,17 +146,19 @@ class NoiseAdder:
         if self.noise_mode == 'OFF':
             pass
         else:
-            s_noisy[ANGLE_IDX] += sigma_angle * self.rng_noise_adder.standard_normal(dtype=np.float32)
-            s_noisy[ANGLE_IDX] = wrap_angle_rad(s_noisy[ANGLE_IDX])
+            self.sigmas[0], self.sigmas[1], self.sigmas[2], self.sigmas[3] = \
+                sigma_angle, sigma_position, sigma_angleD, sigma_positionD
 
-            s_noisy[ANGLE_COS_IDX] = np.cos(s_noisy[ANGLE_IDX])
-            s_noisy[ANGLE_SIN_IDX] = np.sin(s_noisy[ANGLE_IDX])
+            s_noisy[..., NOISE_INDICES] += self.sigmas * self.get_noise_sample()
 
-            s_noisy[POSITION_IDX] += sigma_position * self.rng_noise_adder.standard_normal(dtype=np.float32)
+            if self.batch_size is None:
+                s_noisy[ANGLE_IDX] = wrap_angle_rad(s_noisy[ANGLE_IDX])
+            else:
+                wrap_angle_rad_inplace(s_noisy[:, ANGLE_IDX])
 
-
-            s_noisy[ANGLED_IDX] += sigma_angleD * self.rng_noise_adder.standard_normal(dtype=np.float32)
-            s_noisy[POSITIOND_IDX] += sigma_positionD * self.rng_noise_adder.standard_normal(dtype=np.float32)
+            if update_cos_sin:
+                s_noisy[..., ANGLE_COS_IDX] = np.cos(s_noisy[..., ANGLE_IDX])
+                s_noisy[..., ANGLE_SIN_IDX] = np.sin(s_noisy[..., ANGLE_IDX])
 
         return s_noisy
 
@@ -97,3 +176,11 @@ if __name__ == '__main__':
         s_noisy = NoiseAdderInstance.add_noise_to_measurement(s)
         print(s_noisy)
         s += 1
+
+    BatchedNoiseAdderInstance = NoiseAdder(batch_size=4)
+    BatchedNoiseAdderInstance.noise_mode = 'IIR'
+    s_batch = np.tile(create_cartpole_state(), (4, 1))
+    for i in trange(10):
+        s_noisy = BatchedNoiseAdderInstance.add_noise_to_measurement(s_batch)
+        print(s_noisy)
+        s_batch += 1
@@ -0,0 +1,139 @@
+"""
+Quantization of the measured cartpole state, emulating the resolution of the physical sensors.
+The position is measured with a motor encoder, the angle with an ADC (potentiometer).
+Derivatives are calculated from these measurements over measurement_interval,
+hence their smallest measurable step is the sensor precision divided by this interval.
+
+The same vectorized quantization is used
+ - offline, to quantize already recorded datasets (see others/quantise_dataset.py)
+ - online, as a sensor stage of the simulated CartPole, next to NoiseAdder and LatencyAdder
+Applying it online during data generation makes the offline dataset pass unnecessary.
+"""
+
+import zlib
+
+import numpy as np
+from others.globals_and_utils import create_rng, load_config
+from tqdm import trange
+
+from CartPole.cartpole_parameters import TrackHalfLength
+from CartPole.state_utilities import (ANGLE_COS_IDX, ANGLE_IDX, ANGLE_SIN_IDX,
+                                      ANGLED_IDX, POSITION_IDX, POSITIOND_IDX)
+
+config = load_config("cartpole_physical_parameters.yml")
+config_quantization = config["cartpole"]["quantization"]
+
+QUANTIZATION_MODE = config_quantization["quantization_mode"]
+add_noise = config_quantization["add_noise"]  # +/- quantised units
+
+measurement_interval = config_quantization["measurement_interval"]  # s
+encoder_precision = 2 * float(TrackHalfLength) / config_quantization["encoder_steps"]
+ADC_precision = 1.0 / config_quantization["ADC_steps"]
+
+features_precision_dict = {
+    'angle': ADC_precision,
+    'angleD': ADC_precision / measurement_interval,
+    'position': encoder_precision,
+    'positionD': encoder_precision / measurement_interval,
+}
+
+features_indices_dict = {
+    'angle': ANGLE_IDX,
+    'angleD': ANGLED_IDX,
+    'position': POSITION_IDX,
+    'positionD': POSITIOND_IDX,
+}
+
+
+def quantize(values, quantization_value, rng=None, add_noise=0, out=None):
+    """
+    Rounds values to the nearest multiple of quantization_value
+    and optionally shifts each element by a random integer number of quantization steps in [-add_noise, add_noise].
+    Works on arrays of any shape at once; if out is given, the result is written into it.
+    """
+    out = np.divide(values, quantization_value, out=out)
+    np.rint(out, out=out)
+    if add_noise > 0:
+        out += rng.integers(-add_noise, add_noise + 1, size=np.shape(out))
+    out *= quantization_value
+    return out
+
+
+def derived_seed(seed, key):
+    """Derives a reproducible seed from the global seed and a key, e.g. a file path or the name of a random stream."""
+    if seed is None:
+        return None
+    return (int(seed) + zlib.crc32(str(key).encode())) % (2 ** 32)
+
+
+def seed_for_file(path, seed):
+    """Derives a reproducible seed for a single file from the global seed and the file path."""
+    return derived_seed(seed, path)
+
+
+class SensorQuantizer:
+    def __init__(self, seed=None, add_noise=add_noise, features_precision=None):
+
+        if seed is None:
+            seed = config["cartpole"]["seed"]
+        # Own stream, not correlated with the other random generators seeded with the same global seed
+        self.rng_quantizer = create_rng(self.__class__.__name__, derived_seed(seed, self.__class__.__name__))
+
+        self.quantization_mode = QUANTIZATION_MODE
+        self.add_noise = add_noise
+
+        if features_precision is None:
+            features_precision = features_precision_dict
+        self.features_precision = features_precision
+
+        self.state_indices = np.array([features_indices_dict[key] for key in self.features_precision], dtype=np.int64)
+        self.state_precisions = np.array([self.features_precision[key] for key in self.features_precision], dtype=np.float32)
+        self.quantize_angle = 'angle' in self.features_precision
+
+    def quantize_measurement(self, s, copy=True):
+        """Quantizes a single state or a batch of states [..., 6]; angle_cos and angle_sin follow the quantized angle."""
+
+        if copy == True:
+            s_quantized = np.copy(s)
+        else:
+            s_quantized = s
+
+        if self.quantization_mode == 'OFF':
+            pass
+        else:
+            s_quantized[..., self.state_indices] = quantize(s_quantized[..., self.state_indices], self.state_precisions,
+                                                            rng=self.rng_quantizer, add_noise=self.add_noise)
+            if self.quantize_angle:
+                s_quantized[..., ANGLE_COS_IDX] = np.cos(s_quantized[..., ANGLE_IDX])
+                s_quantized[..., ANGLE_SIN_IDX] = np.sin(s_quantized[..., ANGLE_IDX])
+
+        return s_quantized
+
+    def quantize_dataframe(self, df):
+        """
+        Quantizes in place all columns of the dataframe for which the precision is known.
+        As in quantize_measurement, angle_cos and angle_sin follow the quantized angle.
+        """
+        for key, quantization_value in self.features_precision.items():
+            if key in df.columns:
+                df[key] = quantize(df[key].to_numpy(dtype=np.float64), quantization_value,
+                                   rng=self.rng_quantizer, add_noise=self.add_noise)
+        if self.quantize_angle and 'angle' in df.columns:
+            if 'angle_cos' in df.columns:
+                df['angle_cos'] = np.cos(df['angle'].to_numpy())
+            if 'angle_sin' in df.columns:
+                df['angle_sin'] = np.sin(df['angle'].to_numpy())
+        return df
+
+
+if __name__ == '__main__':
+    from CartPole.state_utilities import create_cartpole_state
+
+    SensorQuantizerInstance = SensorQuantizer()
+    SensorQuantizerInstance.quantization_mode = 'ON'
+    s = create_cartpole_state()
+
+    for i in trange(10):
+        s_quantized = SensorQuantizerInstance.quantize_measurement(s)
+        print(s_quantized)
+        s += 0.0123
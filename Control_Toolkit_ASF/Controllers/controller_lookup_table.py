@@ -0,0 +1,113 @@
+"""
+Explicit controller answering each step from a table of control inputs precomputed on a state grid.
+
+The table holds Q on a regular grid over (position - target_position, positionD, angle, angleD)
+and is created offline by run_lookup_table_generator.py from any controller, typically MPPI.
+A step is a multilinear interpolation between the 16 surrounding grid points and costs microseconds.
+Outside the grid a fallback controller (e.g. LQR) is used if specified, otherwise the state is clipped to the grid.
+"""
+
+import os
+
+import numpy as np
+from numba import jit
+
+from CartPole._CartPole_mathematical_helpers import wrap_angle_rad
+from CartPole.state_utilities import ANGLE_IDX, ANGLED_IDX, POSITION_IDX, POSITIOND_IDX
+from Control_Toolkit.Controllers import template_controller
+from SI_Toolkit.computation_library import NumpyLibrary, TensorType
+
+
+def load_lookup_table(path):
+    """Returns (table of Q, lower grid bounds, grid steps) of a table saved by run_lookup_table_generator.py"""
+    if not os.path.isfile(path):
+        raise FileNotFoundError('No lookup table at {}, create it first with: python run_lookup_table_generator.py '
+                                '(grid and source controller in the lookup-table section of config_controllers.yml)'
+                                .format(path))
+    data = np.load(path)
+    lower, upper = data['lower'].astype(np.float64), data['upper'].astype(np.float64)
+    table = data['table'].astype(np.float32)  # Stored compactly as float16
+    step = (upper - lower) / (np.array(table.shape) - 1)
+    return table, lower, step
+
+
+@jit(nopython=True, nogil=True, cache=True, fastmath=True)
+def multilinear_interpolation(table, lower, step, x):
+    """Multilinear interpolation in the 4-dimensional table with grid points lower + i * step.
+    Coordinates outside the grid are clipped to it.
+
+    :return: Interpolated value and whether x lies inside the grid
+    """
+    inside = True
+    idx = np.empty(4, dtype=np.int64)
+    frac = np.empty(4, dtype=np.float64)
+    for d in range(4):
+        t = (x[d] - lower[d]) / step[d]
+        n = table.shape[d] - 1
+        if t < 0.0:
+            t = 0.0
+            inside = False
+        elif t > n:
+            t = n
+            inside = False
+        i = min(int(t), n - 1)
+        idx[d] = i
+        frac[d] = t - i
+
+    value = 0.0
+    for corner in range(16):
+        weight = 1.0
+        i = np.empty(4, dtype=np.int64)
+        for d in range(4):
+            if (corner >> d) & 1:
+                weight *= frac[d]
+                i[d] = idx[d] + 1
+            else:
+                weight *= 1.0 - frac[d]
+                i[d] = idx[d]
+        value += weight * table[i[0], i[1], i[2], i[3]]
+    return value, inside
+
+
+class controller_lookup_table(template_controller):
+    _computation_library = NumpyLibrary
+
+    def __init__(self, *args, **kwargs):
+        self.init_arguments = (args, kwargs)  # To create the fallback controller for the same environment
+        super().__init__(*args, **kwargs)
+
+    def configure(self):
+        self.table, self.lower, self.step_size = load_lookup_table(self.config_controller["table_path"])
+        self.coordinates = np.zeros(4, dtype=np.float64)
+
+        fallback_name = self.config_controller["fallback_controller"]
+        if fallback_name:
+            from Control_Toolkit.others.globals_and_utils import import_controller_by_name
+
+            args, kwargs = self.init_arguments
+            self.fallback_controller = import_controller_by_name(fallback_name)(*args, **kwargs)
+            self.fallback_controller.configure()
+        else:
+            self.fallback_controller = None
+
+        self.controller_data_for_csv = {'lookup_table_fallback': [0]}
+
+    def step(self, s: np.ndarray, time=None, updated_attributes: "dict[str, TensorType]" = {}):
+        self.update_attributes(updated_attributes)
+
+        self.coordinates[0] = s[POSITION_IDX] - self.variable_parameters.target_position
+        self.coordinates[1] = s[POSITIOND_IDX]
+        self.coordinates[2] = wrap_angle_rad(s[ANGLE_IDX])
+        self.coordinates[3] = s[ANGLED_IDX]
+
+        Q, inside = multilinear_interpolation(self.table, self.lower, self.step_size, self.coordinates)
+
+        if not inside and self.fallback_controller is not None:
+            Q = self.fallback_controller.step(s, time, updated_attributes)
+        self.controller_data_for_csv['lookup_table_fallback'] = [int(not inside and self.fallback_controller is not None)]
+
+        return np.clip(np.float32(Q), -1.0, 1.0)
+
+    def controller_reset(self):
+        if self.fallback_controller is not None:
+            self.fallback_controller.controller_reset()
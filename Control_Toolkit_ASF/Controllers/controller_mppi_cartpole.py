@@ -11,319 +11,345 @@ Based on Williams, Aldrich, Theodorou (2015)
 
 
 import os
+import warnings
 from datetime import datetime
+from time import perf_counter
 from SI_Toolkit.computation_library import NumpyLibrary, TensorType
 
 import matplotlib.pyplot as plt
 import numpy as np
-import yaml
-from CartPole._CartPole_mathematical_helpers import wrap_angle_rad_inplace
+from CartPole._CartPole_mathematical_helpers import wrap_angle_rad_inplace, wrap_angle_rad_numba
+from CartPole.cartpole_equations import (_cartpole_ode_numba, cartpole_integration_numba,
+                                         edge_bounce_numba)
 
 from CartPole.state_utilities import (ANGLE_IDX, ANGLED_IDX, POSITION_IDX,
                                       POSITIOND_IDX, STATE_INDICES,
                                       create_cartpole_state)
 from Control_Toolkit.Controllers import template_controller
 from matplotlib.widgets import Slider
-from numba import jit
+from numba import jit, prange
 from numpy.random import SFC64, Generator
-from CartPole.cartpole_parameters import TrackHalfLength
-from scipy.interpolate import interp1d
-from SI_Toolkit.Predictors.predictor_ODE import predictor_ODE
-from SI_Toolkit.Predictors.predictor_wrapper import PredictorWrapper
+from CartPole.cartpole_parameters import CartPoleParameters, TrackHalfLength
+from others.globals_and_utils import load_config
+from others.streaming_logger import StreamingLogger
+from others.trajectory_library import TrajectoryLibrary, library_features
 
 # from SI_Toolkit.Predictors.predictor_autoregressive_GP import predictor_autoregressive_GP
 # from SI_Toolkit.Predictors.predictor_autoregressive_tf_Jerome import predictor_autoregressive_tf
 
 
-config = yaml.load(open("cartpole_physical_parameters.yml", "r"), Loader=yaml.FullLoader)
-config_data_gen = yaml.load(open("config_data_gen.yml", "r"), Loader=yaml.FullLoader)
-config_controller = yaml.load(open(os.path.join("Control_Toolkit_ASF", "config_controllers.yml"), "r"), Loader=yaml.FullLoader)
-config_mppi_cartpole = config_controller["mppi-cartpole"]
-
-"""Timestep and sampling settings"""
-mpc_horizon = config_mppi_cartpole["mpc_horizon"]
-num_rollouts = config_mppi_cartpole["num_rollouts"]
-update_every = config_mppi_cartpole["update_every"]
-predictor_specification = config_mppi_cartpole["predictor_specification"]
-dt = config_data_gen["dt"]["control"]
-
-"""Define Predictor"""
-predictor = PredictorWrapper()
-predictor.configure(batch_size=num_rollouts, horizon=mpc_horizon, dt=dt, predictor_specification=predictor_specification)
-
-if predictor.predictor_config['predictor_type'] == 'neural':
-    MODEL_NAME = predictor.predictor_config['model_name']
-    try:
-        NET_TYPE = MODEL_NAME.split("-")[0]
-    except AttributeError:  # Should get Attribute Error if NET_NAME is None
-        NET_TYPE = None
-else:
-    NET_TYPE = None
-
-predictor_ground_truth = predictor_ODE(
-    horizon=mpc_horizon, dt=dt, intermediate_steps=10
-)
-
-
-WASH_OUT_LEN = config_mppi_cartpole["WASH_OUT_LEN"]
-
-"""Parameters weighting the different cost components"""
-dd_weight = config_mppi_cartpole["dd_weight"]
-ep_weight = config_mppi_cartpole["ep_weight"]
-ekp_weight = config_mppi_cartpole["ekp_weight"]
-ekc_weight = config_mppi_cartpole["ekc_weight"]
-cc_weight = config_mppi_cartpole["cc_weight"]
-ccrc_weight = config_mppi_cartpole["ccrc_weight"]
-
-"""Perturbation factor"""
-p_Q = config["cartpole"]["actuator_noise"]
-dd_noise = ep_noise = ekp_noise = ekc_noise = cc_noise = config_mppi_cartpole[
-    "cost_noise"
-]
-
-gui_dd = gui_ep = gui_ekp = gui_ekc = gui_cc = gui_ccrc = np.zeros(1, dtype=np.float32)
-
-
-"""MPPI constants"""
-R = config_mppi_cartpole["R"]
-LBD = config_mppi_cartpole["LBD"]
-NU = config_mppi_cartpole["NU"]
-SQRTRHODTINV = config_mppi_cartpole["SQRTRHOINV"] * (1 / np.sqrt(dt))
-SAMPLING_TYPE = config_mppi_cartpole["SAMPLING_TYPE"]
-
-
-"""Init logging variables"""
-LOGGING = config_mppi_cartpole["controller_logging"]
-# Save average cost for each cost component
-LOGS = {
-    "cost_to_go": [],
-    "cost_breakdown": {
-        "cost_dd": [],
-        "cost_ep": [],
-        "cost_ekp": [],
-        "cost_ekc": [],
-        "cost_cc": [],
-        "cost_ccrc": [],
-    },
-    "states": [],
-    "trajectory": [],
-    "target_trajectory": [],
-    "inputs": [],
-    "nominal_rollouts": [],
-}
+"""
+Settings are read from the "mppi-cartpole" section of config_controllers.yml when a controller instance is configured,
+the predictor is created (and imported) only at its first step. Importing this module hence builds no predictor,
+and several instances with different settings can coexist.
+The functions below are pure and get all settings as arguments.
+"""
+
+INTERPOLATION_STEP = 10  # For "interpolated" sampling: a new independent perturbation every ... horizon steps
 
 
 """Cost function helpers"""
 
+TRACK_HALF_LENGTH = float(TrackHalfLength)  # Plain float, to be used as a constant in compiled functions
+CONTROL_CONSTRAINT_VIOLATION_COST = 1.0e5  # Replaces the (unweighted) control cost of inputs outside [-1, 1]
 
-@jit(nopython=True, cache=True, fastmath=True)
+
+@jit(nopython=True, nogil=True, cache=True, fastmath=True)
 def E_kin_cart(positionD):
     """Compute penalty for kinetic energy of cart"""
     return positionD ** 2
 
 
-@jit(nopython=True, cache=True, fastmath=True)
+@jit(nopython=True, nogil=True, cache=True, fastmath=True)
 def E_kin_pol(angleD):
     """Compute penalty for kinetic energy of pole"""
     return angleD ** 2
 
 
-@jit(nopython=True, cache=True, fastmath=True)
+@jit(nopython=True, nogil=True, cache=True, fastmath=True)
 def E_pot_cost(angle):
     """Compute penalty for not balancing pole upright (penalize large angles)"""
     return 0.25 * (1.0 - np.cos(angle)) ** 2
     # return angle ** 2
 
 
-@jit(nopython=True, cache=True, fastmath=True)
+@jit(nopython=True, nogil=True, cache=True, fastmath=True)
 def distance_difference_cost(position, target_position):
     """Compute penalty for distance of cart to the target position"""
-    return ((position - target_position) / (2.0 * TrackHalfLength)) ** 2 + (
-        np.abs(position) > 0.95 * TrackHalfLength
+    return ((position - target_position) / (2.0 * TRACK_HALF_LENGTH)) ** 2 + (
+        np.abs(position) > 0.95 * TRACK_HALF_LENGTH
     ) * 1.0e6  # Soft constraint: Do not crash into border
 
 
-@jit(nopython=True, cache=True, fastmath=True)
+@jit(nopython=True, nogil=True, cache=True, fastmath=True)
 def control_change_rate_cost(u, u_prev):
     """Compute penalty of control jerk, i.e. difference to previous control input"""
     return (u - u_prev) ** 2
 
 
-@jit(nopython=True, cache=True, fastmath=True)
-def penalize_deviation(cc, u):
-    """Compute penalty for producing inputs that do not fulfil input constraints"""
-    # Penalize if control deviation is outside constraint set.
-    I, J = cc.shape
-    for i in range(I):
-        for j in range(J):
-            if np.abs(u[i, j]) > 1.0:
-                cc[i, j] = 1.0e5
-    return cc
+@jit(nopython=True, nogil=True, cache=True, fastmath=True)
+def control_cost(u, delta_u, R, NU):
+    """Compute the MPPI control cost of a perturbed input u + delta_u"""
+    return 0.5 * (1 - 1.0 / NU) * R * (delta_u ** 2) + R * u * delta_u + 0.5 * R * (u ** 2)
 
 
-def trajectory_rollouts(
-    s: np.ndarray,
-    S_tilde_k: np.ndarray,
-    u: np.ndarray,
-    delta_u: np.ndarray,
-    u_prev: np.ndarray,
-    target_position: np.float32,
-):
-    """Sample thousands of rollouts using system model. Compute cost-weighted control update. Log states and costs if specified.
+@jit(nopython=True, nogil=True, cache=True, fastmath=True)
+def phi(angle, position, target_position):
+    """Calculate terminal cost of a trajectory from its terminal state
 
-    :param s: Current state of the system
-    :type s: np.ndarray
-    :param S_tilde_k: Placeholder array to store the cost of each rollout trajectory
-    :type S_tile_k: np.ndarray
-    :param u: Vector of nominal inputs computed in previous iteration
-    :type u: np.ndarray
-    :param delta_u: Array containing all input perturbation samples. Shape (num_rollouts x horizon_steps)
-    :type delta_u: np.ndarray
-    :param u_prev: Array with nominal inputs from previous iteration. Used to compute cost of control change
-    :type u_prev: np.ndarray
-    :param target_position: Target position where the cart should move to
+    Williams et al use an indicator function type of terminal cost in
+    "Information theoretic MPC for model-based reinforcement learning"
+
+    TODO: Try a quadratic terminal cost => Use the LQR terminal cost term obtained
+    by linearizing the system around the unstable equilibrium.
+
+    :param angle: Terminal angle of the rollout
+    :param position: Terminal position of the rollout
+    :param target_position: Target position to move the cart to
     :type target_position: np.float32
+    :return: Terminal cost of the rollout
+    """
+    if np.abs(angle) > 0.2 or np.abs(position - target_position) > 0.1 * TRACK_HALF_LENGTH:
+        return 10000.0
+    return 0.0
 
-    :return: S_tilde_k - Array filled with a cost for each rollout trajectory
+
+@jit(nopython=True, nogil=True, cache=True, fastmath=True)
+def stage_cost(
+    angle, angleD, position, positionD,
+    u, delta_u, u_prev, target_position,
+    weights, R, NU, step_weight,
+    cost_breakdown, j, compute_breakdown,
+):
+    """Stage cost of one rollout at horizon step j. The weighted components are added to cost_breakdown[:, j] if compute_breakdown.
+
+    :param weights: Weights of the cost components [dd, ep, ekp, ekc, cc, ccrc]
+    :param step_weight: Duration of horizon step j in units of dt, all components are scaled by it
+    :return: Summed stage cost
     """
-    initial_state = np.tile(s, (num_rollouts, 1))
-
-    s_horizon = predictor.predict(initial_state, (u + delta_u)[..., np.newaxis])[:, :, : len(STATE_INDICES)]
-
-    # Compute stage costs
-    cost_increment, dd, ep, ekp, ekc, cc, ccrc = q(
-        s_horizon[:, :-1, :], u, delta_u, u_prev, target_position
-    )
-    S_tilde_k = np.sum(cost_increment, axis=1)
-    # Compute terminal cost
-    S_tilde_k += phi(s_horizon, target_position)
-
-    # Pass costs to GUI popup window
-    global gui_dd, gui_ep, gui_ekp, gui_ekc, gui_cc, gui_ccrc
-    gui_dd, gui_ep, gui_ekp, gui_ekc, gui_cc, gui_ccrc = (
-        np.mean(dd),
-        np.mean(ep),
-        np.mean(ekp),
-        np.mean(ekc),
-        np.mean(cc),
-        np.mean(ccrc),
-    )
-
-    if LOGGING:
-        LOGS.get("cost_breakdown").get("cost_dd").append(np.mean(dd, 0))
-        LOGS.get("cost_breakdown").get("cost_ep").append(np.mean(ep, 0))
-        LOGS.get("cost_breakdown").get("cost_ekp").append(np.mean(ekp, 0))
-        LOGS.get("cost_breakdown").get("cost_ekc").append(np.mean(ekc, 0))
-        LOGS.get("cost_breakdown").get("cost_cc").append(np.mean(cc, 0))
-        LOGS.get("cost_breakdown").get("cost_ccrc").append(np.mean(ccrc, 0))
-        # (1 x mpc_horizon)
-        LOGS.get("states").append(
-            np.copy(s_horizon[:, :-1, :])
-        )  # num_rollouts x mpc_horizon x STATE_VARIABLES
-
-    return S_tilde_k
-
-
-def q(
-    s: np.ndarray,
+    dd = step_weight * weights[0] * distance_difference_cost(position, target_position)
+    ep = step_weight * weights[1] * E_pot_cost(angle)
+    ekp = step_weight * weights[2] * E_kin_pol(angleD)
+    ekc = step_weight * weights[3] * E_kin_cart(positionD)
+    if np.abs(u + delta_u) > 1.0:
+        # Penalize if control deviation is outside constraint set.
+        cc = CONTROL_CONSTRAINT_VIOLATION_COST
+    else:
+        cc = step_weight * weights[4] * control_cost(u, delta_u, R, NU)
+    ccrc = step_weight * weights[5] * control_change_rate_cost(u + delta_u, u_prev)
+
+    if compute_breakdown:
+        cost_breakdown[0, j] += dd
+        cost_breakdown[1, j] += ep
+        cost_breakdown[2, j] += ekp
+        cost_breakdown[3, j] += ekc
+        cost_breakdown[4, j] += cc
+        cost_breakdown[5, j] += ccrc
+
+    return dd + ep + ekp + ekc + cc + ccrc
+
+
+@jit(nopython=True, nogil=True, cache=True, fastmath=True)
+def reduce_cost_breakdown(cost_breakdown_chunks, cost_breakdown, num_rollouts):
+    """Sum the cost components of all chunks in a fixed order and average them over the rollouts"""
+    cost_breakdown[...] = 0.0
+    for c in range(cost_breakdown_chunks.shape[0]):
+        cost_breakdown += cost_breakdown_chunks[c]
+    cost_breakdown /= num_rollouts
+
+
+@jit(nopython=True, nogil=True, cache=True, fastmath=True)
+def rollout_is_dead(cost, position, termination_cost, termination_position):
+    """Early termination: a rollout is dead once its cost so far exceeds termination_cost
+    or its cart gets further than termination_position from the center. np.inf disables a criterion."""
+    return cost > termination_cost or np.abs(position) > termination_position
+
+
+@jit(nopython=True, nogil=True, cache=True, fastmath=True)
+def dead_rollout_cost(last_stage_cost, step_multipliers, j):
+    """Cost charged for the steps after j to a rollout which died at step j.
+    Its state is frozen, so instead of evaluating the remaining stage costs
+    the stage cost of step j is charged for each of them in proportion to their duration."""
+    return last_stage_cost * np.sum(step_multipliers[j + 1:]) / step_multipliers[j]
+
+
+def _rollout_costs(
+    s_horizon: np.ndarray,
     u: np.ndarray,
     delta_u: np.ndarray,
     u_prev: np.ndarray,
-    target_position: np.float32,
-) -> np.ndarray:
-    """Stage cost function, i.e. the cost for a particular timestep.
-    Computes stage-cost elementwise for all rollouts and all trajectory steps at once.
-
-    :param s: Current states of all rollouts
-    :type s: np.ndarray
-    :param u: Vector of nominal inputs
-    :type u: np.ndarray
-    :param delta_u: Array of perturbations
-    :type delta_u: np.ndarray
-    :param u_prev: Vector of nominal inputs of previous iteration
-    :type u_prev: np.ndarray
-    :param target_position: Target position where the cart should move to
-    :type target_position: np.float32
-    :return:
-        - q - Summed stage cost
-        - dd - Distance difference cost
-        - ep - Cost to keep pole upright
-        - ekp - Cost of pole kinetic energy
-        - ekc - Cost of cart kinetic energy
-        - cc - Control cost
-        - ccrc - Control change rate cost
+    target_position: float,
+    weights: np.ndarray,
+    R: float,
+    NU: float,
+    step_multipliers: np.ndarray,
+    termination_cost: float,
+    termination_position: float,
+    S_tilde_k: np.ndarray,
+    cost_breakdown: np.ndarray,
+    cost_breakdown_chunks: np.ndarray,
+    chunk_size: int,
+):
+    """Compute the cost of each rollout in place, without allocating temporary arrays.
+    The rollouts are split into chunks of chunk_size, evaluated in parallel in the parallel compiled version.
+    The result does not depend on whether the chunks are evaluated in parallel.
+    Dead rollouts (see rollout_is_dead) are charged dead_rollout_cost and the terminal cost at the state they died in,
+    their remaining stage costs are not evaluated and not included in cost_breakdown.
+
+    :param s_horizon: States of all rollouts, shape (num_rollouts x (mpc_horizon + 1) x STATE_VARIABLES)
+    :param weights: Weights of the cost components [dd, ep, ekp, ekc, cc, ccrc]
+    :param step_multipliers: Duration of each horizon step in units of dt, weighting its stage cost
+    :param S_tilde_k: Output array, filled with the total cost (stage + terminal) of each rollout
+    :param cost_breakdown: Output array (6 x mpc_horizon), filled with the average of each weighted cost component
+        over all rollouts at each horizon step, in the order of weights
+    :param cost_breakdown_chunks: Work array (num_chunks x 6 x mpc_horizon) for the cost components summed in each chunk
     """
-    dd = dd_weight * distance_difference_cost(
-        s[:, :, POSITION_IDX], target_position
-    ).astype(np.float32)
-    ep = ep_weight * E_pot_cost(s[:, :, ANGLE_IDX]).astype(np.float32)
-    ekp = ekp_weight * E_kin_pol(s[:, :, ANGLED_IDX]).astype(np.float32)
-    ekc = ekc_weight * E_kin_cart(s[:, :, POSITIOND_IDX]).astype(np.float32)
-    cc = cc_weight * (
-        0.5 * (1 - 1.0 / NU) * R * (delta_u ** 2) + R * u * delta_u + 0.5 * R * (u ** 2)
-    )
-    ccrc = ccrc_weight * control_change_rate_cost(u + delta_u, u_prev).astype(
-        np.float32
-    )
-    # rterm = 1.0e4 * np.sum((delta_u[:,1:] - delta_u[:,:-1]) ** 2, axis=1, keepdims=True)
-
-    # Penalize if control deviation is outside constraint set.
-    cc[np.abs(u + delta_u) > 1.0] = 1.0e5
-
-    q = dd + ep + ekp + ekc + cc + ccrc
-
-    return q, dd, ep, ekp, ekc, cc, ccrc
-
+    num_rollouts, horizon = delta_u.shape
+    for c in prange(cost_breakdown_chunks.shape[0]):
+        cost_breakdown_chunk = cost_breakdown_chunks[c]
+        cost_breakdown_chunk[...] = 0.0
+        for i in range(c * chunk_size, min((c + 1) * chunk_size, num_rollouts)):
+            cost = 0.0
+            last = horizon  # Step of the state the terminal cost is evaluated at
+            for j in range(horizon):
+                stage = stage_cost(
+                    s_horizon[i, j, ANGLE_IDX], s_horizon[i, j, ANGLED_IDX],
+                    s_horizon[i, j, POSITION_IDX], s_horizon[i, j, POSITIOND_IDX],
+                    u[j], delta_u[i, j], u_prev[j], target_position,
+                    weights, R, NU, step_multipliers[j],
+                    cost_breakdown_chunk, j, True,
+                )
+                cost += stage
+                if rollout_is_dead(cost, s_horizon[i, j, POSITION_IDX], termination_cost, termination_position):
+                    cost += dead_rollout_cost(stage, step_multipliers, j)
+                    last = j
+                    break
+            cost += phi(s_horizon[i, last, ANGLE_IDX], s_horizon[i, last, POSITION_IDX], target_position)
+            S_tilde_k[i] = cost
+    reduce_cost_breakdown(cost_breakdown_chunks, cost_breakdown, num_rollouts)
 
-@jit(nopython=True, cache=True, fastmath=True)
-def phi(s: np.ndarray, target_position: np.float32) -> np.ndarray:
-    """Calculate terminal cost of a set of trajectories
 
-    Williams et al use an indicator function type of terminal cost in
-    "Information theoretic MPC for model-based reinforcement learning"
+rollout_costs = jit(_rollout_costs, nopython=True, nogil=True, cache=True, fastmath=True)
+rollout_costs_parallel = jit(_rollout_costs, nopython=True, parallel=True, nogil=True, cache=True, fastmath=True)
 
-    TODO: Try a quadratic terminal cost => Use the LQR terminal cost term obtained
-    by linearizing the system around the unstable equilibrium.
 
-    :param s: Reference to numpy array of states of all rollouts
-    :type s: np.ndarray
-    :param target_position: Target position to move the cart to
-    :type target_position: np.float32
-    :return: One terminal cost per rollout
-    :rtype: np.ndarray
+@jit(nopython=True, nogil=True, cache=True, fastmath=True)
+def fused_rollout_cost(
+    s: np.ndarray,
+    u: np.ndarray,
+    delta_u: np.ndarray,
+    u_prev: np.ndarray,
+    target_position: float,
+    weights: np.ndarray,
+    R: float,
+    NU: float,
+    model_parameters: np.ndarray,
+    t_step: float,
+    intermediate_steps: int,
+    step_multipliers: np.ndarray,
+    termination_cost: float,
+    termination_position: float,
+    cost_breakdown: np.ndarray,
+    compute_breakdown: bool,
+):
+    """Integrate the cartpole equations for a single rollout and accumulate its cost on the fly.
+    Only the current state is kept, the predicted trajectory is never stored.
+    A dead rollout (see rollout_is_dead) is no longer integrated, its remaining stage costs are not evaluated
+    but charged with dead_rollout_cost, the terminal cost is evaluated at the state it died in.
+    Pass np.inf for both termination criteria to integrate all rollouts to the end of the horizon.
+
+    :param s: Initial state of the rollout
+    :param delta_u: Input perturbations of this rollout, shape (mpc_horizon)
+    :param model_parameters: [k, m_cart, m_pole, g, J_fric, M_fric, L, u_max]
+    :param step_multipliers: Duration of each horizon step in units of dt.
+        Step j is integrated with intermediate_steps * step_multipliers[j] steps of t_step and its stage cost is weighted by it
+    :param termination_cost: Cost above which the rollout is considered dead
+    :param termination_position: |position| above which the rollout is considered dead
+    :param cost_breakdown: Array (6 x mpc_horizon) to which the weighted cost components of the evaluated steps are added if compute_breakdown
+    :return: Total cost (stage + terminal) of the rollout
     """
-    terminal_states = s[:, -1, :]
-    terminal_cost = 10000 * (
-        (np.abs(terminal_states[:, ANGLE_IDX]) > 0.2)
-        | (
-            np.abs(terminal_states[:, POSITION_IDX] - target_position)
-            > 0.1 * TrackHalfLength
+    k, m_cart, m_pole, g = model_parameters[0], model_parameters[1], model_parameters[2], model_parameters[3]
+    J_fric, M_fric, L, u_max = model_parameters[4], model_parameters[5], model_parameters[6], model_parameters[7]
+
+    angle, angleD, position, positionD = s[ANGLE_IDX], s[ANGLED_IDX], s[POSITION_IDX], s[POSITIOND_IDX]
+    angle_cos, angle_sin = np.cos(angle), np.sin(angle)
+
+    cost = 0.0
+    for j in range(delta_u.shape[0]):
+        stage = stage_cost(
+            angle, angleD, position, positionD,
+            u[j], delta_u[j], u_prev[j], target_position,
+            weights, R, NU, step_multipliers[j],
+            cost_breakdown, j, compute_breakdown,
         )
-    )
-    return terminal_cost
-
+        cost += stage
+
+        if rollout_is_dead(cost, position, termination_cost, termination_position):
+            cost += dead_rollout_cost(stage, step_multipliers, j)
+            break
+
+        # Next state, same integration as the numba ODE predictor
+        force = u_max * (u[j] + delta_u[j])
+        for _ in range(intermediate_steps * step_multipliers[j]):
+            angleDD, positionDD = _cartpole_ode_numba(angle_cos, angle_sin, angleD, positionD, force,
+                                                      k, m_cart, m_pole, g, J_fric, M_fric, L)
+            angle, angleD, position, positionD = cartpole_integration_numba(angle, angleD, angleDD,
+                                                                            position, positionD, positionDD, t_step)
+            angle_cos = np.cos(angle)
+            angle, angleD, position, positionD = edge_bounce_numba(angle, angle_cos, angleD, position, positionD,
+                                                                   t_step, L)
+            angle = wrap_angle_rad_numba(angle)
+            angle_cos = np.cos(angle)
+            angle_sin = np.sin(angle)
+
+    return cost + phi(angle, position, target_position)
+
+
+def _fused_rollouts(
+    s: np.ndarray,
+    u: np.ndarray,
+    delta_u: np.ndarray,
+    u_prev: np.ndarray,
+    target_position: float,
+    weights: np.ndarray,
+    R: float,
+    NU: float,
+    model_parameters: np.ndarray,
+    t_step: float,
+    intermediate_steps: int,
+    step_multipliers: np.ndarray,
+    termination_cost: float,
+    termination_position: float,
+    S_tilde_k: np.ndarray,
+    cost_breakdown: np.ndarray,
+    cost_breakdown_chunks: np.ndarray,
+    chunk_size: int,
+    compute_breakdown: bool,
+):
+    """Fill S_tilde_k with the cost of each rollout, see fused_rollout_cost.
+    The rollouts are split into chunks as in _rollout_costs.
+    If compute_breakdown, cost_breakdown (6 x mpc_horizon) is filled with the average of each weighted cost component.
+    """
+    num_rollouts = delta_u.shape[0]
+    for c in prange(cost_breakdown_chunks.shape[0]):
+        cost_breakdown_chunk = cost_breakdown_chunks[c]
+        cost_breakdown_chunk[...] = 0.0
+        for i in range(c * chunk_size, min((c + 1) * chunk_size, num_rollouts)):
+            S_tilde_k[i] = fused_rollout_cost(s, u, delta_u[i], u_prev, target_position, weights, R, NU,
+                                              model_parameters, t_step, intermediate_steps, step_multipliers,
+                                              termination_cost, termination_position,
+                                              cost_breakdown_chunk, compute_breakdown)
+    reduce_cost_breakdown(cost_breakdown_chunks, cost_breakdown, num_rollouts)
 
-@jit(nopython=True, cache=True, fastmath=True)
-def reward_weighted_average(S: np.ndarray, delta_u: np.ndarray):
-    """Average the perturbations delta_u based on their desirability
 
-    :param S: Array of rollout costs
-    :type S: np.ndarray
-    :param delta_u: Array of perturbations
-    :type delta_u: np.ndarray
-    :return: Gain to update the vector of nominal inputs by. Vector of length (horizon_steps)
-    :rtype: np.ndarray
-    """
-    rho = np.min(S)  # for numerical stability
-    exp_s = np.exp(-1.0 / LBD * (S - rho))
-    a = np.sum(exp_s)
-    b = np.sum(np.multiply(np.expand_dims(exp_s, 1), delta_u) / a, axis=0)
-    return b
+fused_rollouts = jit(_fused_rollouts, nopython=True, nogil=True, cache=True, fastmath=True)
+fused_rollouts_parallel = jit(_fused_rollouts, nopython=True, parallel=True, nogil=True, cache=True, fastmath=True)
 
 
-@jit(nopython=True, cache=True, fastmath=True)
-def update_inputs(u: np.ndarray, S: np.ndarray, delta_u: np.ndarray):
+@jit(nopython=True, nogil=True, cache=True, fastmath=True)
+def update_inputs(u: np.ndarray, S: np.ndarray, delta_u: np.ndarray, LBD: float, exp_s: np.ndarray):
     """Reward-weighted in-place update of nominal control inputs according to the MPPI method.
+    The perturbations delta_u are averaged based on their desirability.
 
     :param u: Sampling mean / warm started control inputs of size (,mpc_horizon)
     :type u: np.ndarray
@@ -331,8 +357,62 @@ def update_inputs(u: np.ndarray, S: np.ndarray, delta_u: np.ndarray):
     :type S: np.ndarray
     :param delta_u: The input perturbations that had been used, shape (num_rollouts x mpc_horizon)
     :type delta_u: np.ndarray
+    :param LBD: Cost parameter lambda
+    :type LBD: float
+    :param exp_s: Preallocated buffer of size (num_rollouts) for the rollouts' weights
+    :type exp_s: np.ndarray
     """
-    u += reward_weighted_average(S, delta_u)
+    rho = np.min(S)  # for numerical stability
+    a = 0.0
+    for i in range(S.shape[0]):
+        exp_s[i] = np.exp(-1.0 / LBD * (S[i] - rho))
+        a += exp_s[i]
+    for j in range(u.shape[0]):
+        b = 0.0
+        for i in range(S.shape[0]):
+            b += exp_s[i] * delta_u[i, j]
+        u[j] += b / a
+
+
+def interpolation_matrix(horizon: int, step: int, step_times: np.ndarray = None) -> np.ndarray:
+    """Linear interpolation between perturbations sampled every step-th horizon step, as a matrix.
+
+    :param horizon: Number of horizon steps
+    :param step: Distance in horizon steps between the sampled perturbations (knots)
+    :param step_times: Start time of each horizon step in units of dt, for a multi-resolution horizon.
+        The knots are then placed every step * dt in time. Defaults to uniform steps
+    :return: Matrix of shape (knots x horizon), knot values @ matrix gives the interpolated perturbations.
+        The last knot lies at or after the end of the horizon.
+    :rtype: np.ndarray
+    """
+    t = np.arange(horizon) if step_times is None else step_times
+    num_knots = int(t[-1] // step) + 2
+    left_knot = t // step
+    weight_right = (t % step) / step
+
+    steps = np.arange(horizon)
+    matrix = np.zeros((num_knots, horizon), dtype=np.float32)
+    matrix[left_knot, steps] = 1.0 - weight_right
+    matrix[left_knot + 1, steps] += weight_right
+    return matrix
+
+
+def horizon_step_multipliers(horizon: int, segments: list = None) -> np.ndarray:
+    """Duration of each horizon step in units of dt.
+
+    :param horizon: Number of horizon steps
+    :param segments: [[number of steps, multiplier], ...] consumed in order, the last multiplier is kept up to the end of the horizon.
+        Defaults to None - all steps of dt
+    :return: Integer array of shape (horizon)
+    """
+    multipliers = np.ones(horizon, dtype=np.int64)
+    if segments:
+        j = 0
+        for num_steps, multiplier in segments:
+            multipliers[j:j + num_steps] = multiplier
+            j += num_steps
+        multipliers[j:] = segments[-1][1]
+    return multipliers
 
 
 class controller_mppi_cartpole(template_controller):
@@ -344,6 +424,16 @@ class controller_mppi_cartpole(template_controller):
     _computation_library = NumpyLibrary
     
     def configure(self):
+        config_mppi_cartpole = self.config_controller
+        config_cartpole = load_config("cartpole_physical_parameters.yml")["cartpole"]
+
+        """Timestep and sampling settings"""
+        self.mpc_horizon = config_mppi_cartpole["mpc_horizon"]
+        self.num_rollouts = config_mppi_cartpole["num_rollouts"]
+        self.update_every = config_mppi_cartpole["update_every"]
+        self.predictor_specification = config_mppi_cartpole["predictor_specification"]
+        self.dt = load_config("config_data_gen.yml")["dt"]["control"]
+
         """Random number generator"""
         seed = config_mppi_cartpole["seed"]
         if seed == None:
@@ -351,12 +441,78 @@ class controller_mppi_cartpole(template_controller):
         self.rng_mppi = Generator(SFC64(seed))
         self.rng_mppi_rnn = Generator(SFC64(seed*2)) # There are some random numbers used at warm up of rnn only. Separate rng prevents a shift
 
-        global dd_weight, ep_weight, ekp_weight, ekc_weight, cc_weight
-        dd_weight = dd_weight * (1 + dd_noise * self.rng_mppi.uniform(-1.0, 1.0))
-        ep_weight = ep_weight * (1 + ep_noise * self.rng_mppi.uniform(-1.0, 1.0))
-        ekp_weight = ekp_weight * (1 + ekp_noise * self.rng_mppi.uniform(-1.0, 1.0))
-        ekc_weight = ekc_weight * (1 + ekc_noise * self.rng_mppi.uniform(-1.0, 1.0))
-        cc_weight = cc_weight * (1 + cc_noise * self.rng_mppi.uniform(-1.0, 1.0))
+        """Parameters weighting the different cost components, perturbed by cost_noise"""
+        cost_noise = config_mppi_cartpole["cost_noise"]
+        self.dd_weight = config_mppi_cartpole["dd_weight"] * (1 + cost_noise * self.rng_mppi.uniform(-1.0, 1.0))
+        self.ep_weight = config_mppi_cartpole["ep_weight"] * (1 + cost_noise * self.rng_mppi.uniform(-1.0, 1.0))
+        self.ekp_weight = config_mppi_cartpole["ekp_weight"] * (1 + cost_noise * self.rng_mppi.uniform(-1.0, 1.0))
+        self.ekc_weight = config_mppi_cartpole["ekc_weight"] * (1 + cost_noise * self.rng_mppi.uniform(-1.0, 1.0))
+        self.cc_weight = config_mppi_cartpole["cc_weight"] * (1 + cost_noise * self.rng_mppi.uniform(-1.0, 1.0))
+        self.ccrc_weight = config_mppi_cartpole["ccrc_weight"]
+        self.cost_weights = np.zeros(6, dtype=np.float32)  # Buffer passed to the compiled cost function, refreshed at every update
+
+        """Perturbation factor"""
+        self.p_Q = config_cartpole["actuator_noise"]
+
+        """MPPI constants"""
+        self.R = config_mppi_cartpole["R"]
+        self.LBD = config_mppi_cartpole["LBD"]
+        self.NU = config_mppi_cartpole["NU"]
+        self.SQRTRHODTINV = config_mppi_cartpole["SQRTRHOINV"] * (1 / np.sqrt(self.dt))
+        self.SAMPLING_TYPE = config_mppi_cartpole["SAMPLING_TYPE"]
+        self.noise_bank_size = config_mppi_cartpole["noise_bank_size"]
+
+        """Multi-resolution horizon: steps of a multiple of dt further in the future, possible only with fused rollouts"""
+        self.horizon_segments = config_mppi_cartpole["horizon_segments"]
+        self.multi_resolution = bool(self.horizon_segments)
+        if self.multi_resolution and (not config_mppi_cartpole["fused_rollouts"] or config_mppi_cartpole["controller_logging"]):
+            raise ValueError('Multi-resolution horizon (horizon_segments) requires fused_rollouts: True and controller_logging: False.')
+
+        """Fused rollouts: cartpole equations integrated together with the cost, no predictor involved.
+        Used only if the predictor turns out to be an ODE at the first step."""
+        self.fused_rollouts_requested = config_mppi_cartpole["fused_rollouts"]
+        self.fused_rollouts = False
+        self.fused_intermediate_steps = 10
+
+        """Early termination: the remaining stage costs of dead rollouts (too costly or at the track boundary) are not evaluated.
+        With fused rollouts or the numpy ODE predictor dead rollouts are also no longer integrated."""
+        if config_mppi_cartpole["early_termination"]:
+            self.termination_cost = float(config_mppi_cartpole["early_termination_cost"] or np.inf)
+            track_fraction = config_mppi_cartpole["early_termination_track_fraction"]
+            self.termination_position = track_fraction * TRACK_HALF_LENGTH if track_fraction else np.inf
+        else:
+            self.termination_cost = self.termination_position = np.inf
+
+        """Chunked evaluation of rollout costs, chunks run on all cores if parallel_rollouts"""
+        self.parallel_rollouts = config_mppi_cartpole["parallel_rollouts"]
+        self.rollouts_chunk_size = config_mppi_cartpole["rollouts_chunk_size"]
+
+        """Anytime MPPI: fused rollouts evaluated in batches until a deadline, num_rollouts is then the maximum"""
+        self.anytime = config_mppi_cartpole["anytime"]
+        self.anytime_batch_size = config_mppi_cartpole["anytime_batch_size"]
+        self.anytime_safety_margin = config_mppi_cartpole["anytime_safety_margin"]
+        if self.anytime:
+            if not self.fused_rollouts_requested or config_mppi_cartpole["controller_logging"]:
+                raise ValueError('Anytime MPPI requires fused_rollouts: True and controller_logging: False.')
+            self.controller_data_for_csv = {'mppi_rollouts': [0]}  # Number of rollouts evaluated before the deadline
+
+        """Logging settings, the logs are streamed to disk by a StreamingLogger of this instance"""
+        self.logging = config_mppi_cartpole["controller_logging"]
+        self.logging_path = config_mppi_cartpole["logging_path"]
+        self.logging_chunk_len = config_mppi_cartpole["logging_chunk_len"]
+        self.logging_every = config_mppi_cartpole["logging_every"]
+        self.logging_top_k_rollouts = config_mppi_cartpole["logging_top_k_rollouts"]
+
+        # Cost components averaged over rollouts at the last update, displayed in GUI
+        self.gui_dd = self.gui_ep = self.gui_ekp = self.gui_ekc = self.gui_cc = self.gui_ccrc = np.zeros(1, dtype=np.float32)
+
+        # Created at the first step by initialize
+        self.predictor = None
+        self.rollout_predictor = None  # Predicts the rollouts, the predictor itself or a whole-horizon compiled ODE
+        self.predictor_nominal = None  # Batch size 1, follows the real trajectory (recurrent state) and predicts the nominal rollout
+        self.recurrent_state = None  # Broadcasts the recurrent state of predictor_nominal to the rollouts
+        self.predictor_ground_truth = None
+        self.net_type = None
 
         # State of the cart
         self.s = create_cartpole_state()
@@ -366,12 +522,17 @@ class controller_mppi_cartpole(template_controller):
         self.control_enabled = True
 
         self.s_horizon = np.zeros((), dtype=np.float32)
-        self.u = np.zeros((mpc_horizon), dtype=np.float32)
+
+        params = CartPoleParameters()
+        self.model_parameters = np.array(
+            [params.k, params.m_cart, params.m_pole, params.g, params.J_fric, params.M_fric, params.L, params.u_max],
+            dtype=np.float64,
+        )
+        self.u = np.zeros((self.mpc_horizon), dtype=np.float32)
         self.u_prev = np.zeros_like(self.u, dtype=np.float32)
-        self.delta_u = np.zeros((num_rollouts, mpc_horizon), dtype=np.float32)
-        self.S_tilde_k = np.zeros((num_rollouts), dtype=np.float32)
+        self.allocate_rollout_buffers()
 
-        self.wash_out_len = WASH_OUT_LEN
+        self.wash_out_len = config_mppi_cartpole["WASH_OUT_LEN"]
         self.warm_up_countdown = self.wash_out_len
         try:
             from Control_Toolkit_ASF.Controllers.controller_lqr import \
@@ -389,8 +550,263 @@ class controller_mppi_cartpole(template_controller):
 
         self.auxiliary_controller_available = False
 
+        self.logger = self.create_logger() if self.logging else None
+
+        """Warm start from a library of converged input sequences, loaded at the first step"""
+        self.warm_start_library_path = config_mppi_cartpole["warm_start_library"]
+        self.warm_start_threshold = config_mppi_cartpole["warm_start_threshold"]
+        self.warm_start_record = config_mppi_cartpole["warm_start_record"]
+        self.warm_start_settle_steps = config_mppi_cartpole["warm_start_settle_steps"]
+        self.warm_start_library = None
+        self.warm_start_expected_features = None  # Features of the situation expected at the next step, None - unknown
+        self.settled_steps = 0  # Steps since the last large discrepancy
+
+    def initialize(self):
+        """Create the predictors and decide on the features depending on the predictor type.
+        Called at the first step, so that configuring a controller (e.g. to list it in GUI) stays cheap."""
+        from SI_Toolkit.Predictors.predictor_ODE import predictor_ODE
+        from SI_Toolkit.Predictors.predictor_wrapper import PredictorWrapper
+
+        self.predictor = PredictorWrapper()
+        self.predictor.configure(
+            batch_size=self.num_rollouts, horizon=self.mpc_horizon, dt=self.dt,
+            predictor_specification=self.predictor_specification,
+        )
+
+        if self.predictor.predictor_config['predictor_type'] == 'neural':
+            model_name = self.predictor.predictor_config['model_name']
+            try:
+                self.net_type = model_name.split("-")[0]
+            except AttributeError:  # Should get Attribute Error if NET_NAME is None
+                self.net_type = None
+        else:
+            self.net_type = None
+
+        self.fused_rollouts = (self.fused_rollouts_requested
+                               and self.predictor.predictor_config['predictor_type'] in ['ODE', 'ODE_TF'])
+        self.fused_intermediate_steps = self.predictor.predictor_config.get('intermediate_steps', 10)
+        if self.anytime and not self.fused_rollouts:
+            raise ValueError('Anytime MPPI requires fused rollouts, available only with an ODE or ODE_TF predictor, got {}.'
+                             .format(self.predictor.predictor_config['predictor_type']))
+
+        # Numpy ODE: all rollouts are integrated over the whole horizon in one compiled call instead of step by step
+        if self.predictor.predictor_config['predictor_type'] == 'ODE':
+            from SI_Toolkit_ASF.predictors_customization_numba import predictor_ODE_horizon_numba
+            self.rollout_predictor = predictor_ODE_horizon_numba(
+                horizon=self.mpc_horizon, dt=self.dt, intermediate_steps=self.fused_intermediate_steps,
+                batch_size=self.num_rollouts, variable_parameters=self.variable_parameters,
+                parallel=self.parallel_rollouts, termination_position=self.termination_position,
+            )
+        else:
+            self.rollout_predictor = self.predictor
+
+        if self.multi_resolution and not self.fused_rollouts:
+            raise ValueError('Multi-resolution horizon requires fused rollouts, available only with an ODE or ODE_TF predictor, got {}.'
+                             .format(self.predictor.predictor_config['predictor_type']))
+
+        # The internal state of a recurrent predictor is advanced with batch size 1 and broadcast to the rollouts,
+        # the nominal rollout for logging is predicted with batch size 1 as well
+        recurrent = self.net_type in ["GRU", "LSTM", "RNN"]
+        if recurrent or (self.logging and self.predictor.predictor_config['predictor_type'] in ["neural", "ODE_TF", "GP"]):
+            from SI_Toolkit_ASF.predictors_customization import recurrent_state_broadcast
+            self.predictor_nominal = PredictorWrapper()
+            self.predictor_nominal.configure(
+                batch_size=1, horizon=self.mpc_horizon, dt=self.dt,
+                predictor_specification=self.predictor_specification,
+            )
+            if recurrent:
+                self.recurrent_state = recurrent_state_broadcast(self.predictor, self.predictor_nominal)
+                if not self.recurrent_state.available:
+                    warnings.warn('Cannot broadcast the internal state of the {} predictor, updating all rollouts instead.'
+                                  .format(self.net_type), RuntimeWarning)
+                    self.recurrent_state = None
+
+        if self.logging:
+            self.predictor_ground_truth = predictor_ODE(
+                horizon=self.mpc_horizon, dt=self.dt, intermediate_steps=10
+            )
+
+        if self.warm_start_library_path:
+            if os.path.isfile(self.warm_start_library_path):
+                self.warm_start_library = TrajectoryLibrary.load(self.warm_start_library_path, self.mpc_horizon)
+            else:
+                self.warm_start_library = TrajectoryLibrary(self.mpc_horizon)
+
+    def create_logger(self):
+        """Logger of this controller instance, each experiment is logged into a new folder"""
+        path = os.path.join(self.logging_path, "MPPI-log-" + datetime.now().strftime("%Y-%m-%d_%H-%M-%S-%f"))
+        return StreamingLogger(path, chunk_len=self.logging_chunk_len)
+
+    def allocate_rollout_buffers(self):
+        """
+        Allocate the arrays used at every controller update once, they are then overwritten in place.
+        Called again only if num_rollouts or mpc_horizon are changed (e.g. in GUI while running).
+        """
+        num_rollouts, mpc_horizon = self.num_rollouts, self.mpc_horizon
+        self.delta_u = np.zeros((num_rollouts, mpc_horizon), dtype=np.float32)
+        self.S_tilde_k = np.zeros((num_rollouts), dtype=np.float32)
+        self.rollout_weights = np.zeros((num_rollouts), dtype=np.float32)
+        self.initial_state = np.zeros((num_rollouts, len(STATE_INDICES)), dtype=np.float32)
+        self.u_rollouts = np.zeros((num_rollouts, mpc_horizon, 1), dtype=np.float32)
+        self.cost_breakdown = np.zeros((6, mpc_horizon), dtype=np.float32)
+        num_chunks = -(-num_rollouts // self.rollouts_chunk_size)
+        self.cost_breakdown_chunks = np.zeros((num_chunks, 6, mpc_horizon), dtype=np.float32)
+        self.Q_update = np.zeros((num_rollouts, 1, 1), dtype=np.float32)
+        self.Q_recurrent = np.zeros((1, 1, 1), dtype=np.float32)  # Input of the nominal predictor with broadcast recurrent state
+
+        self.update_horizon_grid()
+
+        if self.noise_bank_size:
+            # The bank holds at least two full sets of perturbations to allow shifted reuse
+            self.noise_bank = self.rng_mppi.standard_normal(
+                size=max(self.noise_bank_size, 2 * num_rollouts * mpc_horizon), dtype=np.float32
+            )
+        else:
+            self.noise_bank = None
+
+    def update_horizon_grid(self):
+        """
+        Set the duration of each horizon step and what depends on it.
+        Each step holds one control input, the interpolation knots and the index-shift of inputs follow the steps' start times.
+        """
+        self.step_multipliers = horizon_step_multipliers(
+            self.mpc_horizon, self.horizon_segments if self.multi_resolution else None
+        )
+        step_times = np.cumsum(self.step_multipliers) - self.step_multipliers  # Start of each step in units of dt
+
+        # After one control step, step j starts with the input of the step covering its start time + dt
+        shifted_times = step_times + 1
+        self.shift_indices = np.searchsorted(step_times, shifted_times, side='right') - 1
+        self.shift_valid = shifted_times < step_times[-1] + self.step_multipliers[-1]
+
+        self.interpolation_matrix = interpolation_matrix(self.mpc_horizon, INTERPOLATION_STEP, step_times)
+        self.interpolation_knots = np.zeros((self.num_rollouts, self.interpolation_matrix.shape[0]), dtype=np.float32)
+
+    def warm_start(self):
+        """
+        Replace the nominal inputs u by the nearest sequence from the warm start library
+        if the situation differs from the one expected after the previous step by more than warm_start_threshold,
+        e.g. after a disturbance, a target jump or at the start of an experiment.
+        Otherwise count the steps for which the controller has been tracking its own solution.
+        """
+        target_position = self.variable_parameters.target_position
+        position, positionD = self.s[POSITION_IDX], self.s[POSITIOND_IDX]
+        angle, angleD = self.s[ANGLE_IDX], self.s[ANGLED_IDX]
+        scales = self.warm_start_library.feature_scales
+
+        if self.warm_start_expected_features is None:
+            discrepancy = np.inf
+        else:
+            features = library_features(position, positionD, angle, angleD, target_position, scales)
+            discrepancy = np.linalg.norm(features - self.warm_start_expected_features)
+
+        if discrepancy > self.warm_start_threshold:
+            nearest = self.warm_start_library.query(self.s, target_position)
+            if nearest is not None:
+                sequence = nearest[1]
+                n = min(sequence.size, self.u.size)
+                self.u[:n] = sequence[:n]
+                self.u[n:] = 0.0
+            self.settled_steps = 0
+        else:
+            self.settled_steps += 1
+
+        # Expected at the next step: the state extrapolated over dt
+        self.warm_start_expected_features = library_features(
+            position + self.dt * positionD, positionD, angle + self.dt * angleD, angleD, target_position, scales
+        )
+
+    def update_cost_weights(self):
+        self.cost_weights[:] = (
+            self.dd_weight, self.ep_weight, self.ekp_weight, self.ekc_weight, self.cc_weight, self.ccrc_weight
+        )
+
+    def update_gui_costs(self):
+        """Pass costs to GUI popup window"""
+        self.gui_dd, self.gui_ep, self.gui_ekp, self.gui_ekc, self.gui_cc, self.gui_ccrc = np.mean(self.cost_breakdown, axis=1)
+
+    def trajectory_rollouts(self, logger: StreamingLogger = None):
+        """Sample thousands of rollouts using system model. Compute cost-weighted control update. Log states and costs if specified.
+        Reads the current state, nominal inputs and perturbations of this instance,
+        fills S_tilde_k with the cost of each rollout trajectory and cost_breakdown with the average cost components.
+
+        :param logger: If given, the cost breakdown and the states and costs of the logging_top_k_rollouts cheapest rollouts are logged
+        :type logger: StreamingLogger, optional
+
+        :return: S_tilde_k - Array filled with a cost for each rollout trajectory
+        """
+        S_tilde_k = self.S_tilde_k
+        self.initial_state[...] = self.s
+        self.update_cost_weights()
+        np.add(self.u, self.delta_u, out=self.u_rollouts[..., 0])
+
+        s_horizon = self.rollout_predictor.predict(self.initial_state, self.u_rollouts)[:, :, : len(STATE_INDICES)]
+
+        # Compute stage and terminal costs
+        (rollout_costs_parallel if self.parallel_rollouts else rollout_costs)(
+            s_horizon, self.u, self.delta_u, self.u_prev, self.variable_parameters.target_position,
+            self.cost_weights,
+            self.R, self.NU, self.step_multipliers,
+            self.termination_cost, self.termination_position,
+            S_tilde_k, self.cost_breakdown, self.cost_breakdown_chunks, self.rollouts_chunk_size,
+        )
+
+        self.update_gui_costs()
+
+        if logger is not None:
+            logger.append("cost_breakdown", self.cost_breakdown)  # 6 x mpc_horizon
+            top_k = self.logging_top_k_rollouts
+            if top_k is None or top_k >= S_tilde_k.size:
+                logged_rollouts = np.argsort(S_tilde_k)
+            else:
+                logged_rollouts = np.argpartition(S_tilde_k, top_k)[:top_k]
+                logged_rollouts = logged_rollouts[np.argsort(S_tilde_k[logged_rollouts])]
+            logger.append("cost_to_go", S_tilde_k[logged_rollouts])  # k
+            logger.append("states", s_horizon[logged_rollouts, :-1, :])  # k x mpc_horizon x STATE_VARIABLES
+
+        return S_tilde_k
+
+    def fused_trajectory_rollouts(self, S_tilde_k: np.ndarray, delta_u: np.ndarray):
+        """Counterpart of trajectory_rollouts which does not call the predictor
+        but integrates the cartpole equations in a compiled kernel together with the cost.
+        Memory use is independent of the horizon; the predicted states are not available for logging.
+
+        :param S_tilde_k: Placeholder array to store the cost of each rollout trajectory, filled in place
+        :type S_tilde_k: np.ndarray
+        :param delta_u: Input perturbations of the evaluated rollouts, (a slice of) self.delta_u
+        :type delta_u: np.ndarray
+
+        :return: S_tilde_k - Array filled with a cost for each rollout trajectory
+        """
+        if hasattr(self.variable_parameters, 'L'):
+            self.model_parameters[6] = self.variable_parameters.L
+        self.update_cost_weights()
+
+        (fused_rollouts_parallel if self.parallel_rollouts else fused_rollouts)(
+            self.s, self.u, delta_u, self.u_prev, self.variable_parameters.target_position,
+            self.cost_weights, self.R, self.NU,
+            self.model_parameters, self.dt / self.fused_intermediate_steps, self.fused_intermediate_steps, self.step_multipliers,
+            self.termination_cost, self.termination_position,
+            S_tilde_k, self.cost_breakdown, self.cost_breakdown_chunks, self.rollouts_chunk_size, True,
+        )
+
+        self.update_gui_costs()
+
+        return S_tilde_k
+
+    def standard_normal(self, out: np.ndarray) -> np.ndarray:
+        """Fill the contiguous array out with standard normal samples.
+        These are drawn fresh or, if noise_bank_size is set, read from the pregenerated bank at a random offset.
+        """
+        if self.noise_bank is None:
+            self.rng_mppi.standard_normal(dtype=np.float32, out=out)
+        else:
+            offset = self.rng_mppi.integers(0, self.noise_bank.size - out.size + 1)
+            out[...] = self.noise_bank[offset:offset + out.size].reshape(out.shape)
+        return out
+
     def initialize_perturbations(
-        self, stdev: float = 1.0, sampling_type: str = None
+        self, stdev: float = 1.0, sampling_type: str = None, out: np.ndarray = None
     ) -> np.ndarray:
         """Sample an array of control perturbations delta_u. Samples for two distinct rollouts are always independent
 
@@ -400,9 +816,11 @@ class controller_mppi_cartpole(template_controller):
             - "random_walk" - The next horizon step's perturbation is correlated with the previous one
             - "uniform" - Draw uniformly distributed samples between -1.0 and 1.0
             - "repeated" - Sample only one perturbation per rollout, apply it repeatedly over the course of the rollout
-            - "interpolated" - Sample a new independent perturbation every 10th MPC horizon step. Interpolate in between the samples
+            - "interpolated" - Sample a new independent perturbation every INTERPOLATION_STEP-th MPC horizon step. Interpolate in between the samples
             - "iid" - Sample independent and identically distributed samples of a Gaussian distribution
         :type sampling_type: str, optional
+        :param out: Preallocated float32 array of shape (num_rollouts x horizon_steps) to fill, defaults to None
+        :type out: np.ndarray, optional
         :return: Independent perturbation samples of shape (num_rollouts x horizon_steps)
         :rtype: np.ndarray
         """
@@ -411,43 +829,36 @@ class controller_mppi_cartpole(template_controller):
         If random_walk is false, initialize with independent Gaussian samples
         If random_walk is true, each row represents a 1D random walk with Gaussian steps.
         """
+        if out is None:
+            out = np.empty((self.num_rollouts, self.mpc_horizon), dtype=np.float32)
+        delta_u = out
+        num_samples, horizon = out.shape
+
         if sampling_type == "random_walk":
-            delta_u = np.empty((num_rollouts, mpc_horizon), dtype=np.float32)
-            delta_u[:, 0] = stdev * self.rng_mppi.standard_normal(
-                size=(num_rollouts,), dtype=np.float32
-            )
-            for i in range(1, mpc_horizon):
-                delta_u[:, i] = delta_u[:, i - 1] + stdev * self.rng_mppi.standard_normal(
-                    size=(num_rollouts,), dtype=np.float32
-                )
+            self.standard_normal(out=delta_u)
+            delta_u *= stdev
+            np.cumsum(delta_u, axis=1, out=delta_u)
         elif sampling_type == "uniform":
-            delta_u = np.empty((num_rollouts, mpc_horizon), dtype=np.float32)
-            for i in range(0, mpc_horizon):
-                delta_u[:, i] = self.rng_mppi.uniform(
-                    low=-1.0, high=1.0, size=(num_rollouts,)
-                ).astype(np.float32)
+            self.rng_mppi.random(dtype=np.float32, out=delta_u)
+            delta_u *= 2.0
+            delta_u -= 1.0
         elif sampling_type == "repeated":
-            delta_u = np.tile(
-                stdev * self.rng_mppi.standard_normal(size=(num_rollouts, 1), dtype=np.float32),
-                (1, mpc_horizon),
-            )
+            # The generator can only fill contiguous arrays, the first column is then repeated
+            self.standard_normal(out=delta_u)
+            delta_u[:, 0] *= stdev
+            delta_u[:, 1:] = delta_u[:, :1]
         elif sampling_type == "interpolated":
-            step = 10
-            range_stop = int(np.ceil((mpc_horizon) / step) * step) + 1
-            t = np.arange(start=0, stop=range_stop, step=step)
-            t_interp = np.arange(start=0, stop=range_stop, step=1)
-            t_interp = np.delete(t_interp, t)
-            delta_u = np.zeros(shape=(num_rollouts, range_stop), dtype=np.float32)
-            delta_u[:, t] = stdev * self.rng_mppi.standard_normal(
-                size=(num_rollouts, t.size), dtype=np.float32
-            )
-            f = interp1d(t, delta_u[:, t])
-            delta_u[:, t_interp] = f(t_interp)
-            delta_u = delta_u[:, :mpc_horizon]
+            if horizon != self.interpolation_matrix.shape[1]:
+                self.interpolation_matrix = interpolation_matrix(horizon, INTERPOLATION_STEP)
+            knots = self.interpolation_knots[:num_samples]
+            if knots.shape != (num_samples, self.interpolation_matrix.shape[0]):
+                knots = np.empty((num_samples, self.interpolation_matrix.shape[0]), dtype=np.float32)
+            self.standard_normal(out=knots)
+            knots *= stdev
+            np.matmul(knots, self.interpolation_matrix, out=delta_u)
         else:
-            delta_u = stdev * self.rng_mppi.standard_normal(
-                size=(num_rollouts, mpc_horizon), dtype=np.float32
-            )
+            self.standard_normal(out=delta_u)
+            delta_u *= stdev
 
         return delta_u
 
@@ -461,8 +872,12 @@ class controller_mppi_cartpole(template_controller):
         :return: A normed control value in the range [-1.0, 1.0]
         :rtype: np.float32
         """
+        step_start = perf_counter()
         self.update_attributes(updated_attributes)
 
+        if self.predictor is None:
+            self.initialize()
+
         self.s = s
 
         self.iteration += 1
@@ -470,59 +885,82 @@ class controller_mppi_cartpole(template_controller):
         # Adjust horizon if changed in GUI while running
         # FIXME: For this to work with NeuralNet predictor we need to build a setter,
         #  which also reinitialize arrays which size depends on horizon
-        predictor.horizon = mpc_horizon
-        if mpc_horizon != self.u.size:
+        self.predictor.horizon = self.mpc_horizon
+        if self.predictor_nominal is not None:
+            self.predictor_nominal.horizon = self.mpc_horizon
+        if self.mpc_horizon != self.u.size:
             self.update_control_vector()
+        if self.delta_u.shape != (self.num_rollouts, self.mpc_horizon):
+            self.allocate_rollout_buffers()
+
+        if self.warm_start_library is not None:
+            self.warm_start()
+
+        if self.iteration % self.update_every == 0 and self.anytime:
+            deadline = step_start + (1.0 - self.anytime_safety_margin) * self.dt
+            num_evaluated = self.anytime_rollouts(deadline)
+            self.controller_data_for_csv['mppi_rollouts'] = [num_evaluated]
+
+            # Update inputs with the weighted perturbations of the evaluated rollouts only
+            update_inputs(self.u, self.S_tilde_k[:num_evaluated], self.delta_u[:num_evaluated], self.LBD,
+                          self.rollout_weights[:num_evaluated])
 
-        if self.iteration % update_every == 0:
-            # Initialize perturbations and cost arrays
-            self.delta_u = self.initialize_perturbations(
+        elif self.iteration % self.update_every == 0:
+            log_update = self.logging and (self.iteration // self.update_every) % self.logging_every == 0
+
+            # Initialize perturbations, the cost array is overwritten by the rollouts
+            self.initialize_perturbations(
                 # stdev=0.1 * (1 + 1 / (self.iteration + 1)),
-                stdev=SQRTRHODTINV,
-                sampling_type=SAMPLING_TYPE,
+                stdev=self.SQRTRHODTINV,
+                sampling_type=self.SAMPLING_TYPE,
+                out=self.delta_u,
             )  # du ~ N(mean=0, var=1/(rho*dt))
-            self.S_tilde_k = np.zeros_like(self.S_tilde_k, dtype=np.float32)
 
             # Run parallel trajectory rollouts for different input perturbations
-            self.S_tilde_k = trajectory_rollouts(
-                self.s,
-                self.S_tilde_k,
-                self.u,
-                self.delta_u,
-                self.u_prev,
-                self.variable_parameters.target_position,
-            )
+            if self.fused_rollouts and not self.logging:
+                self.fused_trajectory_rollouts(self.S_tilde_k, self.delta_u)
+            else:
+                self.trajectory_rollouts(logger=self.logger if log_update else None)
 
             # Update inputs with weighted perturbations
-            update_inputs(self.u, self.S_tilde_k, self.delta_u)
+            update_inputs(self.u, self.S_tilde_k, self.delta_u, self.LBD, self.rollout_weights)
 
             # Log states and costs incurred for plotting later
-            if LOGGING:
-                LOGS.get("cost_to_go").append(np.copy(self.S_tilde_k))
-                LOGS.get("inputs").append(np.copy(self.u))
+            if log_update:
+                self.logger.append("iteration", self.iteration)
+                self.logger.append("cost_to_go_mean", np.mean(self.S_tilde_k))
+                self.logger.append("inputs", self.u)
 
                 # Simulate nominal rollout to plot the trajectory the controller wants to make
                 # Compute one rollout of shape (mpc_horizon + 1) x s.size
-                if predictor.predictor_type == "ODE":
-                    rollout_trajectory = predictor.predict(np.copy(self.s), self.u[:, np.newaxis])
-                elif predictor.predictor_type in ["neural", "ODE_TF", "GP"]:
-                    # This is a lot of unnecessary calculation, but a stateful RNN in TF has frozen batch size
-                    # FIXME: Problaby you can reduce it!
-
-                    rollout_trajectory = predictor.predict(np.tile(self.s, (num_rollouts, 1)),
-                        np.tile(self.u[np.newaxis, :, np.newaxis], (num_rollouts, 1, 1))
+                if self.predictor.predictor_type == "ODE":
+                    rollout_trajectory = self.predictor.predict(np.copy(self.s), self.u[:, np.newaxis])
+                elif self.predictor.predictor_type in ["neural", "ODE_TF", "GP"]:
+                    # Predicted with batch size 1, which follows the same internal state as the rollouts
+                    rollout_trajectory = self.predictor_nominal.predict(
+                        self.s[np.newaxis, :], self.u[np.newaxis, :, np.newaxis]
                     )[0, ...]
-                LOGS.get("nominal_rollouts").append(np.copy(rollout_trajectory[:-1, :]))
+                self.logger.append("nominal_rollouts", rollout_trajectory[:-1, :])
+
+        # Store a converged solution every warm_start_settle_steps steps without large discrepancy
+        if (
+            self.warm_start_record
+            and self.warm_start_library is not None
+            and self.iteration % self.update_every == 0
+            and self.settled_steps > 0
+            and self.settled_steps % self.warm_start_settle_steps == 0
+        ):
+            self.warm_start_library.add(self.s, self.variable_parameters.target_position, self.u)
 
-        if LOGGING:
-            LOGS.get("trajectory").append(np.copy(self.s))
-            LOGS.get("target_trajectory").append(np.copy(self.variable_parameters.target_position))
+        if self.logging:
+            self.logger.append("trajectory", self.s)
+            self.logger.append("target_trajectory", self.variable_parameters.target_position)
 
         if (
             self.warm_up_countdown > 0
             and self.auxiliary_controller_available
-            and predictor.predictor_type == "neural"
-            and (NET_TYPE == "GRU" or NET_TYPE == "LSTM" or NET_TYPE == "RNN")
+            and self.predictor.predictor_type == "neural"
+            and (self.net_type == "GRU" or self.net_type == "LSTM" or self.net_type == "RNN")
 
         ):
             self.warm_up_countdown -= 1
@@ -550,101 +988,115 @@ class controller_mppi_cartpole(template_controller):
         #     Q = np.random.uniform(-1.0, 1.0)
 
         # Add noise on top of the calculated Q value to better explore state space
-        Q = np.float32(Q * (1 + p_Q * self.rng_mppi.uniform(-1.0, 1.0)))
+        Q = np.float32(Q * (1 + self.p_Q * self.rng_mppi.uniform(-1.0, 1.0)))
         # Clip inputs to allowed range
         Q = np.clip(Q, -1.0, 1.0, dtype=np.float32)
 
         # Preserve current series of inputs
-        self.u_prev = np.copy(self.u)
+        np.copyto(self.u_prev, self.u)
 
         # Index-shift inputs
-        self.u[:-1] = self.u[1:]
-        self.u[-1] = 0
+        if self.multi_resolution:
+            self.u[...] = np.where(self.shift_valid, self.u[self.shift_indices], 0.0)
+        else:
+            self.u[:-1] = self.u[1:]
+            self.u[-1] = 0
         # self.u = zeros_like(self.u)
 
         # Prepare predictor for next timestep
-        Q_update = np.tile(Q, (num_rollouts, 1, 1))
-        predictor.update(Q_update, self.s)
+        if self.recurrent_state is not None:
+            self.Q_recurrent.fill(Q)
+            self.recurrent_state.update(self.Q_recurrent, self.s)
+        else:
+            self.Q_update.fill(Q)
+            self.predictor.update(self.Q_update, self.s)
+            if self.predictor_nominal is not None:
+                self.predictor_nominal.update(self.Q_update[:1], self.s)
 
         return Q  # normed control input in the range [-1,1]
 
+    def anytime_rollouts(self, deadline: float) -> int:
+        """Draw and evaluate fused rollouts in batches of anytime_batch_size until the deadline has passed
+        or num_rollouts have been evaluated. At least one batch is always evaluated.
+        The cost breakdown shown in GUI is the one of the last batch.
+
+        :param deadline: Value of time.perf_counter after which no new batch is started
+        :type deadline: float
+        :return: Number of evaluated rollouts, their perturbations and costs are at the beginning of delta_u and S_tilde_k
+        :rtype: int
+        """
+        num_evaluated = 0
+        while num_evaluated < self.num_rollouts:
+            batch = slice(num_evaluated, min(num_evaluated + self.anytime_batch_size, self.num_rollouts))
+            self.initialize_perturbations(stdev=self.SQRTRHODTINV, sampling_type=self.SAMPLING_TYPE, out=self.delta_u[batch])
+            self.fused_trajectory_rollouts(self.S_tilde_k[batch], self.delta_u[batch])
+            num_evaluated = batch.stop
+            if perf_counter() >= deadline:
+                break
+        return num_evaluated
+
     def update_control_vector(self):
         """
         MPPI stores a vector of best-guess-so-far control inputs for future steps.
         When adjusting the horizon length, need to adjust this vector too.
         Init with zeros when lengthening, and slice when shortening horizon.
         """
-        update_length = min(mpc_horizon, self.u.size)
-        u_new = np.zeros((mpc_horizon), dtype=np.float32)
+        update_length = min(self.mpc_horizon, self.u.size)
+        u_new = np.zeros((self.mpc_horizon), dtype=np.float32)
         u_new[:update_length] = self.u[:update_length]
         self.u = u_new
         self.u_prev = np.copy(self.u)
 
     def controller_report(self):
-        if LOGGING:
+        if self.logging:
+            logger = self.logger
+            logger.flush()
+
             ### Plot the average state cost per iteration
-            ctglgs = np.stack(
-                LOGS.get("cost_to_go"), axis=0
-            )  # ITERATIONS x num_rollouts
-            NUM_ITERATIONS = np.shape(ctglgs)[0]
-            time_axis = update_every * dt * np.arange(start=0, stop=np.shape(ctglgs)[0])
+            # Only every logging_every-th update is logged, iterations holds the controller iteration of each of them
+            iterations = logger.load("iteration")  # ITERATIONS
+            NUM_ITERATIONS = np.shape(iterations)[0]
+            time_axis = self.dt * iterations
             plt.figure(num=2, figsize=(16, 9))
-            plt.plot(time_axis, np.mean(ctglgs, axis=1))
+            plt.plot(time_axis, logger.load("cost_to_go_mean"))
             plt.ylabel("Average Running Cost")
             plt.xlabel("time (s)")
             plt.title("Cost-to-go per Timestep")
             plt.show()
 
             ### Graph the different cost components per iteration
-            LOGS["cost_breakdown"]["cost_dd"] = np.stack(
-                LOGS.get("cost_breakdown").get("cost_dd"), axis=0
-            )  # ITERATIONS x mpc_horizon
-            LOGS["cost_breakdown"]["cost_ep"] = np.stack(
-                LOGS.get("cost_breakdown").get("cost_ep"), axis=0
-            )
-            LOGS["cost_breakdown"]["cost_ekp"] = np.stack(
-                LOGS.get("cost_breakdown").get("cost_ekp"), axis=0
-            )
-            LOGS["cost_breakdown"]["cost_ekc"] = np.stack(
-                LOGS.get("cost_breakdown").get("cost_ekc"), axis=0
-            )
-            LOGS["cost_breakdown"]["cost_cc"] = np.stack(
-                LOGS.get("cost_breakdown").get("cost_cc"), axis=0
-            )
-            LOGS["cost_breakdown"]["cost_ccrc"] = np.stack(
-                LOGS.get("cost_breakdown").get("cost_ccrc"), axis=0
-            )
-            time_axis = update_every * dt * np.arange(start=0, stop=NUM_ITERATIONS)
+            cost_breakdown = logger.load("cost_breakdown")  # ITERATIONS x 6 x mpc_horizon
+            cost_dd, cost_ep, cost_ekp, cost_ekc, cost_cc, cost_ccrc = np.moveaxis(cost_breakdown, 1, 0)
 
             plt.figure(num=3, figsize=(16, 9))
             plt.plot(
                 time_axis,
-                np.sum(LOGS.get("cost_breakdown").get("cost_dd"), axis=-1),
+                np.sum(cost_dd, axis=-1),
                 label="Distance difference cost",
             )
             plt.plot(
                 time_axis,
-                np.sum(LOGS.get("cost_breakdown").get("cost_ep"), axis=-1),
+                np.sum(cost_ep, axis=-1),
                 label="E_pot cost",
             )
             plt.plot(
                 time_axis,
-                np.sum(LOGS.get("cost_breakdown").get("cost_ekp"), axis=-1),
+                np.sum(cost_ekp, axis=-1),
                 label="E_kin_pole cost",
             )
             plt.plot(
                 time_axis,
-                np.sum(LOGS.get("cost_breakdown").get("cost_ekc"), axis=-1),
+                np.sum(cost_ekc, axis=-1),
                 label="E_kin_cart cost",
             )
             plt.plot(
                 time_axis,
-                np.sum(LOGS.get("cost_breakdown").get("cost_cc"), axis=-1),
+                np.sum(cost_cc, axis=-1),
                 label="Control cost",
             )
             plt.plot(
                 time_axis,
-                np.sum(LOGS.get("cost_breakdown").get("cost_ccrc"), axis=-1),
+                np.sum(cost_ccrc, axis=-1),
                 label="Control change rate cost",
             )
 
@@ -672,7 +1124,7 @@ class controller_mppi_cartpole(template_controller):
                 # Loop over all MC rollouts
                 for i in range(0, mc_rollouts, idx_interval):
                     ax_position.plot(
-                        (update_every * iteration + np.arange(0, horizon_length)) * dt,
+                        (self.update_every * iteration + np.arange(0, horizon_length)) * self.dt,
                         positions[i, :],
                         linestyle="-",
                         linewidth=1,
@@ -684,7 +1136,7 @@ class controller_mppi_cartpole(template_controller):
                         ),
                     )
                     ax_angle.plot(
-                        (update_every * iteration + np.arange(0, horizon_length)) * dt,
+                        (self.update_every * iteration + np.arange(0, horizon_length)) * self.dt,
                         angles[i, :] * 180.0 / np.pi,
                         linestyle="-",
                         linewidth=1,
@@ -697,24 +1149,22 @@ class controller_mppi_cartpole(template_controller):
                     )
 
             # Prepare data
-            # shape(slgs) = ITERATIONS x num_rollouts x mpc_horizon x STATE_VARIABLES
-            slgs = np.stack(LOGS.get("states"), axis=0)
-            wrap_angle_rad_inplace(slgs[:, :, :, ANGLE_IDX])
+            # The rollout states are large, they are read from disk only for the iteration selected with the slider
             # shape(iplgs) = ITERATIONS x mpc_horizon
-            iplgs = np.stack(LOGS.get("inputs"), axis=0)
+            iplgs = logger.load("inputs")
             # shape(nrlgs) = ITERATIONS x mpc_horizon x STATE_VARIABLES
-            nrlgs = np.stack(LOGS.get("nominal_rollouts"), axis=0)
+            nrlgs = logger.load("nominal_rollouts")
             wrap_angle_rad_inplace(nrlgs[:, :, ANGLE_IDX])
             # shape(trjctlgs) = (update_every * ITERATIONS) x STATE_VARIABLES
-            trjctlgs = np.stack(LOGS.get("trajectory")[:-1], axis=0)
+            trjctlgs = logger.load("trajectory")[:-1]
             wrap_angle_rad_inplace(trjctlgs[:, ANGLE_IDX])
             # shape(trgtlgs) = ITERATIONS x [position]
-            trgtlgs = np.stack(LOGS.get("target_trajectory")[:-1], axis=0)
+            trgtlgs = logger.load("target_trajectory")[:-1]
             # For each rollout, calculate what the nominal trajectory would be using the known true model
             # This can uncover if the model used makes inaccurate predictions
             # shape(true_nominal_rollouts) = ITERATIONS x mpc_horizon x [position, positionD, angle, angleD]
 
-            true_nominal_rollouts = predictor_ground_truth.predict(np.copy(nrlgs[:, 0, :]), iplgs)[:, :-1, :]
+            true_nominal_rollouts = self.predictor_ground_truth.predict(np.copy(nrlgs[:, 0, :]), iplgs)[:, :-1, :]
             wrap_angle_rad_inplace(true_nominal_rollouts[:, :, ANGLE_IDX])
 
             # Create figure
@@ -730,13 +1180,9 @@ class controller_mppi_cartpole(template_controller):
             # Create time slider
             slider_axis = plt.axes([0.15, 0.02, 0.7, 0.03])
             slider = Slider(
-                slider_axis, "timestep", 1, np.shape(slgs)[0], valinit=1, valstep=1
+                slider_axis, "timestep", 1, NUM_ITERATIONS, valinit=1, valstep=1
             )
 
-            # Normalize cost to go to use as opacity in plot
-            # shape(ctglgs) = ITERATIONS x num_rollouts
-            ctglgs = np.divide(ctglgs.T, np.max(np.abs(ctglgs), axis=1)).T
-
             # This function updates the plot when a new iteration is selected
             def update_plot(i):
                 i = int(i)
@@ -745,18 +1191,24 @@ class controller_mppi_cartpole(template_controller):
                 ax2.clear()
 
                 # Plot Monte Carlo rollouts
+                # shape(slgs) = logged rollouts x mpc_horizon x STATE_VARIABLES
+                slgs = logger.get("states", i - 1)
+                wrap_angle_rad_inplace(slgs[:, :, ANGLE_IDX])
+                # Normalize cost to go to use as opacity in plot
+                ctglgs = logger.get("cost_to_go", i - 1)
+                ctglgs = ctglgs / np.max(np.abs(ctglgs))
                 draw_rollouts(
-                    slgs[i - 1, :, :, ANGLE_IDX],
-                    slgs[i - 1, :, :, POSITION_IDX],
+                    slgs[:, :, ANGLE_IDX],
+                    slgs[:, :, POSITION_IDX],
                     ax1,
                     ax2,
-                    ctglgs[i - 1, :],
-                    i - 1,
+                    ctglgs,
+                    iterations[i - 1] // self.update_every,
                 )
 
                 # Plot the realized trajectory
                 ax1.plot(
-                    np.arange(0, np.shape(trjctlgs)[0]) * dt,
+                    np.arange(0, np.shape(trjctlgs)[0]) * self.dt,
                     trjctlgs[:, POSITION_IDX],
                     alpha=1.0,
                     linestyle="-",
@@ -765,7 +1217,7 @@ class controller_mppi_cartpole(template_controller):
                     label="realized trajectory",
                 )
                 ax2.plot(
-                    np.arange(0, np.shape(trjctlgs)[0]) * dt,
+                    np.arange(0, np.shape(trjctlgs)[0]) * self.dt,
                     trjctlgs[:, ANGLE_IDX] * 180.0 / np.pi,
                     alpha=1.0,
                     linestyle="-",
@@ -775,7 +1227,7 @@ class controller_mppi_cartpole(template_controller):
                 )
                 # Plot target positions
                 ax1.plot(
-                    np.arange(0, np.shape(trgtlgs)[0]) * dt,
+                    np.arange(0, np.shape(trgtlgs)[0]) * self.dt,
                     trgtlgs,
                     alpha=1.0,
                     linestyle="--",
@@ -785,7 +1237,7 @@ class controller_mppi_cartpole(template_controller):
                 )
                 # Plot trajectory planned by MPPI (= nominal trajectory)
                 ax1.plot(
-                    (update_every * (i - 1) + np.arange(0, np.shape(nrlgs)[1])) * dt,
+                    (iterations[i - 1] + np.arange(0, np.shape(nrlgs)[1])) * self.dt,
                     nrlgs[i - 1, :, POSITION_IDX],
                     alpha=1.0,
                     linestyle="-",
@@ -794,7 +1246,7 @@ class controller_mppi_cartpole(template_controller):
                     label="nominal trajectory\n(under trained model)",
                 )
                 ax2.plot(
-                    (update_every * (i - 1) + np.arange(0, np.shape(nrlgs)[1])) * dt,
+                    (iterations[i - 1] + np.arange(0, np.shape(nrlgs)[1])) * self.dt,
                     nrlgs[i - 1, :, ANGLE_IDX] * 180.0 / np.pi,
                     alpha=1.0,
                     linestyle="-",
@@ -805,10 +1257,10 @@ class controller_mppi_cartpole(template_controller):
                 # Plot the trajectory of rollout with cost-averaged nominal inputs if model were ideal
                 ax1.plot(
                     (
-                        update_every * (i - 1)
+                        iterations[i - 1]
                         + np.arange(0, np.shape(true_nominal_rollouts)[1])
                     )
-                    * dt,
+                    * self.dt,
                     true_nominal_rollouts[i - 1, :, POSITION_IDX],
                     alpha=1.0,
                     linestyle="--",
@@ -818,10 +1270,10 @@ class controller_mppi_cartpole(template_controller):
                 )
                 ax2.plot(
                     (
-                        update_every * (i - 1)
+                        iterations[i - 1]
                         + np.arange(0, np.shape(true_nominal_rollouts)[1])
                     )
-                    * dt,
+                    * self.dt,
                     true_nominal_rollouts[i - 1, :, ANGLE_IDX] * 180.0 / np.pi,
                     alpha=1.0,
                     linestyle="--",
@@ -830,7 +1282,7 @@ class controller_mppi_cartpole(template_controller):
                     label="nominal trajectory\n(under true model)",
                 )
                 # Set axis limits
-                ax1.set_xlim(0, np.shape(trjctlgs)[0] * dt)
+                ax1.set_xlim(0, np.shape(trjctlgs)[0] * self.dt)
                 ax1.set_ylim(-TrackHalfLength * 1.05, TrackHalfLength * 1.05)
                 ax2.set_ylim(-180.0, 180.0)
 
@@ -870,23 +1322,15 @@ class controller_mppi_cartpole(template_controller):
     # It is called after an experiment,
     # but only if the controller is supposed to be reused without reloading (e.g. in GUI)
     def controller_reset(self):
-        global LOGS
-        LOGS = {
-            "cost_to_go": [],
-            "cost_breakdown": {
-                "cost_dd": [],
-                "cost_ep": [],
-                "cost_ekp": [],
-                "cost_ekc": [],
-                "cost_cc": [],
-                "cost_ccrc": [],
-            },
-            "states": [],
-            "trajectory": [],
-            "target_trajectory": [],
-            "inputs": [],
-            "nominal_rollouts": [],
-        }
+        if self.logging:
+            self.logger.flush()
+            self.logger = self.create_logger()
+
+        if self.warm_start_library is not None:
+            if self.warm_start_record:
+                self.warm_start_library.save(self.warm_start_library_path)
+            self.warm_start_expected_features = None
+            self.settled_steps = 0
 
         self.warm_up_countdown = self.wash_out_len
 
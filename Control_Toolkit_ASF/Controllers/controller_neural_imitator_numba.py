@@ -0,0 +1,49 @@
+"""
+Neural imitator evaluated with the numba inference engine of neural_imitator_numba instead of Tensorflow/Pytorch.
+
+The network is exported once from models_for_neural_imitator_tf to an .npz file next to it.
+A step takes microseconds, the framework dispatch of neural-imitator dominates its 2-3k multiply-accumulates.
+"""
+
+import os
+
+import numpy as np
+
+from CartPole.state_utilities import STATE_INDICES
+from Control_Toolkit.Controllers import template_controller
+from Control_Toolkit_ASF.Controllers.neural_imitator_numba import NeuralImitatorNumba, export_network
+from SI_Toolkit.computation_library import NumpyLibrary, TensorType
+
+
+class controller_neural_imitator_numba(template_controller):
+    _computation_library = NumpyLibrary
+
+    def configure(self):
+        path_to_model = os.path.join(self.config_controller["PATH_TO_MODELS"], self.config_controller["net_name"])
+        path_to_export = os.path.join(path_to_model, self.config_controller["net_name"] + '.npz')
+        if not os.path.isfile(path_to_export):
+            export_network(path_to_model, path_to_export)
+
+        self.net = NeuralImitatorNumba(path_to_export, self.config_controller["input_precision"],
+                                       self.config_controller["quantize_activations"])
+        self.net_input = np.zeros(len(self.net.inputs), dtype=np.float32)
+        self.Q_prev = 0.0
+
+    def step(self, s: np.ndarray, time=None, updated_attributes: "dict[str, TensorType]" = {}):
+        self.update_attributes(updated_attributes)
+
+        for i, name in enumerate(self.net.inputs):
+            if name in STATE_INDICES:
+                self.net_input[i] = s[STATE_INDICES[name]]
+            elif name == 'Q':
+                self.net_input[i] = self.Q_prev
+            else:  # Setpoints, e.g. target_position, target_equilibrium
+                self.net_input[i] = getattr(self.variable_parameters, name)
+
+        Q = np.clip(np.float32(self.net.step(self.net_input)[0]), -1.0, 1.0)
+        self.Q_prev = Q
+        return Q
+
+    def controller_reset(self):
+        self.net.reset()
+        self.Q_prev = 0.0
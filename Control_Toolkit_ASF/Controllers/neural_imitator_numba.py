@@ -0,0 +1,253 @@
+"""
+Lightweight inference of the neural imitator networks (GRU and Dense, as trained with SI_Toolkit) with numba.
+
+The exporter reads the weights of a Tensorflow checkpoint from models_for_neural_imitator_tf into one flat array
+and folds the input normalization into the first layer and the output denormalization into the last one.
+The engine evaluates a single sample in one compiled call, keeping the hidden states of the GRU layers between calls.
+Optionally the fixed point number format of the FPGA implementation (e.g. 'ap_fixed<20,6>') is emulated,
+with the quantization and overflow modes of the HLS ap_fixed type (default AP_TRN and AP_WRAP, as in hls4ml).
+
+Run this file to export a network:
+    python -m Control_Toolkit_ASF.Controllers.neural_imitator_numba ./Control_Toolkit_ASF/Controllers/models_for_neural_imitator_tf/GRU-6IN-32H1-32H2-1OUT-4
+"""
+
+import glob
+import os
+import re
+
+import numpy as np
+from numba import jit
+
+# Layer types in the layer table
+GRU, DENSE_TANH, DENSE_LINEAR = 0, 1, 2
+
+
+def read_net_info(path_to_model):
+    """Returns (inputs, outputs, path to normalization csv) from the .txt file saved with a network by SI_Toolkit"""
+    net_name = os.path.basename(os.path.normpath(path_to_model))
+    with open(os.path.join(path_to_model, net_name + '.txt')) as f:
+        sections = re.split(r'\n\s*\n', f.read())
+    info = {}
+    for section in sections:
+        lines = section.strip().splitlines()
+        if lines and lines[0].endswith(':'):
+            info[lines[0][:-1]] = ' '.join(lines[1:]).strip()
+    inputs = [name.strip() for name in info['INPUTS'].split(',')]
+    outputs = [name.strip() for name in info['OUTPUTS'].split(',')]
+    # The normalization file is stored with the model, the path in the .txt points to the training experiment
+    normalization = glob.glob(os.path.join(path_to_model, 'NI_*.csv'))
+    return inputs, outputs, normalization[0] if normalization else None
+
+
+def minmax_sym_coefficients(path_to_normalization, features):
+    """(scale, offset) such that scale * x + offset maps [min, max] of every feature to [-1, 1] (SI_Toolkit 'minmax_sym')"""
+    with open(path_to_normalization) as f:
+        rows = [line.strip().split(',') for line in f if line.strip() and not line.startswith('#')]
+    header, statistics = rows[0], {row[0]: row for row in rows[1:]}
+    scale, offset = np.empty(len(features)), np.empty(len(features))
+    for i, feature in enumerate(features):
+        column = header.index(feature)
+        minimum, maximum = float(statistics['min'][column]), float(statistics['max'][column])
+        scale[i] = 2.0 / (maximum - minimum)
+        offset[i] = -1.0 - minimum * scale[i]
+    return scale, offset
+
+
+def export_network(path_to_model, path_to_export=None):
+    """
+    Reads the weights of the Tensorflow network saved in path_to_model, folds the normalization in
+    and saves them with the layer table to path_to_export (default: <path_to_model>/<net name>.npz).
+
+    GRU layers are Keras GRU with reset_after=True, Dense layers have tanh activation except for the linear output layer,
+    as composed by SI_Toolkit.
+    """
+    import tensorflow as tf
+
+    net_name = os.path.basename(os.path.normpath(path_to_model))
+    inputs, outputs, path_to_normalization = read_net_info(path_to_model)
+    reader = tf.train.load_checkpoint(os.path.join(path_to_model, 'ckpt.ckpt'))
+    variables = reader.get_variable_to_shape_map()
+
+    def get(layer, name):
+        return reader.get_tensor('layer_with_weights-{}/{}/.ATTRIBUTES/VARIABLE_VALUE'.format(layer, name)).astype(np.float64)
+
+    layers = []
+    layer = 0
+    while any(key.startswith('layer_with_weights-{}/'.format(layer)) for key in variables):
+        if 'layer_with_weights-{}/cell/kernel/.ATTRIBUTES/VARIABLE_VALUE'.format(layer) in variables:
+            bias = get(layer, 'cell/bias')
+            layers.append([GRU, get(layer, 'cell/kernel'), get(layer, 'cell/recurrent_kernel'), bias[0], bias[1]])
+        else:
+            layers.append([DENSE_TANH, get(layer, 'kernel'), get(layer, 'bias')])
+        layer += 1
+    layers[-1][0] = DENSE_LINEAR
+
+    if path_to_normalization is not None:
+        # Input: kernel @ (scale * x + offset) = (scale * kernel) @ x + kernel @ offset
+        scale, offset = minmax_sym_coefficients(path_to_normalization, inputs)
+        first = layers[0]
+        bias = 3 if first[0] == GRU else 2  # Index of the bias added to the input projection
+        first[bias] = first[bias] + offset @ first[1]
+        first[1] = scale[:, np.newaxis] * first[1]
+        # Output: x = (y - offset) / scale
+        scale, offset = minmax_sym_coefficients(path_to_normalization, outputs)
+        layers[-1][1] = layers[-1][1] / scale
+        layers[-1][2] = (layers[-1][2] - offset) / scale
+
+    # Layer table: type, inputs, units, offset in weights, offset in hidden states
+    table = np.zeros((len(layers), 5), dtype=np.int64)
+    weights, weights_offset, state_offset, n_in = [], 0, 0, len(inputs)
+    for i, (layer_type, *arrays) in enumerate(layers):
+        units = arrays[0].shape[1] // 3 if layer_type == GRU else arrays[0].shape[1]
+        table[i] = layer_type, n_in, units, weights_offset, state_offset
+        for array in arrays:
+            weights.append(array.ravel())
+            weights_offset += array.size
+        if layer_type == GRU:
+            state_offset += units
+        n_in = units
+
+    if path_to_export is None:
+        path_to_export = os.path.join(path_to_model, net_name + '.npz')
+    np.savez(path_to_export, weights=np.concatenate(weights).astype(np.float32), layers=table,
+             inputs=np.array(inputs), outputs=np.array(outputs))
+    return path_to_export
+
+
+# Supported quantization (rounding) and overflow modes of ap_fixed, the first ones are the defaults
+QUANTIZATION_MODES = ['AP_TRN', 'AP_RND']
+OVERFLOW_MODES = ['AP_WRAP', 'AP_SAT']
+
+
+def fixed_point_format(precision):
+    """
+    [step, minimum, maximum, quantization mode, overflow mode] (modes as indices of QUANTIZATION_MODES and OVERFLOW_MODES)
+    of the number format 'ap_fixed<total bits, integer bits including sign[, quantization mode[, overflow mode]]>',
+    zeros (no quantization) for 'float'
+    """
+    if precision == 'float':
+        return np.zeros(5, dtype=np.float32)
+    match = re.fullmatch(r'ap_fixed<\s*(\d+)\s*,\s*(\d+)\s*(?:,\s*(\w+)\s*)?(?:,\s*(\w+)\s*)?>', precision)
+    if match is None or (match.group(3) or 'AP_TRN') not in QUANTIZATION_MODES or (match.group(4) or 'AP_WRAP') not in OVERFLOW_MODES:
+        raise ValueError("Precision must be 'float' or 'ap_fixed<total bits, integer bits[, {}[, {}]]>', got {}".format(
+            '/'.join(QUANTIZATION_MODES), '/'.join(OVERFLOW_MODES), precision))
+    total_bits, integer_bits = int(match.group(1)), int(match.group(2))
+    step = 2.0 ** (integer_bits - total_bits)
+    return np.array([step, -2.0 ** (integer_bits - 1), 2.0 ** (integer_bits - 1) - step,
+                     QUANTIZATION_MODES.index(match.group(3) or 'AP_TRN'), OVERFLOW_MODES.index(match.group(4) or 'AP_WRAP')],
+                    dtype=np.float32)
+
+
+@jit(nopython=True, nogil=True, cache=True, fastmath=True)
+def quantize(x, fixed_point):
+    """
+    Rounds x in place to the fixed point grid, towards minus infinity (AP_TRN) or to the nearest value (AP_RND),
+    and brings overflowing values into range by dropping the upper bits (AP_WRAP) or by saturation (AP_SAT)
+    """
+    step, minimum, maximum = fixed_point[0], fixed_point[1], fixed_point[2]
+    if step > 0.0:
+        offset = 0.5 if fixed_point[3] == 1.0 else 0.0
+        for i in range(x.size):
+            value = np.floor(x[i] / step + offset) * step
+            if fixed_point[4] == 1.0:
+                value = min(max(value, minimum), maximum)
+            else:
+                value = minimum + np.mod(value - minimum, maximum - minimum + step)
+            x[i] = value
+
+
+@jit(nopython=True, nogil=True, cache=True, fastmath=True)
+def network_step(x, weights, layers, hidden_states, buffer_in, buffer_out, fixed_point, quantize_activations):
+    """
+    Evaluates the network for a single sample x, updating hidden_states of the GRU layers in place.
+    buffer_in and buffer_out are work arrays of at least the largest layer width.
+
+    :return: The network output, a view of a work array
+    """
+    n = x.size
+    buffer_in[:n] = x
+    quantize(buffer_in[:n], fixed_point)
+
+    for layer in range(layers.shape[0]):
+        layer_type, n_in, units, w, s = layers[layer, 0], layers[layer, 1], layers[layer, 2], layers[layer, 3], layers[layer, 4]
+        h_out = buffer_out[:units]
+        if layer_type == GRU:
+            # Keras GRU with reset_after=True, gates in order update (z), reset (r), candidate (h)
+            kernel = weights[w: w + n_in * 3 * units].reshape((n_in, 3 * units))
+            w += n_in * 3 * units
+            recurrent_kernel = weights[w: w + units * 3 * units].reshape((units, 3 * units))
+            w += units * 3 * units
+            input_bias = weights[w: w + 3 * units]
+            recurrent_bias = weights[w + 3 * units: w + 6 * units]
+            h = hidden_states[s: s + units]
+            for j in range(units):
+                x_z, x_r, x_h = input_bias[j], input_bias[units + j], input_bias[2 * units + j]
+                for i in range(n_in):
+                    x_z += buffer_in[i] * kernel[i, j]
+                    x_r += buffer_in[i] * kernel[i, units + j]
+                    x_h += buffer_in[i] * kernel[i, 2 * units + j]
+                h_z, h_r, h_h = recurrent_bias[j], recurrent_bias[units + j], recurrent_bias[2 * units + j]
+                for i in range(units):
+                    h_z += h[i] * recurrent_kernel[i, j]
+                    h_r += h[i] * recurrent_kernel[i, units + j]
+                    h_h += h[i] * recurrent_kernel[i, 2 * units + j]
+                z = 1.0 / (1.0 + np.exp(-(x_z + h_z)))
+                r = 1.0 / (1.0 + np.exp(-(x_r + h_r)))
+                candidate = np.tanh(x_h + r * h_h)
+                h_out[j] = z * h[j] + (1.0 - z) * candidate
+            h[:] = h_out  # All units computed from the previous hidden state before it is overwritten
+        else:
+            kernel = weights[w: w + n_in * units].reshape((n_in, units))
+            bias = weights[w + n_in * units: w + n_in * units + units]
+            for j in range(units):
+                value = bias[j]
+                for i in range(n_in):
+                    value += buffer_in[i] * kernel[i, j]
+                h_out[j] = np.tanh(value) if layer_type == DENSE_TANH else value
+        if quantize_activations:
+            quantize(h_out, fixed_point)
+        buffer_in, buffer_out = buffer_out, buffer_in
+
+    return buffer_in[:layers[-1, 2]]
+
+
+class NeuralImitatorNumba:
+    """Stateful single-sample inference of an exported network, see export_network"""
+
+    def __init__(self, path_to_export, precision='float', quantize_activations=False):
+        """
+        :param precision: 'float' or 'ap_fixed<total bits, integer bits[, quantization mode[, overflow mode]]>'
+            emulated for the (unnormalized) inputs, see fixed_point_format
+        :param quantize_activations: Emulate the fixed point format also for the outputs of every layer
+        """
+        data = np.load(path_to_export)
+        self.weights = data['weights']
+        self.layers = data['layers']
+        self.inputs = [str(name) for name in data['inputs']]
+        self.outputs = [str(name) for name in data['outputs']]
+
+        self.fixed_point = fixed_point_format(precision)
+        self.quantize_activations = quantize_activations
+
+        gru_layers = self.layers[self.layers[:, 0] == GRU]
+        self.hidden_states = np.zeros(int(np.sum(gru_layers[:, 2])), dtype=np.float32)
+        width = max(len(self.inputs), int(np.max(self.layers[:, 2])))
+        self.buffer_in = np.zeros(width, dtype=np.float32)
+        self.buffer_out = np.zeros(width, dtype=np.float32)
+
+    def step(self, x):
+        """:param x: Network inputs in the order of self.inputs. :return: Network outputs, copy it to keep it beyond the next step"""
+        return network_step(np.asarray(x, dtype=np.float32), self.weights, self.layers, self.hidden_states,
+                            self.buffer_in, self.buffer_out, self.fixed_point, self.quantize_activations)
+
+    def reset(self):
+        self.hidden_states[:] = 0.0
+
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) < 2:
+        print('Usage: python -m Control_Toolkit_ASF.Controllers.neural_imitator_numba path_to_model [path_to_export]')
+        sys.exit(1)
+    print('Exported to {}'.format(export_network(*sys.argv[1:3])))
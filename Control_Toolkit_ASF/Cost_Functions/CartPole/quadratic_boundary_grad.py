@@ -2,12 +2,12 @@ import os
 from yaml import safe_load
 
 from SI_Toolkit.computation_library import TensorType
-from Control_Toolkit.Cost_Functions import cost_function_base
+from Control_Toolkit_ASF.Cost_Functions.cartpole_cost_engine import cartpole_cost_function_base, term_weights
 
 from others.globals_and_utils import load_config
 
-from CartPole.cartpole_parameters import TrackHalfLength, u_max
-from CartPole.state_utilities import ANGLE_IDX, ANGLED_IDX, POSITION_IDX
+from CartPole.cartpole_parameters import u_max
+from CartPole.state_utilities import ANGLE_IDX
 
 import numpy as np
 
@@ -30,45 +30,37 @@ ccrc_weight = config["CartPole"]["quadratic_boundary_grad"]["ccrc_weight"]
 R = config["CartPole"]["quadratic_boundary_grad"]["R"]
 
 
-class quadratic_boundary_grad(cost_function_base):
+CONFIG_WEIGHTS = {  # Initial values, see update_weights
+    'dd_weight': dd_weight,
+    'db_weight': db_weight,
+    'ep_weight': ep_weight,
+    'ekp_weight': ekp_weight,
+    'cc_weight': cc_weight,
+    'ccrc_weight': ccrc_weight,
+    'R': R,
+}
+
+
+def cost_weights(dd_weight, db_weight, ep_weight, ekp_weight, cc_weight, ccrc_weight, R):
+    """Weights of the cost engine terms from the weights named as in config_cost_function.yml"""
+    return term_weights(
+        distance_abs=dd_weight,
+        boundary_quadratic=db_weight,  # Soft constraint: Do not crash into border
+        E_pot_shifted=ep_weight,
+        E_kin_pole=ekp_weight,
+        control=cc_weight * R,
+        control_change_rate=ccrc_weight,
+    )
+
+
+class quadratic_boundary_grad(cartpole_cost_function_base):
     MAX_COST = dd_weight * 1.0e7 + ep_weight + ekp_weight * 25.0 + cc_weight * R * (u_max ** 2) + ccrc_weight * 4 * (u_max ** 2)
 
-    # cost for distance from track edge
-    # def _distance_difference_cost(self, position):
-    #     """Compute penalty for distance of cart to the target position"""
-    #     target_distance_cost = (
-    #         (position - self.variable_parameters.target_position) / (2.0 * TrackHalfLength)) ** 2
-    #
-    #     return target_distance_cost
-
-    def _distance_difference_cost(self, position):
-        """Compute penalty for distance of cart to the target position"""
-        target_distance_cost = self.lib.abs(
-            (position - self.variable_parameters.target_position) / (2.0 * TrackHalfLength))
-
-        return target_distance_cost
-
-    def _boundary_approach_cost(self, position):
-        """Compute penalty for approaching the boundary"""
-        # Soft constraint: Do not crash into border
-        too_near_to_the_boundary = self.lib.cast(self.lib.abs(position) > permissible_track_fraction * TrackHalfLength, self.lib.float32)
-        return too_near_to_the_boundary * (
-                (self.lib.abs(position) - permissible_track_fraction * TrackHalfLength) / (
-                    (1 - permissible_track_fraction) * TrackHalfLength)
-        ) ** 2
-
-    # cost for difference from upright position
-    def _E_pot_cost(self, angle):
-        """Compute penalty for not balancing pole upright (penalize large angles)"""
-        return 0.25 * (2.0 - self.lib.cos(angle + (1.0-self.variable_parameters.target_equilibrium)*self.lib.pi/2.0)) ** 2
-
-    def _E_kin_cost(self, angleD):
-        """Compute penalty for not balancing pole upright (penalize large angles)"""
-        return angleD ** 2
-
-    # actuation cost
-    def _CC_cost(self, u):
-        return R * self.lib.sum(u**2, 2)
+    CONFIG_WEIGHTS = CONFIG_WEIGHTS
+    cost_weights = staticmethod(cost_weights)
+    BOUNDARY_FRACTION = permissible_track_fraction
+    ANALYTIC_GRADIENT = True
+    TUNABLE_TERMS = ('distance_abs', 'boundary_quadratic', 'E_pot_shifted', 'E_kin_pole', 'control', 'control_change_rate')
 
     # final stage cost
     def get_terminal_cost(self, terminal_states: TensorType):
@@ -85,46 +77,21 @@ class quadratic_boundary_grad(cost_function_base):
         :return: One terminal cost per rollout
         :rtype: np.ndarray
         """
-        # terminal_cost = 10000 * self.lib.cast(
-        #     (self.lib.abs(terminal_states[:, ANGLE_IDX]) > 0.2)
-        #     | (
-        #         self.lib.abs(terminal_states[:, POSITION_IDX] - self.variable_parameters.target_position)
-        #         > 0.1 * TrackHalfLength
-        #     ),
-        #     self.lib.float32,
-        # )
+        # return self.engine.indicator_terminal_cost(terminal_states, self.variable_parameters.target_position)
         terminal_cost = self.lib.zeros_like(terminal_states[:, ANGLE_IDX])
         return self.lib.reshape(terminal_cost, (-1, 1))
 
-    # cost of changing control to fast
-    def _control_change_rate_cost(self, u, u_prev):
-        """Compute penalty of control jerk, i.e. difference to previous control input"""
-        u_prev_vec = self.lib.concat(
-            (self.lib.ones((u.shape[0], 1, u.shape[2])) * u_prev, u[:, :-1, :]), 1
-        )
-        return self.lib.sum((u - u_prev_vec) ** 2, 2)
-
     # all stage costs together
     def get_stage_cost(self, states: TensorType, inputs: TensorType, previous_input: TensorType):
-        dd = dd_weight * self._distance_difference_cost(
-            states[:, :, POSITION_IDX]
-        )
-        db = db_weight * self._boundary_approach_cost(states[:, :, POSITION_IDX])
-        ep = ep_weight * self._E_pot_cost(states[:, :, ANGLE_IDX])
-        ekp = ekp_weight * self._E_kin_cost(states[:, :, ANGLED_IDX])
-        cc = cc_weight * self._CC_cost(inputs)
-        ccrc = ccrc_weight * self._control_change_rate_cost(inputs, previous_input)
-        stage_cost = dd + db + ep + ekp + cc + ccrc
-        return stage_cost
+        return self._get_stage_cost(states, inputs, previous_input)
 
     def q_debug(self, s, u, u_prev):
-        dd = dd_weight * self._distance_difference_cost(
-            s[:, :, POSITION_IDX]
+        terms = self.engine.term_breakdown(
+            s, u, u_prev, self.variable_parameters.target_position, self.variable_parameters.target_equilibrium
         )
-        ep = ep_weight * self._E_pot_cost(s[:, :, ANGLE_IDX])
-        cc = cc_weight * self._CC_cost(u)
-        ccrc = 0
-        if u_prev is not None:
-            ccrc = ccrc_weight * self._control_change_rate_cost(u, u_prev)
+        dd = terms.get('distance_abs', 0)
+        ep = terms.get('E_pot_shifted', 0)
+        cc = terms.get('control', 0)
+        ccrc = terms.get('control_change_rate', 0)
         stage_cost = dd + ep + cc + ccrc
         return stage_cost, dd, ep, cc, ccrc
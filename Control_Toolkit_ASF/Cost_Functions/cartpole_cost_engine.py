@@ -0,0 +1,404 @@
+"""
+Cost engine shared by the CartPole cost function variants.
+
+A variant is declared as a set of weighted terms (see TERMS), the engine evaluates all of them in one pass:
+the intermediates used by several terms (distance to target, |position|, cos(angle), boundary mask) are computed once.
+- Numpy: a numba kernel loops over rollouts and horizon steps and accumulates the weighted terms in place,
+  without temporary arrays; the control change rate is computed from neighbouring inputs without concatenation.
+- TF / PyTorch: the terms are computed with self.lib in one function compiled with CompileAdaptive,
+  terms with zero weight are left out of the graph.
+  With analytic_gradient the TF stage cost gets its gradient with respect to states and inputs
+  from the hand-derived derivatives of the terms (stage_cost_vjp) instead of from autodiff.
+The weights are held by the engine instance as a variable of the computation library (a plain array for numpy)
+and read at every call, so they can be changed with set_weights / update_weights without retracing compiled graphs.
+The target position and equilibrium are passed at every call and are likewise not baked into the graphs.
+
+cartpole_cost_function_base is the base of the cost function variants: a variant only declares its weights,
+how they map to the TERMS and the engine options.
+"""
+
+import numpy as np
+from numba import jit
+
+from SI_Toolkit.computation_library import NumpyLibrary, TensorFlowLibrary, TensorType
+from SI_Toolkit.Functions.TF.Compile import CompileAdaptive
+from Control_Toolkit.Cost_Functions import cost_function_base
+
+from CartPole.cartpole_parameters import TrackHalfLength
+from CartPole.state_utilities import ANGLE_IDX, ANGLED_IDX, POSITION_IDX
+
+TERMS = (
+    'distance_quadratic',  # ((position - target) / track length) ** 2
+    'distance_abs',  # |position - target| / track length
+    'distance_nonconvex',  # -0.15 * (cos(8 pi (position - target) / track length) - 1)
+    'boundary_step',  # 1 if |position| > boundary_fraction * TrackHalfLength
+    'boundary_quadratic',  # Squared penetration beyond boundary_fraction * TrackHalfLength, normalized to the remaining track
+    'E_pot',  # target_equilibrium * 0.25 * (1 - cos(angle)) ** 2
+    'E_pot_shifted',  # 0.25 * (2 - cos(angle + (1 - target_equilibrium) * pi / 2)) ** 2
+    'E_kin_pole',  # angleD ** 2
+    'control',  # sum(u ** 2) over control inputs
+    'control_change_rate',  # sum((u - u at previous step) ** 2), u_prev at the first step; skipped if no previous input
+)
+
+TRACK_HALF_LENGTH = float(TrackHalfLength)
+
+
+def term_weights(**weights) -> np.ndarray:
+    """Weights of all TERMS as array, terms not given are not used"""
+    unknown = set(weights) - set(TERMS)
+    if unknown:
+        raise ValueError('Unknown cost terms: {}'.format(unknown))
+    return np.array([weights.get(term, 0.0) for term in TERMS], dtype=np.float32)
+
+
+@jit(nopython=True, nogil=True, cache=True, fastmath=True)
+def stage_costs_numba(states, inputs, u_prev, has_u_prev, target_position, target_equilibrium,
+                      weights, boundary_fraction, out):
+    """Fill out (batch x horizon) with the weighted sum of the cost terms, see TERMS for their order."""
+    track_length = 2.0 * TRACK_HALF_LENGTH
+    boundary = boundary_fraction * TRACK_HALF_LENGTH
+    remaining_track = (1.0 - boundary_fraction) * TRACK_HALF_LENGTH
+    shift = (1.0 - target_equilibrium) * np.pi / 2.0
+    need_cos = weights[5] != 0.0
+
+    for i in range(states.shape[0]):
+        for j in range(states.shape[1]):
+            position = states[i, j, POSITION_IDX]
+            angle = states[i, j, ANGLE_IDX]
+
+            distance = (position - target_position) / track_length
+            abs_position = np.abs(position)
+            near_boundary = abs_position > boundary
+
+            cost = 0.0
+            if weights[0] != 0.0:
+                cost += weights[0] * distance ** 2
+            if weights[1] != 0.0:
+                cost += weights[1] * np.abs(distance)
+            if weights[2] != 0.0:
+                cost += weights[2] * -0.15 * (np.cos(4.0 * 2.0 * np.pi * distance) - 1.0)
+            if near_boundary:
+                if weights[3] != 0.0:
+                    cost += weights[3]
+                if weights[4] != 0.0:
+                    cost += weights[4] * ((abs_position - boundary) / remaining_track) ** 2
+            if need_cos:
+                cost += weights[5] * target_equilibrium * 0.25 * (1.0 - np.cos(angle)) ** 2
+            if weights[6] != 0.0:
+                cost += weights[6] * 0.25 * (2.0 - np.cos(angle + shift)) ** 2
+            if weights[7] != 0.0:
+                cost += weights[7] * states[i, j, ANGLED_IDX] ** 2
+            for k in range(inputs.shape[2]):
+                u = inputs[i, j, k]
+                if weights[8] != 0.0:
+                    cost += weights[8] * u ** 2
+                if weights[9] != 0.0 and has_u_prev:
+                    du = u - (inputs[i, j - 1, k] if j > 0 else u_prev[k])
+                    cost += weights[9] * du ** 2
+            out[i, j] = cost
+    return out
+
+
+class CartPoleCostEngine:
+    def __init__(self, lib, weights: np.ndarray, boundary_fraction: float = 0.95, analytic_gradient: bool = False,
+                 tunable_terms=()):
+        """
+        :param lib: Computation library of the cost function
+        :param weights: Initial weights of the TERMS, see term_weights
+        :param boundary_fraction: Fraction of TrackHalfLength beyond which the boundary terms apply
+        :param analytic_gradient: With Tensorflow, differentiate the stage cost with stage_cost_vjp
+        :param tunable_terms: Terms computed even if their initial weight is zero, so that they can be switched on with set_weights
+        """
+        self.lib = lib
+        self.numba_backend = lib is NumpyLibrary
+        self.analytic_gradient = analytic_gradient and lib is TensorFlowLibrary
+        self.boundary_fraction = float(boundary_fraction)
+
+        self.weights_numpy = np.array(weights, dtype=np.float32)
+        if self.numba_backend:
+            self.weights = self.weights_numpy  # Passed to the numba kernel, updated in place
+        else:
+            self.weights = lib.to_variable(self.weights_numpy, lib.float32)
+        self.no_previous_input = np.zeros(1, dtype=np.float32)  # Placeholder for the numba kernel, not read
+        # Terms traced into the compiled graphs, fixed for the lifetime of the engine
+        self.used_terms = {term for term, weight in zip(TERMS, self.weights_numpy) if weight != 0.0} | set(tunable_terms)
+
+    def set_weights(self, weights: np.ndarray):
+        """Hot update of all term weights, e.g. while tuning on the running system. No graph is retraced.
+
+        :param weights: Weights of the TERMS, see term_weights.
+            With TF / PyTorch only the used terms (nonzero initial weight or tunable) may get a nonzero weight.
+        """
+        weights = np.asarray(weights, dtype=np.float32)
+        if not self.numba_backend:
+            new_terms = {term for term, weight in zip(TERMS, weights) if weight != 0.0} - self.used_terms
+            if new_terms:
+                raise ValueError('Cost terms {} are not in the compiled graph, '
+                                 'create the engine with them in tunable_terms to tune them'.format(new_terms))
+        self.weights_numpy[...] = weights
+        if not self.numba_backend:
+            self.lib.assign(self.weights, self.lib.to_tensor(self.weights_numpy, self.lib.float32))
+
+    def update_weights(self, **weights):
+        """Hot update of the given term weights, the others are kept, e.g. update_weights(E_pot=1000.0)"""
+        unknown = set(weights) - set(TERMS)
+        if unknown:
+            raise ValueError('Unknown cost terms: {}'.format(unknown))
+        new_weights = np.copy(self.weights_numpy)
+        for term, weight in weights.items():
+            new_weights[TERMS.index(term)] = weight
+        self.set_weights(new_weights)
+
+    def get_weights(self) -> dict:
+        return {term: float(weight) for term, weight in zip(TERMS, self.weights_numpy)}
+
+    def stage_cost(self, states: TensorType, inputs: TensorType, previous_input: TensorType,
+                   target_position, target_equilibrium, out: np.ndarray = None):
+        """Weighted sum of the terms at each horizon step, shape (batch x horizon)
+
+        :param out: Numpy only, float32 array of shape (batch x horizon) the stage costs are written to, allocated if None
+        """
+        if self.numba_backend:
+            has_u_prev = previous_input is not None
+            u_prev = self.no_previous_input if not has_u_prev else \
+                np.asarray(previous_input, dtype=np.float32).reshape(-1)
+            if out is None:
+                out = np.empty(states.shape[:2], dtype=np.float32)
+            return stage_costs_numba(states, inputs, u_prev, has_u_prev, float(target_position),
+                                     float(target_equilibrium), self.weights, self.boundary_fraction, out)
+        if self.analytic_gradient:
+            return self._stage_cost_with_analytic_gradient(
+                states, inputs, previous_input, target_position, target_equilibrium
+            )
+        terms = self.term_costs(states, inputs, previous_input, target_position, target_equilibrium)
+        return self._weighted_sum(terms)
+
+    def _stage_cost_with_analytic_gradient(self, states, inputs, previous_input, target_position, target_equilibrium):
+        import tensorflow as tf
+
+        # Read the variables outside of the custom gradient function
+        weights = tf.convert_to_tensor(self.weights)
+        target_position = tf.convert_to_tensor(target_position, dtype=tf.float32)
+        target_equilibrium = tf.convert_to_tensor(target_equilibrium, dtype=tf.float32)
+        if previous_input is not None:
+            previous_input = tf.convert_to_tensor(previous_input, dtype=tf.float32)
+
+        @tf.custom_gradient
+        def stage_cost(states, inputs):
+            terms = self.term_costs(states, inputs, previous_input, target_position, target_equilibrium)
+
+            def grad(upstream):
+                return self.stage_cost_vjp(
+                    upstream, states, inputs, previous_input, target_position, target_equilibrium, weights
+                )
+
+            return self._weighted_sum(terms, weights), grad
+
+        return stage_cost(states, inputs)
+
+    @CompileAdaptive
+    def stage_cost_vjp(self, upstream: TensorType, states: TensorType, inputs: TensorType, previous_input: TensorType,
+                       target_position, target_equilibrium, weights):
+        """Gradient of sum(upstream * stage cost) with respect to states and inputs,
+        from the hand-derived derivatives of the terms. upstream has shape (batch x horizon), weights those of the TERMS."""
+        lib = self.lib
+        used = self.used_terms
+        w = {term: weights[i] for i, term in enumerate(TERMS)}
+        position = states[:, :, POSITION_IDX]
+        angle = states[:, :, ANGLE_IDX]
+        zeros = lib.zeros_like(position)
+
+        track_length = 2.0 * TrackHalfLength
+        distance = (position - target_position) / track_length
+        d_position = zeros
+        if 'distance_quadratic' in used:
+            d_position += w['distance_quadratic'] * 2.0 * distance / track_length
+        if 'distance_abs' in used:
+            d_position += w['distance_abs'] * lib.sign(distance) / track_length
+        if 'distance_nonconvex' in used:
+            d_position += w['distance_nonconvex'] * 0.15 * 8.0 * lib.pi * lib.sin(8.0 * lib.pi * distance) / track_length
+        if 'boundary_quadratic' in used:
+            boundary = self.boundary_fraction * TrackHalfLength
+            near_boundary = lib.cast(lib.abs(position) > boundary, lib.float32)
+            d_position += w['boundary_quadratic'] * near_boundary * 2.0 * (lib.abs(position) - boundary) * lib.sign(position) \
+                / ((1.0 - self.boundary_fraction) * TrackHalfLength) ** 2
+        # boundary_step is piecewise constant
+
+        d_angle = zeros
+        if 'E_pot' in used:
+            d_angle += w['E_pot'] * target_equilibrium * 0.5 * (1.0 - lib.cos(angle)) * lib.sin(angle)
+        if 'E_pot_shifted' in used:
+            shifted_angle = angle + (1.0 - target_equilibrium) * lib.pi / 2.0
+            d_angle += w['E_pot_shifted'] * 0.5 * (2.0 - lib.cos(shifted_angle)) * lib.sin(shifted_angle)
+
+        d_angleD = zeros
+        if 'E_kin_pole' in used:
+            d_angleD += w['E_kin_pole'] * 2.0 * states[:, :, ANGLED_IDX]
+
+        d_states = [zeros] * states.shape[-1]
+        d_states[POSITION_IDX], d_states[ANGLE_IDX], d_states[ANGLED_IDX] = d_position, d_angle, d_angleD
+        upstream = upstream[:, :, lib.newaxis]
+        grad_states = upstream * lib.stack(d_states, -1)
+
+        grad_inputs = lib.zeros_like(inputs)
+        if 'control' in used:
+            grad_inputs += upstream * w['control'] * 2.0 * inputs
+        if 'control_change_rate' in used and previous_input is not None:
+            u_prev_vec = lib.concat(
+                (lib.ones((inputs.shape[0], 1, inputs.shape[2])) * previous_input, inputs[:, :-1, :]), 1
+            )
+            # The change at step j enters the cost of step j with u_j and with -u_(j-1)
+            d_change = upstream * w['control_change_rate'] * 2.0 * (inputs - u_prev_vec)
+            grad_inputs += d_change - lib.concat((d_change[:, 1:, :], lib.zeros_like(d_change[:, :1, :])), 1)
+        return grad_states, grad_inputs
+
+    def _weighted_sum(self, terms, weights=None):
+        weights = self.weights if weights is None else weights
+        stage_cost = 0.0
+        for term, cost in terms.items():
+            stage_cost = stage_cost + weights[TERMS.index(term)] * cost
+        return stage_cost
+
+    @CompileAdaptive
+    def term_costs(self, states: TensorType, inputs: TensorType, previous_input: TensorType,
+                   target_position, target_equilibrium):
+        """Unweighted cost of each used term with self.lib, {term: cost of shape (batch x horizon)}"""
+        lib = self.lib
+        used = self.used_terms
+        position = states[:, :, POSITION_IDX]
+        terms = {}
+
+        distance = (position - target_position) / (2.0 * TrackHalfLength)
+        if 'distance_quadratic' in used:
+            terms['distance_quadratic'] = distance ** 2
+        if 'distance_abs' in used:
+            terms['distance_abs'] = lib.abs(distance)
+        if 'distance_nonconvex' in used:
+            terms['distance_nonconvex'] = -0.15 * (lib.cos(4 * 2 * lib.pi * distance) - 1.0)
+
+        if 'boundary_step' in used or 'boundary_quadratic' in used:
+            abs_position = lib.abs(position)
+            near_boundary = lib.cast(abs_position > self.boundary_fraction * TrackHalfLength, lib.float32)
+            if 'boundary_step' in used:
+                terms['boundary_step'] = near_boundary
+            if 'boundary_quadratic' in used:
+                terms['boundary_quadratic'] = near_boundary * (
+                    (abs_position - self.boundary_fraction * TrackHalfLength)
+                    / ((1.0 - self.boundary_fraction) * TrackHalfLength)
+                ) ** 2
+
+        angle = states[:, :, ANGLE_IDX]
+        if 'E_pot' in used:
+            terms['E_pot'] = target_equilibrium * 0.25 * (1.0 - lib.cos(angle)) ** 2
+        if 'E_pot_shifted' in used:
+            terms['E_pot_shifted'] = 0.25 * (2.0 - lib.cos(angle + (1.0 - target_equilibrium) * lib.pi / 2.0)) ** 2
+        if 'E_kin_pole' in used:
+            terms['E_kin_pole'] = states[:, :, ANGLED_IDX] ** 2
+
+        if 'control' in used:
+            terms['control'] = lib.sum(inputs ** 2, 2)
+        if 'control_change_rate' in used and previous_input is not None:
+            u_prev_vec = lib.concat(
+                (lib.ones((inputs.shape[0], 1, inputs.shape[2])) * previous_input, inputs[:, :-1, :]), 1
+            )
+            terms['control_change_rate'] = lib.sum((inputs - u_prev_vec) ** 2, 2)
+        return terms
+
+    def term_breakdown(self, states, inputs, previous_input, target_position, target_equilibrium):
+        """Weighted cost of each used term, {term: cost of shape (batch x horizon)}, e.g. for debugging"""
+        terms = self.term_costs(states, inputs, previous_input, target_position, target_equilibrium)
+        return {term: self.weights[TERMS.index(term)] * cost for term, cost in terms.items()}
+
+    def indicator_terminal_cost(self, terminal_states: TensorType, target_position):
+        """10000 if the pole is not upright (|angle| > 0.2) or the cart is not at target (> 0.1 TrackHalfLength), shape (batch x 1)"""
+        lib = self.lib
+        terminal_cost = 10000 * lib.cast(
+            (lib.abs(terminal_states[:, ANGLE_IDX]) > 0.2)
+            | (lib.abs(terminal_states[:, POSITION_IDX] - target_position) > 0.1 * TrackHalfLength),
+            lib.float32,
+        )
+        return lib.reshape(terminal_cost, (-1, 1))
+
+
+class cartpole_cost_function_base(cost_function_base):
+    """
+    Base of the CartPole cost functions evaluated with a CartPoleCostEngine.
+
+    A variant sets CONFIG_WEIGHTS - initial weights named as in config_cost_function.yml,
+    cost_weights - a function mapping these weights to the weights of the TERMS,
+    and the engine options BOUNDARY_FRACTION, ANALYTIC_GRADIENT and TUNABLE_TERMS (see CartPoleCostEngine).
+    The engine is created with the cost function and created anew if the computation library is changed.
+    """
+    CONFIG_WEIGHTS = {}
+    BOUNDARY_FRACTION = 0.95
+    ANALYTIC_GRADIENT = False
+    TUNABLE_TERMS = ()
+
+    @staticmethod
+    def cost_weights(**config_weights) -> np.ndarray:
+        raise NotImplementedError
+
+    def __init__(self, *args, **kwargs):
+        self.engine = None
+        super().__init__(*args, **kwargs)
+        self.config_weights = dict(self.CONFIG_WEIGHTS)
+        self.stage_cost_buffer = np.zeros((0, 0), dtype=np.float32)
+        self.engine = self.create_engine()
+
+    def create_engine(self) -> CartPoleCostEngine:
+        return CartPoleCostEngine(
+            self.lib, self.cost_weights(**self.config_weights), boundary_fraction=self.BOUNDARY_FRACTION,
+            analytic_gradient=self.ANALYTIC_GRADIENT, tunable_terms=self.TUNABLE_TERMS,
+        )
+
+    def set_computation_library(self, ComputationLib):
+        super().set_computation_library(ComputationLib)
+        # The weights variable and the compiled graphs belong to the computation library
+        if self.engine is not None and self.engine.lib is not self.lib:
+            self.engine = self.create_engine()
+
+    def update_weights(self, **config_weights):
+        """Hot update of weights named as in config_cost_function.yml, e.g. update_weights(ep_weight=1000.0).
+        Compiled graphs are not retraced."""
+        self.config_weights.update(config_weights)
+        self.engine.set_weights(self.cost_weights(**self.config_weights))
+
+    # final stage cost
+    def get_terminal_cost(self, terminal_states: TensorType):
+        """Calculate terminal cost of a set of trajectories
+
+        Williams et al use an indicator function type of terminal cost in
+        "Information theoretic MPC for model-based reinforcement learning"
+
+        TODO: Try a quadratic terminal cost => Use the LQR terminal cost term obtained
+        by linearizing the system around the unstable equilibrium.
+
+        :param terminal_states: Reference to numpy array of terminal states of all rollouts
+        :type terminal_states: np.ndarray
+        :return: One terminal cost per rollout, has shape (batch_size x 1)
+        :rtype: np.ndarray
+        """
+        return self.engine.indicator_terminal_cost(terminal_states, self.variable_parameters.target_position)
+
+    # all stage costs together, the control change rate only if previous_input is given
+    def _get_stage_cost(self, states: TensorType, inputs: TensorType, previous_input: TensorType):
+        """With numpy the stage costs are written to a buffer of this cost function, overwritten at the next call"""
+        out = None
+        if self.engine.numba_backend:
+            if self.stage_cost_buffer.shape != states.shape[:2]:
+                self.stage_cost_buffer = np.zeros(states.shape[:2], dtype=np.float32)
+            out = self.stage_cost_buffer
+        return self.engine.stage_cost(
+            states, inputs, previous_input,
+            self.variable_parameters.target_position, self.variable_parameters.target_equilibrium, out=out,
+        )
+
+
+def find_cartpole_cost_function(controller, max_depth=3):
+    """The CartPole cost function of a controller, possibly held by a cost function wrapper, None if it uses none"""
+    cost_function = controller
+    for _ in range(max_depth):
+        cost_function = getattr(cost_function, 'cost_function', None)
+        if cost_function is None or isinstance(cost_function, cartpole_cost_function_base):
+            return cost_function
+    return None
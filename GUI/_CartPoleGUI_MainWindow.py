@@ -14,6 +14,7 @@ import time
 import sys
 
 from CartPole.cartpole_parameters import (
+    CP_PARAMETERS_DEFAULT,
     TrackHalfLength,
 )
 
@@ -55,6 +56,8 @@ try:
 except:
     pass
 from GUI._ControllerGUI_NoiseOptionsWindow import NoiseOptionsWindow
+from GUI._ControllerGUI_CostFunctionOptionsWindow import CostFunctionOptionsWindow
+from Control_Toolkit_ASF.Cost_Functions.cartpole_cost_engine import find_cartpole_cost_function
 
 
 # Class implementing the main window of CartPole GUI
@@ -679,7 +682,7 @@ class MainWindow(QMainWindow):
 
             # TODO: Make it more general for all possible parameters
             try:
-                L[...] = row['L']
+                CP_PARAMETERS_DEFAULT.set_parameters(L=row['L'])
             except KeyError:
                 pass
             except:
@@ -1214,8 +1217,11 @@ class MainWindow(QMainWindow):
 
     def open_additional_controller_widget(self):
         # Open up additional options widgets depending on the controller type
+        cost_function = find_cartpole_cost_function(self.CartPoleInstance.controller)
         if self.CartPoleInstance.controller_name == 'mppi-cartpole':
-            self.optionsControllerWidget = MPPIOptionsWindow()
+            self.optionsControllerWidget = MPPIOptionsWindow(self.CartPoleInstance.controller)
+        elif cost_function is not None:
+            self.optionsControllerWidget = CostFunctionOptionsWindow(cost_function)
         else:
             try: self.optionsControllerWidget.close()
             except: pass
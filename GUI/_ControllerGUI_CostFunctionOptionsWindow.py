@@ -0,0 +1,52 @@
+# Necessary only for debugging in Visual Studio Code IDE
+try:
+    import ptvsd
+except:
+    pass
+
+# Import functions from PyQt6 module (creating GUI)
+from PyQt6.QtWidgets import (
+    QVBoxLayout,
+    QHBoxLayout,
+    QLabel,
+    QLineEdit,
+    QWidget,
+)
+from PyQt6.QtCore import Qt
+
+
+class CostFunctionOptionsWindow(QWidget):
+    """
+    Weights of the CartPole cost function of a controller (see cartpole_cost_function_base),
+    changed while the controller is running with update_weights, without retracing compiled graphs.
+    """
+    def __init__(self, cost_function):
+        super(CostFunctionOptionsWindow, self).__init__()
+
+        self.cost_function = cost_function
+
+        layout = QVBoxLayout()
+        layout.addWidget(QLabel("Cost function: {}".format(type(cost_function).__name__)))
+
+        for name, value in self.cost_function.config_weights.items():
+            textbox = QLineEdit()
+            textbox.setText(str(value))
+            textbox.textChanged.connect(lambda val, name=name: self.weight_changed(name, val))
+            h_layout = QHBoxLayout()
+            h_layout.addWidget(QLabel("{} =".format(name)))
+            h_layout.addWidget(textbox)
+            layout.addLayout(h_layout)
+
+        self.setLayout(layout)
+        self.setWindowFlags(self.windowFlags() | Qt.WindowType.WindowStaysOnTopHint)
+        self.setGeometry(0, 0, 300, 50)
+
+        self.show()
+        self.setWindowTitle("Cost Function Options")
+
+    def weight_changed(self, name: str, val: str):
+        try:
+            val = float(val)
+        except ValueError:
+            return  # Incomplete input, e.g. '' or '1e'
+        self.cost_function.update_weights(**{name: val})
@@ -1,14 +1,208 @@
-from tqdm import trange
-from time import sleep
+"""
+On-the-fly augmentation of training batches.
+
+The cartpole is mirror-symmetric around the track center:
+position, positionD, angle, angleD, angle_sin, Q and target_position change sign, angle_cos stays unchanged.
+Mirroring a random part of each batch doubles the effective amount of data without storing a mirrored copy on disk.
+Optionally a random contiguous subsequence is cropped from each batch.
+Time is never reversed, as the cartpole with friction is not time-reversal-symmetric.
+
+The features are identified by name, never by position: by default the inputs and outputs of config_training,
+in the order of the network inputs and outputs.
+Normalized data (NORMALIZE in config_training) is mirrored in normalized space:
+with the affine normalization x_n = a * x + b the mirror image of x_n is 2 * b - x_n, not -x_n,
+the offsets b are read from the normalization info of the experiment.
+"""
+
+import glob
+import os
+
+import numpy as np
+
+from others.globals_and_utils import create_rng, load_config
 
 AUGMENT_DATA = False
+MIRROR_PROBABILITY = 0.5  # Fraction of samples in each batch which gets mirrored
+CROP_SUBSEQUENCES = False
+CROP_LEN = None  # Length of the cropped subsequence, None - random length from MIN_CROP_LEN to full length
+MIN_CROP_LEN = 1
+
+# Features which change sign when the cartpole is mirrored; the same holds for their differences (D_ prefix)
+MIRRORED_FEATURES = [
+    'angle', 'angleD', 'angleDD', 'angle_sin',
+    'position', 'positionD', 'positionDD',
+    'Q', 'Q_applied', 'Q_calculated', 'u',
+    'target_position',
+]
+
+
+def mirror_signs(features):
+    """Returns for each feature -1.0 if it changes sign when the cartpole is mirrored and 1.0 otherwise."""
+    signs = np.ones(len(features), dtype=np.float32)
+    for i, feature in enumerate(features):
+        if feature in MIRRORED_FEATURES or (feature[:2] == 'D_' and feature[2:] in MIRRORED_FEATURES):
+            signs[i] = -1.0
+    return signs
+
+
+def training_features(config_training):
+    """
+    (inputs, outputs) of the network trained with config_training,
+    sorted by name as SI_Toolkit orders them (see INPUTS and OUTPUTS in the .txt file of a trained network)
+    """
+    training_default = config_training['training_default']
+    inputs = training_default['control_inputs'] + training_default['state_inputs'] + training_default['setpoint_inputs']
+    return sorted(inputs), sorted(training_default['outputs'])
+
+
+def normalization_offsets(path_to_normalization, features, normalization_type='minmax_sym'):
+    """
+    Offsets b of the normalization x_n = a * x + b of the features,
+    from a normalization info csv of SI_Toolkit (rows mean, std, max, min; a column per feature)
+    """
+    with open(path_to_normalization) as f:
+        rows = [line.strip().split(',') for line in f if line.strip() and not line.startswith('#')]
+    header, statistics = rows[0], {row[0]: row for row in rows[1:]}
+
+    def statistic(name, feature):
+        value = statistics[name][header.index(feature)]
+        if value == '':
+            raise ValueError('No normalization info ({}) for {} in {}'.format(name, feature, path_to_normalization))
+        return float(value)
+
+    offsets = np.zeros(len(features), dtype=np.float32)
+    for i, feature in enumerate(features):
+        if feature not in header:
+            raise ValueError('No normalization info for {} in {}'.format(feature, path_to_normalization))
+        if normalization_type == 'minmax_sym':
+            minimum, maximum = statistic('min', feature), statistic('max', feature)
+            offsets[i] = -(maximum + minimum) / (maximum - minimum)
+        elif normalization_type == 'minmax_pos':
+            minimum, maximum = statistic('min', feature), statistic('max', feature)
+            offsets[i] = -minimum / (maximum - minimum)
+        elif normalization_type == 'gaussian':
+            offsets[i] = -statistic('mean', feature) / statistic('std', feature)
+        else:
+            raise ValueError('Unknown normalization type {}'.format(normalization_type))
+    return offsets
+
+
+def normalization_info_path(config_training):
+    """The newest normalization info csv of the experiment of config_training"""
+    paths = config_training['paths']
+    folder = os.path.join(paths['PATH_TO_EXPERIMENT_FOLDERS'], paths['path_to_experiment'], 'NormalizationInfo')
+    candidates = glob.glob(os.path.join(folder, 'NI_*.csv'))
+    if not candidates:
+        raise FileNotFoundError('Mirroring normalized data needs the normalization info, none found in {}'.format(folder))
+    return max(candidates, key=os.path.getmtime)
+
 
+def feature_names(data, names):
+    """Names of the features (last dimension) of data: names if given, otherwise the columns of a dataframe"""
+    if names is None:
+        names = getattr(data, 'columns', None)
+        if names is None:
+            raise ValueError('Mirroring needs the feature names of the data, pass them or use a dataframe')
+    names = list(names)
+    if len(names) != np.shape(data)[-1]:
+        raise ValueError('Got {} feature names for data with {} features'.format(len(names), np.shape(data)[-1]))
+    return names
 
-def augment_data(data, labels):
+
+class DataAugmentation:
+    def __init__(self, inputs, outputs, seed=None,
+                 mirror_probability=MIRROR_PROBABILITY,
+                 crop_subsequences=CROP_SUBSEQUENCES, crop_len=CROP_LEN, min_crop_len=MIN_CROP_LEN,
+                 path_to_normalization=None, normalization_type='minmax_sym'):
+        """
+        :param path_to_normalization: Normalization info of normalized data and labels, None for unnormalized ones
+        """
+
+        self.rng = create_rng(self.__class__.__name__, seed)
+
+        self.features = (list(inputs), list(outputs))
+        self.path_to_normalization = path_to_normalization
+        self.inputs_signs = mirror_signs(inputs)
+        self.outputs_signs = mirror_signs(outputs)
+        # Mirror image sign * x + shift, the shift is 2 * b for normalized mirrored features and 0 otherwise
+        self.inputs_shift = np.zeros_like(self.inputs_signs)
+        self.outputs_shift = np.zeros_like(self.outputs_signs)
+        if path_to_normalization is not None:
+            for features, signs, shift in ((inputs, self.inputs_signs, self.inputs_shift),
+                                           (outputs, self.outputs_signs, self.outputs_shift)):
+                mirrored = [feature for feature, sign in zip(features, signs) if sign < 0.0]
+                shift[signs < 0.0] = 2.0 * normalization_offsets(path_to_normalization, mirrored, normalization_type)
+
+        self.mirror_probability = mirror_probability
+
+        self.crop_subsequences = crop_subsequences
+        self.crop_len = crop_len
+        self.min_crop_len = min_crop_len
+
+    def __call__(self, data, labels):
+        return self.augment(data, labels)
+
+    def augment(self, data, labels):
+        """
+        data and labels are arrays [batch_size, (time_steps,) features], normalized if the augmentation was created
+        with the normalization info, with the features listed in inputs and outputs; the same samples are mirrored in both.
+        """
+        data, labels = np.asarray(data), np.asarray(labels)
+        if data.shape[-1] != self.inputs_signs.size or labels.shape[-1] != self.outputs_signs.size:
+            raise ValueError('The data has {} and the labels {} features, the augmentation was created for {} and {}'.format(
+                data.shape[-1], labels.shape[-1], self.inputs_signs.size, self.outputs_signs.size))
+        batch_size = data.shape[0]
+        mirrored = self.rng.random(batch_size) < self.mirror_probability
+
+        data = np.where(mirrored.reshape((batch_size,) + (1,) * (data.ndim - 1)),
+                        data * self.inputs_signs + self.inputs_shift, data)
+        labels = np.where(mirrored.reshape((batch_size,) + (1,) * (labels.ndim - 1)),
+                          labels * self.outputs_signs + self.outputs_shift, labels)
+
+        if self.crop_subsequences and data.ndim == 3 and labels.ndim == 3:
+            data, labels = self.crop(data, labels)
+
+        return data, labels
+
+    def crop(self, data, labels):
+        """Cuts the same random contiguous window out of data and labels; the time order is preserved."""
+        time_steps = data.shape[1]
+        if self.crop_len is None:
+            crop_len = self.rng.integers(min(self.min_crop_len, time_steps), time_steps + 1)
+        else:
+            crop_len = min(self.crop_len, time_steps)
+        start = self.rng.integers(0, time_steps - crop_len + 1)
+        return data[:, start:start + crop_len, ...], labels[:, start:start + crop_len, ...]
+
+
+_data_augmentation = None
+
+
+def augment_data(data, labels, inputs=None, outputs=None, normalized=None):
+    """
+    :param inputs, outputs: Feature names of data and labels,
+        by default the columns if they are dataframes, otherwise the inputs and outputs of config_training
+    :param normalized: Whether data and labels are normalized, by default NORMALIZE of config_training.
+        Normalized data is mirrored with the normalization info of the experiment.
+    """
 
     if AUGMENT_DATA:
-        print('Augmenting data...')
-        sleep(0.002)
-        for i in trange(len(data)):
-            data[i] = data[i]
+        global _data_augmentation
+        config_training = load_config(os.path.join("SI_Toolkit_ASF", "config_training.yml"))
+        if normalized is None:
+            normalized = config_training["training_default"]["NORMALIZE"]
+
+        default_inputs, default_outputs = training_features(config_training)
+        if inputs is None and not hasattr(data, 'columns'):
+            inputs = default_inputs
+        if outputs is None and not hasattr(labels, 'columns'):
+            outputs = default_outputs
+        inputs, outputs = feature_names(data, inputs), feature_names(labels, outputs)
+        path_to_normalization = normalization_info_path(config_training) if normalized else None
+
+        if (_data_augmentation is None or _data_augmentation.features != (inputs, outputs)
+                or _data_augmentation.path_to_normalization != path_to_normalization):
+            _data_augmentation = DataAugmentation(inputs, outputs, seed=config_training["training_default"]["SEED"],
+                                                  path_to_normalization=path_to_normalization)
+        data, labels = _data_augmentation(data, labels)
     return data, labels
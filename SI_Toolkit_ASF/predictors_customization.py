@@ -1,11 +1,31 @@
+from types import MethodType
 from typing import Callable, Optional
-from SI_Toolkit.computation_library import NumpyLibrary
+
+import numpy as np
+from SI_Toolkit.computation_library import NumpyLibrary, TensorFlowLibrary
 from CartPole.cartpole_equations import CartPoleEquations
+from CartPole.cartpole_parameters import TIME_VARYING_PARAMETERS
 
 from CartPole.state_utilities import STATE_INDICES, STATE_VARIABLES, CONTROL_INPUTS, CONTROL_INDICES, create_cartpole_state
 from CartPole.state_utilities import ANGLE_IDX, ANGLED_IDX, POSITION_IDX, POSITIOND_IDX, ANGLE_COS_IDX, ANGLE_SIN_IDX
 
 from SI_Toolkit.Functions.TF.Compile import CompileAdaptive
+from SI_Toolkit_ASF import GLOBALLY_DISABLE_COMPILATION
+from others.globals_and_utils import count_traces
+
+
+def compile_counting_traces(method, name, jit_compile=None):
+    """
+    CompileAdaptive of a bound method whose traces are counted (see count_traces).
+    :param jit_compile: None - compiled as by CompileAdaptive, with XLA if USE_JIT_COMPILATION is set in SI_Toolkit_ASF;
+        True/False - with Tensorflow compiled with/without XLA. Nothing is compiled if compilation is globally disabled.
+    """
+    # Bound again, CompileAdaptive selects the compilation by the library of the instance
+    counted = MethodType(count_traces(method.__func__, name), method.__self__)
+    if jit_compile is not None and method.__self__.lib is TensorFlowLibrary and not GLOBALLY_DISABLE_COMPILATION:
+        import tensorflow as tf
+        return tf.function(counted, jit_compile=jit_compile)
+    return CompileAdaptive(counted)
 
 
 class next_state_predictor_ODE:
@@ -16,19 +36,32 @@ class next_state_predictor_ODE:
                  lib,
                  batch_size=1,
                  variable_parameters=None,
-                 disable_individual_compilation=False):
+                 disable_individual_compilation=False,
+                 analytic_gradient=False,
+                 jit_compile=None):
         self.lib = lib
         self.intermediate_steps = self.lib.to_tensor(intermediate_steps, dtype=self.lib.int32)
+        self.intermediate_steps_unrolled = int(intermediate_steps)
         self.t_step = self.lib.to_tensor(dt / float(self.intermediate_steps), dtype=self.lib.float32)
         self.variable_parameters = variable_parameters
 
         self.cpe = CartPoleEquations(lib=self.lib)
         self.params = self.cpe.params
 
+        # With Tensorflow and analytic_gradient=True the gradient of a step is computed with the adjoint pass
+        # of CartPoleEquations instead of recording the unrolled substeps on the gradient tape
+        if analytic_gradient and self.lib is TensorFlowLibrary:
+            self.fine_integration = self._fine_integration_with_analytic_gradient()
+        else:
+            self.fine_integration = self._fine_integration
+
+        # With Tensorflow jit_compile=True compiles the step with XLA, fusing the elementwise substeps into few kernels,
+        # None follows USE_JIT_COMPILATION (see compile_counting_traces)
+        # A warning is raised if the compiled step is retraced during a run
         if disable_individual_compilation:
             self.step = self._step
         else:
-            self.step = CompileAdaptive(self._step)
+            self.step = compile_counting_traces(self._step, 'next_state_predictor_ODE.step', jit_compile)
 
     def _step(self, s, Q):
 
@@ -37,21 +70,152 @@ class next_state_predictor_ODE:
         # assert Q.ndim == 2
         # assert s.ndim == 2
 
+        # The parameters are read from variables (see CartPoleParameters), changing them does not retrace the step.
+        # The pole length of the controller (variable_parameters.L) is a variable in the Control_Toolkit controllers.
+        parameters = {name: self.lib.to_tensor(getattr(self.params, name), dtype=self.lib.float32)
+                      for name in TIME_VARYING_PARAMETERS}
         if self.variable_parameters is not None and hasattr(self.variable_parameters, 'L'):
-            pole_half_length = self.lib.to_tensor(self.variable_parameters.L, dtype=self.lib.float32)
-        else:
-            pole_half_length = self.lib.to_tensor(self.cpe.params.L, dtype=self.lib.float32)
+            parameters['L'] = self.lib.to_tensor(self.variable_parameters.L, dtype=self.lib.float32)
 
+        s_next = self.fine_integration(s, Q, *[parameters[name] for name in TIME_VARYING_PARAMETERS])
+
+        return s_next
+
+    def _fine_integration(self, s, Q, *parameters):
         Q = Q[..., 0]  # Removes features dimension, specific for cartpole as it has only one control input
         u = self.cpe.Q2u(Q)
-        s_next = self.cpe.cartpole_fine_integration(s, u=u, t_step=self.t_step, intermediate_steps=self.intermediate_steps, L=pole_half_length)
-
+        s_next = self.cpe.cartpole_fine_integration(s, u=u, t_step=self.t_step, intermediate_steps=self.intermediate_steps,
+                                                    **dict(zip(TIME_VARYING_PARAMETERS, parameters)))
         return s_next
 
+    def _fine_integration_with_analytic_gradient(self):
+        import tensorflow as tf
+
+        forward = CompileAdaptive(self._fine_integration)  # Autograph does not convert the custom gradient function itself
+
+        @tf.custom_gradient
+        def fine_integration(s, Q, *parameters):
+            s_next = forward(s, Q, *parameters)
+
+            def grad(grad_s_next):
+                u = self.cpe.Q2u(Q[..., 0])
+                grad_s, grad_u = self.cpe.cartpole_fine_integration_vjp(
+                    s, u, self.t_step, self.intermediate_steps_unrolled, grad_s_next,
+                    **dict(zip(TIME_VARYING_PARAMETERS, parameters))
+                )
+                grad_Q = (self.params.u_max * grad_u)[..., tf.newaxis]
+                return (grad_s, grad_Q) + (None,) * len(parameters)  # No gradient with respect to the parameters
+
+            return s_next, grad
+
+        return fine_integration
+
     def __call__(self, s, Q):
         return self.step(s, Q)
 
 
+class predictor_ODE_horizon_tf:
+    """
+    Tensorflow ODE predictor integrating the whole horizon of all rollouts in one compiled call,
+    counterpart of predictor_ODE_horizon_numba. With jit_compile=True the rollout loop is compiled with XLA,
+    with False without, with None as set by USE_JIT_COMPILATION in SI_Toolkit_ASF.
+    """
+
+    def __init__(self,
+                 horizon: int,
+                 dt: float,
+                 intermediate_steps: int = 10,
+                 batch_size: int = 1,
+                 variable_parameters=None,
+                 jit_compile: Optional[bool] = None,
+                 **kwargs):
+        self.lib = TensorFlowLibrary
+        self.horizon = horizon
+        self.batch_size = batch_size
+        self.next_step_predictor = next_state_predictor_ODE(
+            dt, intermediate_steps, TensorFlowLibrary, batch_size, variable_parameters,
+            disable_individual_compilation=True,  # Compiled together with the rollout loop
+        )
+        self.predict_tf = compile_counting_traces(self._predict_tf, 'predictor_ODE_horizon_tf.predict', jit_compile)
+
+    def _predict_tf(self, initial_state, Q):
+        s = initial_state
+        output = [s]
+        for i in range(self.horizon):
+            s = self.next_step_predictor.step(s, Q[:, i, :])
+            output.append(s)
+        return TensorFlowLibrary.stack(output, axis=1)
+
+    def predict(self, initial_state, Q):
+        """
+        :param initial_state: Shape (STATE_VARIABLES) or (batch_size x STATE_VARIABLES)
+        :param Q: Normed control inputs, shape (batch_size x horizon x 1)
+        :return: Initial and predicted states, shape (batch_size x (horizon + 1) x STATE_VARIABLES)
+        """
+        import tensorflow as tf
+
+        Q = tf.convert_to_tensor(Q, dtype=tf.float32)
+        initial_state = tf.broadcast_to(tf.convert_to_tensor(initial_state, dtype=tf.float32),
+                                        (tf.shape(Q)[0], len(STATE_VARIABLES)))
+        return self.predict_tf(initial_state, Q)
+
+    def update(self, Q0=None, s=None):
+        pass  # The ODE has no internal state
+
+
+def recurrent_core(predictor, max_depth=3):
+    """The object holding the stateful Keras network (attribute net) of a predictor, possibly wrapped, None if there is none"""
+    for _ in range(max_depth):
+        if predictor is None:
+            return None
+        if hasattr(getattr(predictor, 'net', None), 'layers'):
+            return predictor
+        predictor = getattr(predictor, 'predictor', None)
+    return None
+
+
+def recurrent_layers(net):
+    return [layer for layer in net.layers
+            if any(name in layer.name for name in ('gru', 'lstm', 'rnn')) and getattr(layer, 'stateful', False)]
+
+
+class recurrent_state_broadcast:
+    """
+    Advances the internal state of a recurrent neural predictor once per control step along the real trajectory,
+    with a copy of the predictor of batch size 1, and broadcasts it to the rollout predictor of a larger batch.
+    This replaces updating the rollout predictor with the same input and state tiled over all rollouts.
+    available is False if the predictors do not hold stateful Keras networks of the same architecture,
+    the rollout predictor must then be updated as before.
+    """
+
+    def __init__(self, rollout_predictor, single_predictor):
+        self.single_predictor = single_predictor
+        self.rollout_core, single_core = recurrent_core(rollout_predictor), recurrent_core(single_predictor)
+
+        self.available = self.rollout_core is not None and single_core is not None
+        if self.available:
+            self.rollout_layers = recurrent_layers(self.rollout_core.net)
+            self.single_layers = recurrent_layers(single_core.net)
+            self.available = len(self.rollout_layers) > 0 and len(self.rollout_layers) == len(self.single_layers)
+
+    def update(self, Q0, s):
+        """Advance the state with the applied input Q0 (1 x 1 x CONTROL_INPUTS) and the measured state s"""
+        self.single_predictor.update(Q0, s)
+        self.broadcast()
+
+    def broadcast(self):
+        import tensorflow as tf
+
+        internal_states = []
+        for rollout_layer, single_layer in zip(self.rollout_layers, self.single_layers):
+            for rollout_state, single_state in zip(rollout_layer.states, single_layer.states):
+                rollout_state.assign(tf.broadcast_to(single_state, tf.shape(rollout_state)))
+            internal_states.append(tf.identity(rollout_layer.states[0]))
+        # Predictors which restore the states from a copy before every prediction
+        if hasattr(self.rollout_core, 'rnn_internal_states'):
+            self.rollout_core.rnn_internal_states = internal_states
+
+
 class predictor_output_augmentation_tf:
     def __init__(self, net_info, lib=NumpyLibrary, disable_individual_compilation=False, differential_network=False):
 
@@ -89,7 +253,13 @@ class predictor_output_augmentation_tf:
         if 'angle_cos' in outputs:
             self.index_angle_cos = self.lib.to_tensor(self.net_output_indices['angle_cos'], dtype=self.lib.int64)
 
-        if disable_individual_compilation:
+        # Slot of each augmented feature in the last dimension of the output, after the network outputs
+        self.augmentation_slots = {feature: len(outputs) + i for i, feature in enumerate(features_augmentation)}
+        self.output_buffer = None  # Numpy output, reallocated only when the batch size or horizon changes
+
+        if self.lib is NumpyLibrary:
+            self.augment = self._augment_numpy
+        elif disable_individual_compilation:
             self.augment = self._augment
         else:
             self.augment = CompileAdaptive(self._augment)
@@ -101,22 +271,58 @@ class predictor_output_augmentation_tf:
         return self.features_augmentation
 
     def _augment(self, net_output):
+        """
+        Appends the augmented features to net_output [batch_size, time_steps, features] with a single concatenation.
+        Compiled, its output is taken from the memory pool of Tensorflow,
+        writing it into a preallocated variable instead would add a copy (assign).
+        """
+        if self.augmentation_len == 0:
+            return net_output
 
-        output = net_output  # [batch_size, time_steps, features]
+        augmented = []
         if 'angle' in self.features_augmentation:
-            angle = self.lib.atan2(
-                    net_output[..., self.index_angle_sin],
-                    net_output[..., self.index_angle_cos])[:, :, self.lib.newaxis]  # self.lib.atan2 removes the features (last) dimension, so it is added back with [:, :, self.lib.newaxis]
-            output = self.lib.concat([output, angle], axis=-1)
+            augmented.append(self.lib.atan2(
+                net_output[..., self.index_angle_sin],
+                net_output[..., self.index_angle_cos]))
+        if 'angle_sin' in self.features_augmentation or 'angle_cos' in self.features_augmentation:
+            angle = net_output[..., self.index_angle]  # Sliced once for both
+            if 'angle_sin' in self.features_augmentation:
+                augmented.append(self.lib.sin(angle))
+            if 'angle_cos' in self.features_augmentation:
+                augmented.append(self.lib.cos(angle))
+
+        # The slicing above removes the features (last) dimension, it is added back with [..., self.lib.newaxis]
+        return self.lib.concat([net_output] + [feature[..., self.lib.newaxis] for feature in augmented], axis=-1)
+
+    def _augment_numpy(self, net_output, out=None):
+        """
+        Numpy counterpart of _augment writing the network outputs and the augmented features into the slots of one array.
 
-        if 'angle_sin' in self.features_augmentation:
-            angle_sin = \
-                self.lib.sin(net_output[..., self.index_angle])[:, :, self.lib.newaxis]
-            output = self.lib.concat([output, angle_sin], axis=-1)
+        :param out: Array of shape [batch_size, time_steps, features + augmented features] to write into;
+            if None the output buffer of this instance, reused at every call: copy the result if it must outlive the next call
+        """
+        if self.augmentation_len == 0:
+            return net_output
 
-        if 'angle_cos' in self.features_augmentation:
-            angle_cos = \
-                self.lib.cos(net_output[..., self.index_angle])[:, :, self.lib.newaxis]
-            output = self.lib.concat([output, angle_cos], axis=-1)
+        num_outputs = net_output.shape[-1]
+        shape = net_output.shape[:-1] + (num_outputs + self.augmentation_len,)
+        if out is None:
+            if self.output_buffer is None or self.output_buffer.shape != shape or self.output_buffer.dtype != net_output.dtype:
+                self.output_buffer = np.empty(shape, dtype=net_output.dtype)
+            out = self.output_buffer
+        elif out.shape != shape:
+            raise ValueError('Output array of shape {} expected, got {}'.format(shape, out.shape))
+        output = out
+
+        output[..., :num_outputs] = net_output
+        slots = self.augmentation_slots
+        if 'angle' in slots:
+            np.arctan2(net_output[..., self.index_angle_sin], net_output[..., self.index_angle_cos],
+                       out=output[..., slots['angle']])
+        if 'angle_sin' in slots:
+            np.sin(net_output[..., self.index_angle], out=output[..., slots['angle_sin']])
+        if 'angle_cos' in slots:
+            np.cos(net_output[..., self.index_angle], out=output[..., slots['angle_cos']])
 
         return output
+
@@ -5,7 +5,8 @@ import numpy as np
 from CartPole.state_utilities import STATE_INDICES, STATE_VARIABLES, CONTROL_INPUTS, create_cartpole_state
 
 from CartPole.cartpole_equations import CartPoleEquations
-from CartPole.cartpole_numba import cartpole_fine_integration_numba_interface
+from CartPole.cartpole_numba import (cartpole_fine_integration_numba_interface, cartpole_horizon_integration_numba,
+                                     cartpole_horizon_integration_numba_parallel)
 
 
 class next_state_predictor_ODE:
@@ -40,5 +41,60 @@ class next_state_predictor_ODE:
 
         Q = np.squeeze(Q, axis=1)  # Removes features dimension, specific for cartpole as it has only one control input
         u = self.cpe.Q2u(Q)
+
         s_next = cartpole_fine_integration_numba_interface(s, u, self.t_step, self.intermediate_steps, self.cpe.params, L=pole_half_length)
-        return s_next
\ No newline at end of file
+        return s_next
+
+
+class predictor_ODE_horizon_numba:
+    """
+    Numpy ODE predictor integrating the whole horizon of all rollouts in one compiled call,
+    with the same dynamics as next_state_predictor_ODE (incl. edge bounce).
+    The integration runs in double precision, the trajectories are stored as float32;
+    they agree with stepping next_state_predictor_ODE (float32) within float32 round-off.
+    The trajectories are written into a buffer reused at every call: copy the output if it must outlive the next prediction.
+    A rollout whose cart gets further than termination_position from the center is no longer integrated,
+    its state stays frozen until the end of the horizon (early termination, see controller_mppi_cartpole).
+    """
+
+    def __init__(self,
+                 horizon: int,
+                 dt: float,
+                 intermediate_steps: int = 10,
+                 batch_size: int = 1,
+                 variable_parameters=None,
+                 parallel: bool = False,
+                 termination_position: float = np.inf,
+                 **kwargs):
+        self.horizon = horizon
+        self.batch_size = batch_size
+        self.variable_parameters = variable_parameters
+        self.intermediate_steps = int(intermediate_steps)
+        self.t_step = float(dt / float(self.intermediate_steps))
+
+        params = CartPoleEquations().params
+        self.u_max = float(params.u_max)
+        self.model_parameters = tuple(float(p) for p in (params.k, params.m_cart, params.m_pole, params.g,
+                                                          params.J_fric, params.M_fric))
+        self.L = float(params.L)
+        self.termination_position = float(termination_position)
+
+        self.integrate = cartpole_horizon_integration_numba_parallel if parallel else cartpole_horizon_integration_numba
+        self.output = np.zeros((batch_size, horizon + 1, len(STATE_VARIABLES)), dtype=np.float32)
+
+    def predict(self, initial_state: np.ndarray, Q: np.ndarray) -> np.ndarray:
+        """
+        :param initial_state: Shape (STATE_VARIABLES) or (batch_size x STATE_VARIABLES)
+        :param Q: Normed control inputs, shape (batch_size x horizon x 1)
+        :return: Initial and predicted states, shape (batch_size x (horizon + 1) x STATE_VARIABLES), the reused buffer
+        """
+        if self.output.shape[:2] != (Q.shape[0], Q.shape[1] + 1):
+            self.output = np.zeros((Q.shape[0], Q.shape[1] + 1, len(STATE_VARIABLES)), dtype=np.float32)
+        initial_state = np.broadcast_to(initial_state, (Q.shape[0], len(STATE_VARIABLES)))
+
+        L = getattr(self.variable_parameters, 'L', self.L)
+        return self.integrate(initial_state, Q, self.output, self.u_max, self.t_step, self.intermediate_steps,
+                              *self.model_parameters, float(L), self.termination_position)
+
+    def update(self, Q0=None, s=None):
+        pass  # The ODE has no internal state
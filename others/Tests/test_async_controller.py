@@ -0,0 +1,87 @@
+import time
+
+import numpy as np
+import pytest
+
+from CartPole.async_controller import AsyncControllerRunner
+
+CPU_TIME = 0.05  # s
+
+
+class BusyController:
+    """Uses about cpu_time of CPU time and sleep_time of wall-clock time per step, returns the time of the state"""
+    def __init__(self, cpu_time=CPU_TIME, sleep_time=0.0, error=None):
+        self.cpu_time, self.sleep_time, self.error = cpu_time, sleep_time, error
+
+    def step(self, s, time_of_state, updated_attributes):
+        start = time.thread_time()
+        while time.thread_time() - start < self.cpu_time:
+            pass
+        time.sleep(self.sleep_time)
+        if self.error is not None:
+            raise self.error
+        return time_of_state
+
+
+@pytest.fixture
+def make_runner():
+    runners = []
+
+    def make(controller, computation_time_scale=1.0):
+        runners.append(AsyncControllerRunner(controller, computation_time_scale))
+        return runners[-1]
+
+    yield make
+    for runner in runners:
+        runner.stop()
+
+
+def poll_until_due(runner, start_time, dt=0.002):
+    t = start_time
+    while True:
+        result = runner.poll(t)
+        if result is not None:
+            return t, result
+        t += dt
+
+
+def test_result_is_not_due_before_computation_time(make_runner):
+    runner = make_runner(BusyController())
+    runner.submit(np.zeros(6), 1.0, {})
+    assert runner.busy
+    assert runner.poll(1.0) is None
+
+    t, (Q, computation_time) = poll_until_due(runner, 1.0)
+    assert Q == 1.0
+    assert CPU_TIME <= computation_time < CPU_TIME + 0.05
+    assert computation_time <= t - 1.0 < computation_time + 0.002
+    assert not runner.busy and runner.poll(t) is None
+
+
+def test_computation_time_is_cpu_time_of_controller(make_runner):
+    # Waiting (e.g. for the GIL held by the simulation) does not count as computation time
+    runner = make_runner(BusyController(cpu_time=0.01, sleep_time=0.2), computation_time_scale=2.0)
+    runner.submit(np.zeros(6), 0.0, {})
+    _, (_, computation_time) = poll_until_due(runner, 0.0)
+    assert 0.02 <= computation_time < 0.1
+
+
+def test_errors_propagate(make_runner):
+    runner = make_runner(BusyController(cpu_time=0.0, error=ValueError('controller failed')))
+    runner.submit(np.zeros(6), 0.0, {})
+    with pytest.raises(ValueError, match='controller failed'):
+        poll_until_due(runner, 0.0)
+    assert not runner.busy
+
+
+def test_cancel_discards_pending_result(make_runner):
+    runner = make_runner(BusyController())
+    runner.submit(np.zeros(6), 0.0, {})
+    with pytest.raises(RuntimeError):
+        runner.submit(np.zeros(6), 0.0, {})
+    runner.cancel()
+    assert not runner.busy and runner.poll(10.0) is None
+
+    runner.submit(np.zeros(6), 2.0, {})  # Usable again after cancel
+    _, (Q, _) = poll_until_due(runner, 2.0)
+    assert Q == 2.0
@@ -0,0 +1,82 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from SI_Toolkit.computation_library import NumpyLibrary, TensorFlowLibrary
+
+from Control_Toolkit_ASF.Cost_Functions.CartPole.default import default
+from Control_Toolkit_ASF.Cost_Functions.CartPole.quadratic_boundary import quadratic_boundary
+from Control_Toolkit_ASF.Cost_Functions.CartPole.quadratic_boundary_grad import quadratic_boundary_grad
+from Control_Toolkit_ASF.Cost_Functions.CartPole.quadratic_boundary_nonconvex import quadratic_boundary_nonconvex
+from Control_Toolkit_ASF.Cost_Functions.cartpole_cost_engine import TERMS, find_cartpole_cost_function
+
+COST_FUNCTIONS = [default, quadratic_boundary, quadratic_boundary_grad, quadratic_boundary_nonconvex]
+
+
+def rollouts(batch_size=8, horizon=5):
+    rng = np.random.default_rng(0)
+    states = 0.2 * rng.standard_normal((batch_size, horizon, 6)).astype(np.float32)
+    inputs = rng.uniform(-1.0, 1.0, (batch_size, horizon, 1)).astype(np.float32)
+    return states, inputs, inputs[0, 0]
+
+
+def make(cost_function, lib):
+    return cost_function(SimpleNamespace(target_position=0.05, target_equilibrium=1.0), lib)
+
+
+@pytest.mark.parametrize('cost_function', COST_FUNCTIONS)
+@pytest.mark.parametrize('with_previous_input', [True, False])
+def test_numba_kernel_matches_library_implementation(cost_function, with_previous_input):
+    states, inputs, previous_input = rollouts()
+    previous_input = previous_input if with_previous_input else None
+    numba_costs = make(cost_function, NumpyLibrary)._get_stage_cost(states, inputs, previous_input)
+    tf_costs = np.array(make(cost_function, TensorFlowLibrary)._get_stage_cost(states, inputs, previous_input))
+    np.testing.assert_allclose(numba_costs, tf_costs, rtol=1e-5, atol=1e-4)
+
+
+@pytest.mark.parametrize('lib', [NumpyLibrary, TensorFlowLibrary])
+def test_update_weights_changes_costs(lib):
+    states, inputs, previous_input = rollouts()
+    cost_function = make(quadratic_boundary, lib)
+    assert cost_function.engine is not None  # Created with the cost function
+    before = np.array(cost_function._get_stage_cost(states, inputs, previous_input))
+
+    cost_function.update_weights(ep_weight=0.0)
+
+    after = np.array(cost_function._get_stage_cost(states, inputs, previous_input))
+    assert cost_function.engine.get_weights()['E_pot'] == 0.0
+    assert np.all(after <= before) and np.any(after < before)
+
+
+def test_numpy_stage_costs_reuse_buffer():
+    states, inputs, previous_input = rollouts()
+    cost_function = make(default, NumpyLibrary)
+    first = cost_function._get_stage_cost(states, inputs, previous_input)
+    second = cost_function._get_stage_cost(states, inputs, previous_input)
+    assert first is second is cost_function.stage_cost_buffer
+
+
+def test_engine_follows_computation_library():
+    cost_function = make(default, TensorFlowLibrary)
+    cost_function.update_weights(ep_weight=1.0)
+    cost_function.set_computation_library(NumpyLibrary)
+    assert cost_function.engine.numba_backend
+    assert cost_function.engine.get_weights()['E_pot'] == 1.0
+
+
+def test_untraced_terms_cannot_be_switched_on():
+    cost_function = make(default, TensorFlowLibrary)
+    weights = np.zeros(len(TERMS), dtype=np.float32)
+    weights[TERMS.index('E_kin_pole')] = 1.0
+    with pytest.raises(ValueError):
+        cost_function.engine.set_weights(weights)
+
+
+def test_cost_function_found_behind_wrapper():
+    # The GUI changes the weights of the cost function a controller holds, possibly through a wrapper
+    cost_function = make(default, NumpyLibrary)
+    wrapper = SimpleNamespace(cost_function=cost_function)
+    assert find_cartpole_cost_function(SimpleNamespace(cost_function=wrapper)) is cost_function
+    assert find_cartpole_cost_function(SimpleNamespace(cost_function=SimpleNamespace())) is None
+    assert find_cartpole_cost_function(None) is None
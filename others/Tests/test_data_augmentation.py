@@ -0,0 +1,136 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import SI_Toolkit_ASF.data_augmentation as data_augmentation
+from SI_Toolkit_ASF.data_augmentation import DataAugmentation, augment_data, mirror_signs
+
+INPUTS = ['Q', 'angleD', 'angle_cos', 'angle_sin', 'position', 'positionD', 'target_position']
+OUTPUTS = ['D_angle_cos', 'D_angle_sin', 'D_position', 'angleD']
+
+
+def test_mirror_signs_by_name():
+    np.testing.assert_array_equal(mirror_signs(INPUTS), [-1, -1, 1, -1, -1, -1, -1])
+    np.testing.assert_array_equal(mirror_signs(OUTPUTS), [1, -1, -1, -1])
+
+
+def test_mirror_known_batch():
+    data = np.arange(2 * 3 * len(INPUTS), dtype=np.float32).reshape((2, 3, len(INPUTS))) + 1.0
+    labels = np.arange(2 * 3 * len(OUTPUTS), dtype=np.float32).reshape((2, 3, len(OUTPUTS))) + 1.0
+
+    augmentation = DataAugmentation(INPUTS, OUTPUTS, seed=0, mirror_probability=1.0)
+    data_mirrored, labels_mirrored = augmentation(data, labels)
+
+    np.testing.assert_array_equal(data_mirrored, data * np.array([-1, -1, 1, -1, -1, -1, -1], dtype=np.float32))
+    np.testing.assert_array_equal(labels_mirrored, labels * np.array([1, -1, -1, -1], dtype=np.float32))
+
+    # The mirrored cartpole is physical: cos/sin of the mirrored angle
+    angle = np.array([0.3, -1.2])
+    batch = np.stack([np.cos(angle), np.sin(angle)], axis=-1)
+    mirrored, _ = DataAugmentation(['angle_cos', 'angle_sin'], ['angle_cos'], seed=0, mirror_probability=1.0)(
+        batch, batch[:, :1])
+    np.testing.assert_allclose(mirrored, np.stack([np.cos(-angle), np.sin(-angle)], axis=-1))
+
+
+def test_mirror_probability_zero_keeps_batch():
+    data = np.ones((4, len(INPUTS)), dtype=np.float32)
+    labels = np.ones((4, len(OUTPUTS)), dtype=np.float32)
+    data_augmented, labels_augmented = DataAugmentation(INPUTS, OUTPUTS, seed=0, mirror_probability=0.0)(data, labels)
+    np.testing.assert_array_equal(data_augmented, data)
+    np.testing.assert_array_equal(labels_augmented, labels)
+
+
+def test_feature_count_mismatch_raises():
+    augmentation = DataAugmentation(INPUTS, OUTPUTS, seed=0)
+    with pytest.raises(ValueError):
+        augmentation(np.ones((2, len(INPUTS) - 1)), np.ones((2, len(OUTPUTS))))
+
+
+def test_augment_data_looks_features_up_by_name(monkeypatch):
+    monkeypatch.setattr(data_augmentation, 'AUGMENT_DATA', True)
+
+    # Columns in an order different from config_training
+    data = pd.DataFrame({'position': [0.1], 'angle_cos': [0.5], 'Q': [0.2]})
+    labels = pd.DataFrame({'angle_cos': [0.4]})
+    augmentation = DataAugmentation(list(data.columns), list(labels.columns), seed=0, mirror_probability=1.0)
+    monkeypatch.setattr(data_augmentation, '_data_augmentation', augmentation)
+
+    data_augmented, labels_augmented = augment_data(data, labels, normalized=False)
+    np.testing.assert_allclose(data_augmented, [[-0.1, 0.5, -0.2]])
+    np.testing.assert_allclose(labels_augmented, [[0.4]])
+
+
+def test_augment_data_rejects_data_not_matching_training_features(monkeypatch):
+    monkeypatch.setattr(data_augmentation, 'AUGMENT_DATA', True)
+    with pytest.raises(ValueError):
+        augment_data(np.ones((2, 3)), np.ones((2, 1)), normalized=False)
+
+
+def write_normalization_info(folder, minimum, maximum):
+    # Format of SI_Toolkit, the differences (D_) have no min/max
+    features = sorted(minimum) + ['D_position']
+    rows = [[''] + features,
+            ['mean'] + [str((minimum[f] + maximum[f]) / 2.0) for f in sorted(minimum)] + ['0.0'],
+            ['std'] + ['1.0' for _ in sorted(minimum)] + [''],
+            ['max'] + [str(maximum[f]) for f in sorted(minimum)] + [''],
+            ['min'] + [str(minimum[f]) for f in sorted(minimum)] + ['']]
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, 'NI_2024-01-01_00-00-00.csv')
+    with open(path, 'w') as f:
+        f.write('# Normalization info\n' + '\n'.join(','.join(row) for row in rows) + '\n')
+    return path
+
+
+MINIMUM = {'Q': -1.0, 'angleD': -10.0, 'angle_cos': -1.0, 'angle_sin': -1.0, 'position': -0.2, 'positionD': -1.0,
+           'target_position': -0.1, 'target_equilibrium': -1.0, 'Q_calculated': -1.0}
+MAXIMUM = {'Q': 1.0, 'angleD': 14.0, 'angle_cos': 1.0, 'angle_sin': 1.0, 'position': 0.15, 'positionD': 3.0,
+           'target_position': 0.2, 'target_equilibrium': 1.0, 'Q_calculated': 0.5}
+
+
+def normalize(x, features):
+    minimum, maximum = np.array([MINIMUM[f] for f in features]), np.array([MAXIMUM[f] for f in features])
+    return (2.0 * (x - minimum) / (maximum - minimum) - 1.0).astype(np.float32)
+
+
+def test_mirror_in_normalized_space(tmp_path):
+    path = write_normalization_info(tmp_path, MINIMUM, MAXIMUM)
+    rng = np.random.default_rng(0)
+    data = rng.uniform(-0.1, 0.1, (4, 3, len(INPUTS))).astype(np.float32)
+    labels = rng.uniform(-0.1, 0.1, (4, 3, 1)).astype(np.float32)
+
+    mirrored_data, mirrored_labels = DataAugmentation(INPUTS, ['Q'], seed=0, mirror_probability=1.0)(data, labels)
+    normalized_data, normalized_labels = DataAugmentation(INPUTS, ['Q'], seed=0, mirror_probability=1.0,
+                                                          path_to_normalization=path)(
+        normalize(data, INPUTS), normalize(labels, ['Q']))
+
+    np.testing.assert_allclose(normalized_data, normalize(mirrored_data, INPUTS), atol=1e-5)
+    np.testing.assert_allclose(normalized_labels, normalize(mirrored_labels, ['Q']), atol=1e-5)
+
+    with pytest.raises(ValueError):  # No normalization info for a mirrored feature
+        DataAugmentation(['D_position'], ['Q'], path_to_normalization=path)
+
+
+def test_augment_data_default_call_on_normalized_batches(monkeypatch, tmp_path):
+    # As called by the training pipeline: unnamed, normalized numpy batches
+    write_normalization_info(os.path.join(tmp_path, 'Experiment', 'NormalizationInfo'), MINIMUM, MAXIMUM)
+    config_training = data_augmentation.load_config(os.path.join('SI_Toolkit_ASF', 'config_training.yml'))
+    config_training['paths'] = {'PATH_TO_EXPERIMENT_FOLDERS': str(tmp_path), 'path_to_experiment': 'Experiment'}
+    config_training['training_default']['NORMALIZE'] = True
+    monkeypatch.setattr(data_augmentation, 'load_config', lambda path: config_training)
+    monkeypatch.setattr(data_augmentation, 'AUGMENT_DATA', True)
+    monkeypatch.setattr(data_augmentation, '_data_augmentation', None)
+
+    inputs, outputs = data_augmentation.training_features(config_training)
+    rng = np.random.default_rng(0)
+    data = rng.uniform(-0.1, 0.1, (64, len(inputs))).astype(np.float32)
+    labels = rng.uniform(-0.1, 0.1, (64, len(outputs))).astype(np.float32)
+    data_augmented, labels_augmented = augment_data(normalize(data, inputs), normalize(labels, outputs))
+
+    mirrored_data, mirrored_labels = DataAugmentation(inputs, outputs, mirror_probability=1.0)(data, labels)
+    is_mirrored = np.all(np.isclose(data_augmented, normalize(mirrored_data, inputs), atol=1e-5), axis=-1)
+    is_kept = np.all(np.isclose(data_augmented, normalize(data, inputs), atol=1e-5), axis=-1)
+    assert np.all(is_mirrored | is_kept) and np.any(is_mirrored) and np.any(is_kept)
+    np.testing.assert_allclose(labels_augmented[is_mirrored], normalize(mirrored_labels, outputs)[is_mirrored], atol=1e-5)
+    np.testing.assert_allclose(labels_augmented[~is_mirrored], normalize(labels, outputs)[~is_mirrored], atol=1e-5)
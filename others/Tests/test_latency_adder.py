@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from CartPole.latency_adder import MAX_LATENCY_LEN, LatencyAdder
+from CartPole.state_utilities import ANGLE_COS_IDX, ANGLE_IDX, POSITION_IDX, STATE_VARIABLES
+
+DT = 0.002
+
+
+def state(value):
+    return np.full(len(STATE_VARIABLES), float(value))
+
+
+def fill(adder, values):
+    """Adds the states state(v) for v in values and returns the delayed states after every addition"""
+    delayed = []
+    for value in values:
+        adder.add_current_state_to_latency_buffer(state(value))
+        delayed.append(adder.get_interpolated_delayed_state().copy())
+    return np.array(delayed)
+
+
+def test_zero_latency_returns_current_state():
+    adder = LatencyAdder(latency=0.0, dt_sampling=DT)
+    delayed = fill(adder, range(5))
+    np.testing.assert_allclose(delayed[:, POSITION_IDX], np.arange(5))
+
+
+def test_integer_latency_is_a_pure_delay():
+    adder = LatencyAdder(latency=3 * DT, dt_sampling=DT)
+    delayed = fill(adder, range(1, 11))
+    np.testing.assert_allclose(delayed[3:, POSITION_IDX], np.arange(1, 8))
+    # Before the buffer is filled the initial (zero) state is returned, with angle_cos 1
+    np.testing.assert_allclose(delayed[:3, POSITION_IDX], 0.0)
+    np.testing.assert_allclose(delayed[:3, ANGLE_COS_IDX], 1.0)
+
+
+def test_fractional_latency_interpolates_linearly():
+    adder = LatencyAdder(latency=2.25 * DT, dt_sampling=DT)
+    delayed = fill(adder, range(1, 11))
+    np.testing.assert_allclose(delayed[4:, POSITION_IDX], np.arange(5, 11) - 2.25)
+
+
+def test_modular_index_wraps_around_the_buffer():
+    adder = LatencyAdder(latency=5 * DT, dt_sampling=DT)
+    n = 3 * adder.latency_buffer_len + 7  # Index goes around the circular buffer several times
+    delayed = fill(adder, range(n))
+    np.testing.assert_allclose(delayed[-1, POSITION_IDX], n - 1 - 5)
+    assert adder.access_past_value(0, 0) == adder.latency_buffer_len - 1
+    assert adder.access_past_value(2, 5) == adder.latency_buffer_len - 4
+
+
+def test_access_past_value_rejects_points_out_of_buffer():
+    adder = LatencyAdder(latency=0.0, dt_sampling=DT)
+    with pytest.raises(ValueError):
+        adder.access_past_value(0, -1)
+    with pytest.raises(ValueError):
+        adder.access_past_value(0, adder.latency_buffer_len)
+
+
+def test_negative_latency_is_rejected():
+    with pytest.raises(ValueError):
+        LatencyAdder(latency=-DT, dt_sampling=DT)
+
+
+def test_per_channel_latency_from_dict():
+    adder = LatencyAdder(latency={'angle': 2 * DT}, dt_sampling=DT)
+    delayed = fill(adder, range(1, 11))
+    np.testing.assert_allclose(delayed[-1, ANGLE_IDX], 8.0)
+    np.testing.assert_allclose(delayed[-1, POSITION_IDX], 10.0)  # Not listed, not delayed
+
+
+def test_resize_keeps_history():
+    adder = LatencyAdder(latency=0.0, dt_sampling=DT)
+    fill(adder, range(1, 51))
+    adder.set_latency((MAX_LATENCY_LEN + 10) * DT)
+    assert adder.latency_buffer_len == MAX_LATENCY_LEN + 12
+    np.testing.assert_allclose(adder.get_delayed_state(0)[POSITION_IDX], 50.0)
+    np.testing.assert_allclose(adder.get_delayed_state(49)[POSITION_IDX], 1.0)
+    adder.add_current_state_to_latency_buffer(state(51))
+    np.testing.assert_allclose(adder.get_delayed_state(1)[POSITION_IDX], 50.0)
+
+
+def test_batched_states_are_delayed_independently():
+    batch_size = 3
+    adder = LatencyAdder(latency=1.5 * DT, dt_sampling=DT, batch_size=batch_size)
+    offsets = np.arange(batch_size)[:, np.newaxis] * 100.0
+    for value in range(1, 11):
+        adder.add_current_state_to_latency_buffer(offsets + value)
+    delayed = adder.get_interpolated_delayed_state()
+    assert delayed.shape == (batch_size, len(STATE_VARIABLES))
+    np.testing.assert_allclose(delayed[:, POSITION_IDX], offsets[:, 0] + 10 - 1.5)
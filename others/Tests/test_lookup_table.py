@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+import Control_Toolkit.others.globals_and_utils as control_toolkit_utils
+
+from CartPole.state_utilities import ANGLE_IDX, ANGLED_IDX, POSITION_IDX, POSITIOND_IDX, create_cartpole_state
+from Control_Toolkit_ASF.Controllers.controller_lookup_table import (controller_lookup_table, load_lookup_table,
+                                                                    multilinear_interpolation)
+from run_lookup_table_generator import serpentine_order
+
+SHAPE = (3, 4, 5, 3)
+LOWER = np.array([-0.1, -0.6, -0.4, -4.0])
+UPPER = np.array([0.1, 0.6, 0.4, 4.0])
+COEFFICIENTS = np.array([2.0, -0.5, 1.5, 0.05])
+
+
+def save_linear_table(path):
+    """Table of Q = COEFFICIENTS @ x + 0.1, reproduced exactly by multilinear interpolation"""
+    axes = [np.linspace(LOWER[d], UPPER[d], SHAPE[d]) for d in range(4)]
+    points = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1)
+    np.savez_compressed(path, table=(points @ COEFFICIENTS + 0.1).astype(np.float32), lower=LOWER, upper=UPPER,
+                        source_controller='test')
+    return path, points
+
+
+def test_interpolation_exact_at_grid_points_and_linear_between(tmp_path):
+    path, points = save_linear_table(tmp_path / 'table.npz')
+    table, lower, step = load_lookup_table(str(path))
+    for index in [(0, 0, 0, 0), (2, 3, 4, 2), (1, 2, 3, 1)]:
+        value, inside = multilinear_interpolation(table, lower, step, points[index])
+        assert inside
+        assert value == pytest.approx(table[index], abs=1e-6)
+
+    rng = np.random.default_rng(0)
+    for x in rng.uniform(LOWER, UPPER, (20, 4)):
+        value, inside = multilinear_interpolation(table, lower, step, x)
+        assert inside
+        assert value == pytest.approx(COEFFICIENTS @ x + 0.1, abs=1e-5)
+
+
+def test_inside_flag_at_grid_edges(tmp_path):
+    table, lower, step = load_lookup_table(str(save_linear_table(tmp_path / 'table.npz')[0]))
+    assert multilinear_interpolation(table, lower, step, UPPER.copy())[1]
+    assert multilinear_interpolation(table, lower, step, LOWER.copy())[1]
+    for d in range(4):
+        for bound, sign in ((UPPER, 1.0), (LOWER, -1.0)):
+            x = bound.copy()
+            x[d] += sign * 0.01
+            value, inside = multilinear_interpolation(table, lower, step, x)
+            assert not inside
+            assert value == pytest.approx(COEFFICIENTS @ bound + 0.1, abs=1e-5)  # Clipped to the grid
+
+
+def test_missing_table_raises_clear_error(tmp_path):
+    with pytest.raises(FileNotFoundError, match='run_lookup_table_generator'):
+        load_lookup_table(str(tmp_path / 'missing.npz'))
+
+
+class FallbackController:
+    def __init__(self, *args, **kwargs):
+        self.steps = 0
+
+    def configure(self):
+        pass
+
+    def step(self, s, time=None, updated_attributes={}):
+        self.steps += 1
+        return 0.75
+
+
+def test_fallback_controller_outside_of_grid(tmp_path, monkeypatch):
+    monkeypatch.setattr(control_toolkit_utils, 'import_controller_by_name', lambda name: FallbackController)
+    controller = controller_lookup_table(dt=0.02, environment_name='CartPole',
+                                         initial_environment_attributes={'target_position': 0.0, 'target_equilibrium': 1.0, 'L': 0.4})
+    controller.config_controller.update(table_path=str(save_linear_table(tmp_path / 'table.npz')[0]),
+                                        fallback_controller='fallback')
+    controller.configure()
+
+    s = create_cartpole_state()
+    s[POSITION_IDX], s[POSITIOND_IDX], s[ANGLE_IDX], s[ANGLED_IDX] = 0.05, 0.1, 0.1, 1.0
+    assert controller.step(s, 0.0, {'target_position': 0.0}) == pytest.approx(COEFFICIENTS @ [0.05, 0.1, 0.1, 1.0] + 0.1, abs=1e-5)
+    assert controller.fallback_controller.steps == 0
+    assert controller.controller_data_for_csv['lookup_table_fallback'] == [0]
+
+    s[ANGLED_IDX] = 5.0  # Beyond the grid
+    assert controller.step(s, 0.0, {'target_position': 0.0}) == pytest.approx(0.75)
+    assert controller.fallback_controller.steps == 1
+    assert controller.controller_data_for_csv['lookup_table_fallback'] == [1]
+
+
+@pytest.mark.parametrize('shape', [(3, 4, 5, 3), (2, 2, 2, 2), (13, 13, 17, 17)])
+def test_serpentine_order_visits_neighbours(shape):
+    order = serpentine_order(shape)
+    assert np.array_equal(np.sort(order), np.arange(np.prod(shape)))
+    steps = np.abs(np.diff(np.stack(np.unravel_index(order, shape), axis=-1), axis=0))
+    assert np.all(steps.sum(axis=-1) == 1)  # One step along one axis
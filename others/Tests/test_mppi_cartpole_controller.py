@@ -0,0 +1,246 @@
+import importlib.util
+import sys
+import types
+
+import numpy as np
+import pytest
+from numpy.random import SFC64, Generator
+from scipy.interpolate import interp1d
+
+from CartPole.state_utilities import ANGLE_IDX, POSITION_IDX, create_cartpole_state
+import Control_Toolkit_ASF.Controllers.controller_mppi_cartpole as mppi_cartpole_module
+from Control_Toolkit_ASF.Controllers.controller_mppi_cartpole import controller_mppi_cartpole, update_inputs
+from SI_Toolkit_ASF.predictors_customization_numba import predictor_ODE_horizon_numba
+
+NUM_ROLLOUTS, HORIZON = 64, 20
+CONFIG = {
+    'seed': 0, 'num_rollouts': NUM_ROLLOUTS, 'mpc_horizon': HORIZON, 'rollouts_chunk_size': 16,
+    'predictor_specification': 'ODE', 'controller_logging': False, 'warm_start_library': None,
+}
+
+BUFFERS = ['u', 'u_prev', 'delta_u', 'S_tilde_k', 'rollout_weights', 'initial_state', 'u_rollouts', 'cost_breakdown',
+           'cost_breakdown_chunks', 'Q_update', 'Q_recurrent', 'interpolation_knots', 'cost_weights']
+
+
+class PredictorStandIn:
+    """ODE predictor as seen by the controller, records the inputs it is updated with"""
+    predictor_type = 'ODE'
+    predictor_config = {'predictor_type': 'ODE', 'intermediate_steps': 10}
+    instances = 0
+
+    def __init__(self):
+        PredictorStandIn.instances += 1
+        self.horizon = None
+        self.updates = []
+
+    def configure(self, batch_size, horizon, dt, predictor_specification):
+        self.horizon = horizon
+
+    def update(self, Q, s):
+        self.updates.append(Q)
+
+
+def make_controller(controller_class=controller_mppi_cartpole, with_predictors=True, **config):
+    """mppi-cartpole configured with CONFIG and config.
+    With the predictors initialize would create for the ODE predictor if with_predictors, otherwise left to the first step"""
+    controller = controller_class(
+        dt=0.02, environment_name='CartPole',
+        initial_environment_attributes={'target_position': 0.0, 'target_equilibrium': 1.0, 'L': 0.395},
+        control_limits=(-1.0, 1.0),
+    )
+    controller.config_controller.update({**CONFIG, **config})
+    controller.configure()
+    if not with_predictors:
+        return controller
+
+    controller.predictor = PredictorStandIn()
+    controller.fused_rollouts = controller.fused_rollouts_requested
+    controller.rollout_predictor = predictor_ODE_horizon_numba(
+        horizon=controller.mpc_horizon, dt=controller.dt, intermediate_steps=10, batch_size=controller.num_rollouts,
+        variable_parameters=controller.variable_parameters, parallel=controller.parallel_rollouts,
+        termination_position=controller.termination_position,
+    )
+    return controller
+
+
+def initial_state():
+    s = create_cartpole_state()
+    s[ANGLE_IDX], s[POSITION_IDX] = 0.1, 0.05
+    return s
+
+
+@pytest.mark.parametrize('fused', [False, True])
+def test_step_reuses_buffers(fused):
+    controller = make_controller(fused_rollouts=fused)
+    controller.recurrent_state = PredictorStandIn()
+    buffers = {name: getattr(controller, name) for name in BUFFERS}
+
+    for _ in range(5):
+        Q = controller.step(initial_state())
+
+    for name, buffer in buffers.items():
+        assert getattr(controller, name) is buffer, name
+    assert all(update is controller.Q_recurrent for update in controller.recurrent_state.updates)
+    assert controller.Q_recurrent.shape == (1, 1, 1) and controller.Q_recurrent[0, 0, 0] == Q
+
+    controller.recurrent_state = None
+    controller.step(initial_state())
+    assert controller.predictor.updates[-1] is controller.Q_update
+
+
+@pytest.mark.parametrize('fused', [False, True])
+@pytest.mark.parametrize('chunk_size, parallel', [(16, False), (24, False), (16, True), (24, True), (NUM_ROLLOUTS, True)])
+def test_chunked_and_parallel_evaluation_match_unchunked(fused, chunk_size, parallel):
+    reference = make_controller(fused_rollouts=fused, rollouts_chunk_size=NUM_ROLLOUTS, parallel_rollouts=False)
+    controller = make_controller(fused_rollouts=fused, rollouts_chunk_size=chunk_size, parallel_rollouts=parallel)
+
+    for _ in range(3):
+        Q_reference, Q = reference.step(initial_state()), controller.step(initial_state())
+        np.testing.assert_allclose(controller.S_tilde_k, reference.S_tilde_k, rtol=1e-6)
+        np.testing.assert_allclose(controller.cost_breakdown, reference.cost_breakdown, rtol=1e-5, atol=1e-7)
+        np.testing.assert_allclose(controller.u, reference.u, rtol=1e-5, atol=1e-7)
+        assert Q == pytest.approx(Q_reference, abs=1e-6)
+
+
+def interpolated_perturbations_interp1d(rng, num_samples, horizon, stdev):
+    """Interpolated sampling as it was done with a scipy interp1d object at every step"""
+    step = 10
+    range_stop = int(np.ceil((horizon) / step) * step) + 1
+    t = np.arange(start=0, stop=range_stop, step=step)
+    t_interp = np.delete(np.arange(start=0, stop=range_stop, step=1), t)
+    delta_u = np.zeros(shape=(num_samples, range_stop), dtype=np.float32)
+    delta_u[:, t] = stdev * rng.standard_normal(size=(num_samples, t.size), dtype=np.float32)
+    delta_u[:, t_interp] = interp1d(t, delta_u[:, t])(t_interp)
+    return delta_u[:, :horizon]
+
+
+@pytest.mark.parametrize('horizon', [10, 20, 35, 41])
+def test_interpolation_matrix_matches_interp1d(horizon):
+    controller = make_controller(mpc_horizon=horizon, SAMPLING_TYPE='interpolated')
+    controller.rng_mppi = Generator(SFC64(1))
+    delta_u = controller.initialize_perturbations(stdev=0.3, sampling_type='interpolated', out=controller.delta_u)
+
+    expected = interpolated_perturbations_interp1d(Generator(SFC64(1)), NUM_ROLLOUTS, horizon, 0.3)
+    assert delta_u.shape == (NUM_ROLLOUTS, horizon)
+    np.testing.assert_allclose(delta_u, expected, rtol=1e-5, atol=1e-6)
+
+
+def test_noise_bank_draws_at_random_offsets():
+    controller = make_controller(noise_bank_size=20000)
+    bank = controller.noise_bank
+    assert bank.size >= 2 * NUM_ROLLOUTS * HORIZON
+
+    draws, offsets = [], set()
+    for _ in range(50):
+        out = np.empty((NUM_ROLLOUTS, HORIZON), dtype=np.float32)
+        assert controller.standard_normal(out=out) is out
+        offset = np.flatnonzero(bank == out[0, 0])[0]
+        np.testing.assert_array_equal(out.ravel(), bank[offset:offset + out.size])  # A contiguous part of the bank
+        offsets.add(offset)
+        draws.append(out)
+
+    assert len(offsets) > 40
+    draws = np.stack(draws)
+    assert abs(draws.mean()) < 0.05
+    assert draws.std() == pytest.approx(1.0, abs=0.05)
+    assert abs(np.corrcoef(draws[:, :, :-1].ravel(), draws[:, :, 1:].ravel())[0, 1]) < 0.05
+
+    delta_u = controller.initialize_perturbations(stdev=0.5, sampling_type='iid', out=controller.delta_u)
+    assert delta_u.shape == (NUM_ROLLOUTS, HORIZON) and delta_u.std() == pytest.approx(0.5, rel=0.1)
+
+
+def test_instances_with_different_configs_do_not_share_state():
+    controller = make_controller(seed=0, dd_weight=100.0)
+    other = make_controller(seed=1, num_rollouts=32, mpc_horizon=30, dd_weight=10.0, SAMPLING_TYPE='iid')
+    alone = make_controller(seed=0, dd_weight=100.0)
+
+    for name in BUFFERS + ['rng_mppi', 'model_parameters', 'step_multipliers', 'interpolation_matrix']:
+        assert getattr(controller, name) is not getattr(other, name), name
+    assert controller.delta_u.shape == (NUM_ROLLOUTS, HORIZON) and other.delta_u.shape == (32, 30)
+    assert controller.dd_weight == 100.0 and other.dd_weight == 10.0
+
+    for _ in range(3):
+        Q = controller.step(initial_state())
+        other.step(initial_state())
+        assert Q == alone.step(initial_state())
+        np.testing.assert_array_equal(controller.u, alone.u)
+        np.testing.assert_array_equal(controller.S_tilde_k, alone.S_tilde_k)
+    np.testing.assert_array_equal(controller.cost_weights, alone.cost_weights)
+
+
+def test_import_and_configure_build_no_predictor(monkeypatch):
+    # Loaded afresh with stand-ins for the predictors created by initialize
+    predictors = types.ModuleType('SI_Toolkit.Predictors')
+    monkeypatch.setitem(sys.modules, 'SI_Toolkit.Predictors', predictors)
+    monkeypatch.setitem(sys.modules, 'SI_Toolkit.Predictors.predictor_wrapper',
+                        types.SimpleNamespace(PredictorWrapper=PredictorStandIn))
+    monkeypatch.setitem(sys.modules, 'SI_Toolkit.Predictors.predictor_ODE',
+                        types.SimpleNamespace(predictor_ODE=PredictorStandIn))
+    monkeypatch.setattr(PredictorStandIn, 'instances', 0)
+
+    spec = importlib.util.spec_from_file_location('fresh_controller_mppi_cartpole', mppi_cartpole_module.__file__)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    assert not any(isinstance(value, PredictorStandIn) for value in vars(module).values())
+
+    controllers = [make_controller(module.controller_mppi_cartpole, with_predictors=False, fused_rollouts=True) for _ in range(2)]
+    assert PredictorStandIn.instances == 0
+    assert all(controller.predictor is None and controller.rollout_predictor is None for controller in controllers)
+
+    # Each instance creates its own predictor at its first step
+    controllers[0].step(initial_state())
+    assert PredictorStandIn.instances == 1
+    assert controllers[0].predictor is not None and controllers[1].predictor is None
+    assert controllers[0].fused_rollouts
+
+
+ANYTIME_CONFIG = {'anytime': True, 'fused_rollouts': True, 'anytime_batch_size': 8, 'anytime_safety_margin': 0.2}
+
+
+def test_anytime_rollouts_stop_at_deadline():
+    controller = make_controller(**ANYTIME_CONFIG)
+    controller.s = initial_state()
+    assert controller.anytime_rollouts(deadline=-np.inf) == 8  # At least one batch
+    assert controller.anytime_rollouts(deadline=np.inf) == NUM_ROLLOUTS
+
+
+def test_anytime_step_uses_completed_batches_only(monkeypatch):
+    controller = make_controller(**ANYTIME_CONFIG)
+    # Every reading of the clock advances it by a bit more than a quarter of the time budget of a step
+    budget = (1.0 - controller.anytime_safety_margin) * controller.dt
+    clock = iter(np.arange(1000) * budget / 3.5)
+    monkeypatch.setattr(mppi_cartpole_module, 'perf_counter', lambda: next(clock))
+
+    # Never evaluated rollouts, which would dominate the update if used
+    controller.S_tilde_k[32:] = -1.0e6
+    controller.delta_u[32:] = 100.0
+    u = controller.u.copy()
+
+    controller.step(initial_state())
+    assert controller.controller_data_for_csv['mppi_rollouts'] == [32]
+    assert np.all(controller.S_tilde_k[32:] == -1.0e6) and np.all(controller.delta_u[32:] == 100.0)
+    assert np.all(controller.S_tilde_k[:32] > 0.0)
+
+    update_inputs(u, controller.S_tilde_k[:32].copy(), controller.delta_u[:32].copy(), controller.LBD,
+                  np.zeros(32, dtype=np.float32))
+    np.testing.assert_allclose(controller.u_prev, u, rtol=1e-6)  # The inputs before the index-shift
+    assert np.all(np.abs(controller.u_prev) < 1.0)
+
+
+@pytest.mark.parametrize('horizon_segments', [[[HORIZON, 1]], [[5, 1], [5, 1]], [[3, 1]]])
+def test_uniform_multi_resolution_grid_reproduces_standard_horizon(horizon_segments):
+    standard = make_controller(fused_rollouts=True)
+    uniform = make_controller(fused_rollouts=True, horizon_segments=horizon_segments)
+    assert uniform.multi_resolution and not standard.multi_resolution
+
+    np.testing.assert_array_equal(uniform.step_multipliers, np.ones(HORIZON))
+    np.testing.assert_array_equal(uniform.step_multipliers, standard.step_multipliers)
+    np.testing.assert_array_equal(uniform.interpolation_matrix, standard.interpolation_matrix)
+    np.testing.assert_array_equal(uniform.shift_indices[:-1], np.arange(1, HORIZON))
+    assert np.all(uniform.shift_valid[:-1]) and not uniform.shift_valid[-1]
+
+    for _ in range(4):
+        assert uniform.step(initial_state()) == standard.step(initial_state())
+        np.testing.assert_array_equal(uniform.S_tilde_k, standard.S_tilde_k)
+        np.testing.assert_array_equal(uniform.cost_breakdown, standard.cost_breakdown)
+        np.testing.assert_array_equal(uniform.u, standard.u)
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from CartPole.cartpole_parameters import CartPoleParameters
+from CartPole.state_utilities import POSITION_IDX, POSITIOND_IDX, STATE_VARIABLES, create_cartpole_state
+from Control_Toolkit_ASF.Controllers.controller_mppi_cartpole import TRACK_HALF_LENGTH, fused_rollouts, rollout_costs
+from SI_Toolkit_ASF.predictors_customization_numba import predictor_ODE_horizon_numba
+
+NUM_ROLLOUTS, HORIZON, DT, INTERMEDIATE_STEPS = 64, 30, 0.02, 10
+CHUNK_SIZE = 16
+WEIGHTS = np.array([1.0, 1.0, 0.1, 0.1, 1.0, 0.1], dtype=np.float32)
+R, NU = 1.0, 1000.0
+
+
+def setup():
+    rng = np.random.default_rng(0)
+    s = create_cartpole_state()
+    s[POSITION_IDX], s[POSITIOND_IDX] = 0.8 * TRACK_HALF_LENGTH, 1.0  # Heading for the boundary
+    u = np.zeros(HORIZON, dtype=np.float32)
+    delta_u = rng.uniform(-1.0, 1.0, (NUM_ROLLOUTS, HORIZON)).astype(np.float32)
+    return s, u, delta_u
+
+
+def model_parameters():
+    params = CartPoleParameters()
+    return np.array([params.k, params.m_cart, params.m_pole, params.g, params.J_fric, params.M_fric, params.L,
+                     params.u_max], dtype=np.float64)
+
+
+def evaluate_fused(s, u, delta_u, termination_cost, termination_position):
+    S = np.zeros(NUM_ROLLOUTS, dtype=np.float32)
+    cost_breakdown = np.zeros((6, HORIZON), dtype=np.float32)
+    chunks = np.zeros((NUM_ROLLOUTS // CHUNK_SIZE, 6, HORIZON), dtype=np.float32)
+    fused_rollouts(s, u, delta_u, u, 0.0, WEIGHTS, R, NU, model_parameters(), DT / INTERMEDIATE_STEPS,
+                   INTERMEDIATE_STEPS, np.ones(HORIZON, dtype=np.int64), termination_cost, termination_position,
+                   S, cost_breakdown, chunks, CHUNK_SIZE, True)
+    return S
+
+
+def evaluate_with_predictor(s, u, delta_u, termination_cost, termination_position):
+    predictor = predictor_ODE_horizon_numba(HORIZON, DT, INTERMEDIATE_STEPS, NUM_ROLLOUTS,
+                                            termination_position=termination_position)
+    s_horizon = predictor.predict(s.astype(np.float32), (u + delta_u)[..., np.newaxis])
+    S = np.zeros(NUM_ROLLOUTS, dtype=np.float32)
+    cost_breakdown = np.zeros((6, HORIZON), dtype=np.float32)
+    chunks = np.zeros((NUM_ROLLOUTS // CHUNK_SIZE, 6, HORIZON), dtype=np.float32)
+    rollout_costs(s_horizon, u, delta_u, u, 0.0, WEIGHTS, R, NU, np.ones(HORIZON, dtype=np.int64),
+                  termination_cost, termination_position, S, cost_breakdown, chunks, CHUNK_SIZE)
+    return S, s_horizon
+
+
+def test_predictor_freezes_rollouts_beyond_termination_position():
+    s, u, delta_u = setup()
+    termination_position = 0.95 * TRACK_HALF_LENGTH
+    _, s_horizon = evaluate_with_predictor(s, u, delta_u, np.inf, termination_position)
+
+    beyond = np.abs(s_horizon[:, :, POSITION_IDX]) > termination_position
+    assert np.any(beyond)
+    for i, j in zip(*np.nonzero(beyond)):
+        np.testing.assert_array_equal(s_horizon[i, j:], np.broadcast_to(s_horizon[i, j], (HORIZON + 1 - j, len(STATE_VARIABLES))))
+
+
+@pytest.mark.parametrize('termination_cost, track_fraction', [(np.inf, 0.95), (50.0, None), (np.inf, None)])
+def test_fused_and_predictor_paths_terminate_alike(termination_cost, track_fraction):
+    s, u, delta_u = setup()
+    termination_position = track_fraction * TRACK_HALF_LENGTH if track_fraction else np.inf
+    S_fused = evaluate_fused(s, u, delta_u, termination_cost, termination_position)
+    S_predictor, _ = evaluate_with_predictor(s, u, delta_u, termination_cost, termination_position)
+    np.testing.assert_allclose(S_fused, S_predictor, rtol=1e-3)
+
+
+def test_dead_rollouts_are_charged_for_remaining_steps():
+    s, u, delta_u = setup()
+    S_full = evaluate_fused(s, u, delta_u, np.inf, np.inf)
+    S_terminated = evaluate_fused(s, u, delta_u, np.inf, 0.95 * TRACK_HALF_LENGTH)
+    # Dead rollouts stay costly, the ranking of the cheapest rollouts is kept
+    assert np.argmin(S_full) == np.argmin(S_terminated)
+    assert np.all(S_terminated[S_terminated != S_full] > np.min(S_full))
@@ -0,0 +1,61 @@
+import os
+
+import numpy as np
+import pytest
+
+from Control_Toolkit_ASF.Controllers.neural_imitator_numba import (NeuralImitatorNumba, export_network, fixed_point_format,
+                                                                   minmax_sym_coefficients, quantize, read_net_info)
+
+PATH_TO_MODEL = './Control_Toolkit_ASF/Controllers/models_for_neural_imitator_tf/GRU-6IN-32H1-32H2-1OUT-4'
+
+
+def quantized(values, precision):
+    x = np.array(values, dtype=np.float32)
+    quantize(x, fixed_point_format(precision))
+    return x
+
+
+def test_default_modes_truncate_and_wrap():
+    # ap_fixed<6,3>: step 1/8, range [-4, 4 - 1/8]; hls4ml uses the defaults AP_TRN and AP_WRAP
+    np.testing.assert_array_equal(quantized([0.3, -0.3, 3.9, 4.0, 4.25, -4.125], 'ap_fixed<6,3>'),
+                                  [0.25, -0.375, 3.875, -4.0, -3.75, 3.875])
+    np.testing.assert_array_equal(fixed_point_format('ap_fixed<6,3>'), fixed_point_format('ap_fixed<6, 3, AP_TRN, AP_WRAP>'))
+
+
+def test_rounding_and_saturation_modes():
+    np.testing.assert_array_equal(quantized([0.3, -0.3, 0.0625, 4.25, -5.0], 'ap_fixed<6,3,AP_RND,AP_SAT>'),
+                                  [0.25, -0.25, 0.125, 3.875, -4.0])
+    np.testing.assert_array_equal(quantized([4.25, -5.0], 'ap_fixed<6,3,AP_TRN,AP_SAT>'), [3.875, -4.0])
+
+
+@pytest.mark.parametrize('precision', ['ap_fixed<6>', 'ap_fixed<6,3,AP_RND_ZERO>', 'ap_fixed<6,3,AP_TRN,AP_SAT_SYM>', 'fixed'])
+def test_unsupported_precision(precision):
+    with pytest.raises(ValueError):
+        fixed_point_format(precision)
+
+
+def test_float_precision_matches_keras_model(tmp_path):
+    tf = pytest.importorskip('tensorflow')
+
+    net = NeuralImitatorNumba(export_network(PATH_TO_MODEL, os.path.join(tmp_path, 'net.npz')), 'float')
+
+    # The same network in Keras, with the normalization done outside of it
+    inputs, outputs, path_to_normalization = read_net_info(PATH_TO_MODEL)
+    reader = tf.train.load_checkpoint(os.path.join(PATH_TO_MODEL, 'ckpt.ckpt'))
+    get = lambda name: reader.get_tensor(name + '/.ATTRIBUTES/VARIABLE_VALUE')
+    model = tf.keras.Sequential([tf.keras.Input((None, len(inputs))),
+                                 tf.keras.layers.GRU(32, return_sequences=True),
+                                 tf.keras.layers.GRU(32, return_sequences=True),
+                                 tf.keras.layers.Dense(len(outputs))])
+    model.set_weights([get('layer_with_weights-{}/cell/{}'.format(layer, name))
+                       for layer in range(2) for name in ['kernel', 'recurrent_kernel', 'bias']]
+                      + [get('layer_with_weights-2/kernel'), get('layer_with_weights-2/bias')])
+    scale_in, offset_in = minmax_sym_coefficients(path_to_normalization, inputs)
+    scale_out, offset_out = minmax_sym_coefficients(path_to_normalization, outputs)
+
+    rng = np.random.default_rng(0)
+    x = rng.uniform(-1.0, 1.0, (20, len(inputs))).astype(np.float32)
+    keras_outputs = (model(((scale_in * x + offset_in)[np.newaxis]).astype(np.float32)).numpy()[0] - offset_out) / scale_out
+    numba_outputs = np.array([net.step(sample).copy() for sample in x])
+
+    np.testing.assert_allclose(numba_outputs, keras_outputs, rtol=1e-4, atol=1e-4)
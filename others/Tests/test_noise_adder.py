@@ -0,0 +1,95 @@
+import numpy as np
+from scipy.signal import lfilter
+
+import CartPole.noise_adder as noise_adder
+from CartPole.noise_adder import NOISE_INDICES, NOISE_SMOOTHING, NoiseAdder
+from CartPole.state_utilities import ANGLE_COS_IDX, ANGLE_IDX, ANGLE_SIN_IDX, POSITION_IDX, create_cartpole_state
+
+POSITION_CHANNEL = list(NOISE_INDICES).index(POSITION_IDX)
+
+
+def make_noise_adder(noise_mode, **kwargs):
+    adder = NoiseAdder(**kwargs)
+    adder.noise_mode = noise_mode
+    return adder
+
+
+def test_off_mode_returns_unchanged_copy():
+    s = create_cartpole_state()
+    s_noisy = make_noise_adder('OFF').add_noise_to_measurement(s)
+    np.testing.assert_array_equal(s_noisy, s)
+    assert s_noisy is not s
+
+
+def test_on_mode_scales_unit_noise_with_current_sigmas(monkeypatch):
+    monkeypatch.setattr(noise_adder, 'sigma_angle', 0.0)
+    monkeypatch.setattr(noise_adder, 'sigma_angleD', 0.0)
+    monkeypatch.setattr(noise_adder, 'sigma_position', 0.5)
+    monkeypatch.setattr(noise_adder, 'sigma_positionD', 0.0)
+    adder = make_noise_adder('ON', noise_block_size=100)
+    s = create_cartpole_state()
+    s[ANGLE_IDX] = 0.3
+
+    s_noisy = adder.add_noise_to_measurement(s)
+
+    expected = 0.5 * adder.noise_block[0, POSITION_CHANNEL]
+    np.testing.assert_allclose(s_noisy[POSITION_IDX] - s[POSITION_IDX], expected, rtol=1e-6)
+    np.testing.assert_allclose(s_noisy[ANGLE_IDX], s[ANGLE_IDX])
+    np.testing.assert_allclose(s_noisy[ANGLE_COS_IDX], np.cos(s_noisy[ANGLE_IDX]), atol=1e-6)
+    np.testing.assert_allclose(s_noisy[ANGLE_SIN_IDX], np.sin(s_noisy[ANGLE_IDX]), atol=1e-6)
+
+
+def test_noise_block_is_consumed_in_order_and_redrawn():
+    adder = make_noise_adder('ON', noise_block_size=4)
+    samples = [adder.get_noise_sample().copy() for _ in range(4)]
+    first_block = adder.noise_block.copy()
+    np.testing.assert_array_equal(samples, first_block)
+
+    adder.get_noise_sample()
+    assert adder.noise_block_index == 1
+    assert not np.array_equal(adder.noise_block, first_block)
+
+
+def test_changing_mode_redraws_block():
+    adder = make_noise_adder('ON', noise_block_size=100)
+    adder.get_noise_sample()
+    adder.noise_mode = 'IIR'
+    adder.get_noise_sample()
+    assert adder.noise_block_mode == 'IIR'
+    assert adder.noise_block_index == 1
+
+
+def test_iir_noise_is_filtered_white_noise_continuous_across_blocks():
+    block_size = 50
+    adder = make_noise_adder('IIR', noise_block_size=block_size)
+    reference = make_noise_adder('ON', noise_block_size=2 * block_size)  # Same seed, same white noise
+
+    iir_samples = np.array([adder.get_noise_sample().copy() for _ in range(2 * block_size)])
+    white = reference.rng_noise_adder.standard_normal(
+        size=(2 * block_size, len(NOISE_INDICES)), dtype=np.float32)
+
+    for i, a in enumerate(NOISE_SMOOTHING):
+        if a == 1.0:
+            expected = white[:, i]
+        else:
+            expected = lfilter([a], [1.0, a - 1.0], white[:, i] / noise_adder._noise_iir_factor(a))
+        np.testing.assert_allclose(iir_samples[:, i], expected, rtol=1e-4, atol=1e-5)
+
+
+def test_iir_noise_has_unit_variance():
+    adder = make_noise_adder('IIR', noise_block_size=200000)
+    adder.generate_noise_block()
+    a = NOISE_SMOOTHING[POSITION_CHANNEL]
+    position_noise = adder.noise_block[:, POSITION_CHANNEL]
+    np.testing.assert_allclose(np.std(position_noise), 1.0, rtol=0.02)
+    # First order filter: lag one autocorrelation is 1-a
+    np.testing.assert_allclose(np.corrcoef(position_noise[1:], position_noise[:-1])[0, 1], 1.0 - a, atol=0.02)
+
+
+def test_batched_noise_is_independent_per_state():
+    batch_size = 4
+    adder = make_noise_adder('ON', batch_size=batch_size)
+    s_batch = np.tile(create_cartpole_state(), (batch_size, 1))
+    s_noisy = adder.add_noise_to_measurement(s_batch)
+    assert s_noisy.shape == s_batch.shape
+    assert len(np.unique(s_noisy[:, POSITION_IDX])) == batch_size
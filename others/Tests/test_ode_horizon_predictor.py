@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from CartPole.state_utilities import ANGLE_COS_IDX, ANGLE_IDX, ANGLE_SIN_IDX, ANGLED_IDX, POSITION_IDX, POSITIOND_IDX
+from SI_Toolkit_ASF.predictors_customization_numba import next_state_predictor_ODE, predictor_ODE_horizon_numba
+
+BATCH_SIZE, HORIZON, DT, INTERMEDIATE_STEPS = 32, 20, 0.02, 10
+
+
+def initial_states_and_inputs():
+    rng = np.random.default_rng(0)
+    s = np.zeros((BATCH_SIZE, 6), dtype=np.float32)
+    s[:, ANGLE_IDX] = rng.uniform(-0.5, 0.5, BATCH_SIZE)
+    s[:, ANGLED_IDX] = rng.uniform(-1.0, 1.0, BATCH_SIZE)
+    s[:, ANGLE_COS_IDX], s[:, ANGLE_SIN_IDX] = np.cos(s[:, ANGLE_IDX]), np.sin(s[:, ANGLE_IDX])
+    s[:, POSITION_IDX] = rng.uniform(-0.1, 0.1, BATCH_SIZE)
+    s[:, POSITIOND_IDX] = rng.uniform(-0.5, 0.5, BATCH_SIZE)
+    Q = rng.uniform(-1.0, 1.0, (BATCH_SIZE, HORIZON, 1)).astype(np.float32)
+    return s, Q
+
+
+@pytest.mark.parametrize('parallel', [False, True])
+def test_horizon_predictor_matches_stepwise_predictor(parallel):
+    # The horizon kernel integrates with double precision scalars, the stepwise predictor with float32 arrays
+    s, Q = initial_states_and_inputs()
+    s_horizon = predictor_ODE_horizon_numba(HORIZON, DT, INTERMEDIATE_STEPS, BATCH_SIZE, parallel=parallel).predict(s, Q)
+    assert s_horizon.dtype == np.float32
+
+    step_predictor = next_state_predictor_ODE(DT, INTERMEDIATE_STEPS, BATCH_SIZE)
+    s_step = s
+    np.testing.assert_array_equal(s_horizon[:, 0], s)
+    for j in range(HORIZON):
+        s_step = step_predictor.step(s_step, Q[:, j])
+        np.testing.assert_allclose(s_horizon[:, j + 1], s_step, rtol=1e-4, atol=1e-5)
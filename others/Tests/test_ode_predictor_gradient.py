@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+
+from SI_Toolkit.computation_library import TensorFlowLibrary
+
+from CartPole.state_utilities import (ANGLE_COS_IDX, ANGLE_IDX, ANGLE_SIN_IDX, ANGLED_IDX, POSITION_IDX,
+                                      POSITIOND_IDX, STATE_VARIABLES)
+from SI_Toolkit_ASF.predictors_customization import next_state_predictor_ODE
+
+BATCH_SIZE, HORIZON = 50, 20
+
+
+def initial_states():
+    rng = np.random.default_rng(0)
+    s0 = np.zeros((BATCH_SIZE, len(STATE_VARIABLES)), dtype=np.float32)
+    s0[:, ANGLE_IDX] = rng.uniform(-np.pi, np.pi, BATCH_SIZE)
+    s0[:, ANGLED_IDX] = rng.normal(0.0, 2.0, BATCH_SIZE)
+    s0[:, POSITION_IDX] = rng.uniform(-0.1, 0.1, BATCH_SIZE)
+    s0[:, POSITIOND_IDX] = rng.normal(0.0, 0.5, BATCH_SIZE)
+    s0[:, ANGLE_COS_IDX], s0[:, ANGLE_SIN_IDX] = np.cos(s0[:, ANGLE_IDX]), np.sin(s0[:, ANGLE_IDX])
+    Q = rng.uniform(-1.0, 1.0, (BATCH_SIZE, HORIZON, 1)).astype(np.float32)
+    return tf.constant(s0), tf.Variable(Q)
+
+
+def rollout_gradient(analytic_gradient, s0, Q):
+    predictor = next_state_predictor_ODE(0.02, 10, TensorFlowLibrary, BATCH_SIZE, analytic_gradient=analytic_gradient)
+
+    @tf.function
+    def gradient():
+        with tf.GradientTape() as tape:
+            s = s0
+            loss = 0.0
+            for i in range(HORIZON):
+                s = predictor.step(s, Q[:, i])
+                loss += tf.reduce_sum(s[:, POSITION_IDX] ** 2 + (1.0 - s[:, ANGLE_COS_IDX]) ** 2)
+        return tape.gradient(loss, Q)
+
+    return gradient().numpy()
+
+
+def test_analytic_gradient_matches_autodiff():
+    s0, Q = initial_states()
+    gradient_analytic = rollout_gradient(True, s0, Q)
+    gradient_autodiff = rollout_gradient(False, s0, Q)
+
+    scale = np.max(np.abs(gradient_autodiff))
+    assert scale > 0.0
+    np.testing.assert_allclose(gradient_analytic / scale, gradient_autodiff / scale, atol=1e-4)
+
+
+def test_analytic_gradient_is_opt_in():
+    predictor = next_state_predictor_ODE(0.02, 10, TensorFlowLibrary)
+    assert predictor.fine_integration == predictor._fine_integration
@@ -0,0 +1,45 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from SI_Toolkit.computation_library import NumpyLibrary, TensorFlowLibrary
+
+from SI_Toolkit_ASF.predictors_customization import predictor_output_augmentation_tf
+
+NET_INFO = SimpleNamespace(outputs=['angle', 'angleD', 'position', 'positionD'])
+
+
+def net_output():
+    rng = np.random.default_rng(0)
+    return rng.uniform(-1.0, 1.0, (4, 3, len(NET_INFO.outputs))).astype(np.float32)
+
+
+def test_numpy_augmentation_matches_library_implementation():
+    output = net_output()
+    augmented = predictor_output_augmentation_tf(NET_INFO, NumpyLibrary).augment(output)
+    reference = predictor_output_augmentation_tf(NET_INFO, TensorFlowLibrary, disable_individual_compilation=True).augment(output)
+    np.testing.assert_allclose(augmented, np.array(reference), rtol=1e-6)
+
+
+def test_numpy_augmentation_reuses_output_buffer():
+    augmentation = predictor_output_augmentation_tf(NET_INFO, NumpyLibrary)
+    first, second = net_output(), -net_output()
+
+    buffer = augmentation.augment(first)
+    assert augmentation.augment(second) is buffer
+    np.testing.assert_array_equal(buffer[..., :len(NET_INFO.outputs)], second)
+
+    longer_horizon = np.concatenate([second, second], axis=1)
+    assert augmentation.augment(longer_horizon).shape[1] == 2 * second.shape[1]  # Reallocated for the new shape
+    assert augmentation.augment(longer_horizon) is augmentation.output_buffer
+
+
+def test_numpy_augmentation_writes_into_given_array():
+    augmentation = predictor_output_augmentation_tf(NET_INFO, NumpyLibrary)
+    output = net_output()
+    out = np.empty(output.shape[:-1] + (len(NET_INFO.outputs) + 2,), dtype=np.float32)
+    assert augmentation.augment(output, out=out) is out
+    assert augmentation.output_buffer is None
+    with pytest.raises(ValueError):
+        augmentation.augment(output, out=out[..., :-1])
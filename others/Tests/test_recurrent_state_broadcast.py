@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+
+from SI_Toolkit_ASF.predictors_customization import recurrent_state_broadcast
+
+NUM_ROLLOUTS, NUM_FEATURES, UNITS = 5, 3, 4
+
+
+class GRUPredictor:
+    """
+    Minimal stand-in for an SI_Toolkit neural predictor: a stateful Keras network in the attribute net,
+    whose internal state update() advances by one step with the applied input and the measured state
+    """
+    def __init__(self, batch_size, weights=None):
+        self.net = tf.keras.Sequential([tf.keras.Input(batch_shape=(batch_size, 1, NUM_FEATURES)),
+                                        tf.keras.layers.GRU(UNITS, stateful=True, return_sequences=True),
+                                        tf.keras.layers.GRU(UNITS, stateful=True, return_sequences=True),
+                                        tf.keras.layers.Dense(1)])
+        if weights is not None:
+            self.net.set_weights(weights)
+        self.batch_size = batch_size
+
+    def update(self, Q0, s):
+        net_input = np.concatenate([Q0[:, 0, :], s], axis=-1)[:, np.newaxis, :]
+        self.net(np.broadcast_to(net_input, (self.batch_size, 1, NUM_FEATURES)).astype(np.float32))
+
+    def states(self):
+        return [layer.states[0].numpy() for layer in self.net.layers[:2]]
+
+
+class Wrapper:
+    """Like PredictorWrapper, holds the predictor in the attribute predictor"""
+    def __init__(self, predictor):
+        self.predictor = predictor
+
+    def update(self, Q0, s):
+        self.predictor.update(Q0, s)
+
+
+def test_broadcast_state_equals_per_rollout_update():
+    single = GRUPredictor(1)
+    per_rollout = GRUPredictor(NUM_ROLLOUTS, single.net.get_weights())
+    broadcast_to = GRUPredictor(NUM_ROLLOUTS, single.net.get_weights())
+    state = recurrent_state_broadcast(Wrapper(broadcast_to), Wrapper(single))
+    assert state.available
+
+    rng = np.random.default_rng(0)
+    for _ in range(4):
+        Q0, s = rng.uniform(-1.0, 1.0, (1, 1, 1)), rng.uniform(-1.0, 1.0, (1, NUM_FEATURES - 1))
+        per_rollout.update(Q0, s)  # The same input tiled over all rollouts
+        state.update(Q0, s)
+        for expected, broadcast in zip(per_rollout.states(), broadcast_to.states()):
+            np.testing.assert_allclose(broadcast, expected, rtol=1e-6, atol=1e-6)
+
+
+def test_not_available_without_stateful_network():
+    state = recurrent_state_broadcast(Wrapper(object()), Wrapper(GRUPredictor(1)))
+    assert not state.available
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+from CartPole.sensor_quantizer import SensorQuantizer, derived_seed, quantize
+from CartPole.state_utilities import (ANGLE_COS_IDX, ANGLE_IDX, ANGLE_SIN_IDX, ANGLED_IDX, POSITION_IDX,
+                                      POSITIOND_IDX, create_cartpole_state)
+
+PRECISION = {'angle': 0.01, 'angleD': 0.1, 'position': 0.001, 'positionD': 0.05}
+
+
+def make_quantizer(add_noise=0):
+    quantizer = SensorQuantizer(seed=1, add_noise=add_noise, features_precision=PRECISION)
+    quantizer.quantization_mode = 'ON'
+    return quantizer
+
+
+def test_quantize_rounds_to_nearest_multiple():
+    values = np.array([0.014, 0.016, -0.026, 0.0], dtype=np.float64)
+    np.testing.assert_allclose(quantize(values, 0.01), [0.01, 0.02, -0.03, 0.0])
+
+
+def test_quantize_noise_is_bounded_by_add_noise_steps():
+    rng = np.random.default_rng(0)
+    values = np.zeros(1000)
+    quantized = quantize(values, 0.5, rng=rng, add_noise=2)
+    assert set(np.unique(quantized)) <= {-1.0, -0.5, 0.0, 0.5, 1.0}
+
+
+def test_quantize_measurement_keeps_cos_sin_consistent():
+    s = create_cartpole_state()
+    s[ANGLE_IDX], s[ANGLED_IDX], s[POSITION_IDX], s[POSITIOND_IDX] = 0.1234, 1.234, 0.01234, 0.1234
+    s_quantized = make_quantizer().quantize_measurement(s)
+
+    np.testing.assert_allclose(s_quantized[ANGLE_IDX], 0.12, atol=1e-6)
+    np.testing.assert_allclose(s_quantized[POSITION_IDX], 0.012, atol=1e-6)
+    np.testing.assert_allclose(s_quantized[ANGLE_COS_IDX], np.cos(s_quantized[ANGLE_IDX]), atol=1e-6)
+    np.testing.assert_allclose(s_quantized[ANGLE_SIN_IDX], np.sin(s_quantized[ANGLE_IDX]), atol=1e-6)
+    assert s[ANGLE_IDX] == np.float32(0.1234)  # Copied by default
+
+
+def test_quantize_dataframe_matches_quantize_measurement():
+    rng = np.random.default_rng(1)
+    angle = rng.uniform(-np.pi, np.pi, 50)
+    df = pd.DataFrame({
+        'angle': angle, 'angle_cos': np.cos(angle), 'angle_sin': np.sin(angle),
+        'angleD': rng.normal(0.0, 2.0, 50), 'position': rng.uniform(-0.2, 0.2, 50), 'positionD': rng.normal(0.0, 0.5, 50),
+    })
+    states = np.zeros((50, 6), dtype=np.float64)
+    for column, idx in (('angle', ANGLE_IDX), ('angle_cos', ANGLE_COS_IDX), ('angle_sin', ANGLE_SIN_IDX),
+                        ('angleD', ANGLED_IDX), ('position', POSITION_IDX), ('positionD', POSITIOND_IDX)):
+        states[:, idx] = df[column]
+
+    expected = make_quantizer().quantize_measurement(states)
+    make_quantizer().quantize_dataframe(df)  # Precisions held in float32 in quantize_measurement, hence atol
+
+    np.testing.assert_allclose(df['angle'], expected[:, ANGLE_IDX], atol=1e-6)
+    np.testing.assert_allclose(df['angle_cos'], expected[:, ANGLE_COS_IDX], atol=1e-6)
+    np.testing.assert_allclose(df['angle_sin'], expected[:, ANGLE_SIN_IDX], atol=1e-6)
+    np.testing.assert_allclose(df['position'], expected[:, POSITION_IDX], atol=1e-6)
+
+
+def test_quantizer_stream_is_not_the_global_seed_stream():
+    assert derived_seed(1873, 'SensorQuantizer') != 1873
+    assert derived_seed(None, 'SensorQuantizer') is None
+
+    quantizer = SensorQuantizer(seed=1873, add_noise=1, features_precision=PRECISION)
+    first_draws = quantizer.rng_quantizer.integers(0, 2 ** 31, 5)
+    global_stream = np.random.Generator(np.random.SFC64(seed=1873)).integers(0, 2 ** 31, 5)
+    assert not np.array_equal(first_draws, global_stream)
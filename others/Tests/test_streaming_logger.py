@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from others.streaming_logger import StreamingLogger
+
+
+def test_entries_are_written_in_chunks(tmp_path):
+    logger = StreamingLogger(str(tmp_path), chunk_len=3)
+    for i in range(7):
+        logger.append('x', np.full(2, i))
+
+    assert logger.chunk_lengths['x'] == [3, 3]
+    assert len(logger.buffers['x']) == 1
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['x_00000.npy', 'x_00001.npy']
+    assert logger.length('x') == 7
+
+
+def test_get_reads_entries_on_disk_and_in_memory(tmp_path):
+    logger = StreamingLogger(str(tmp_path), chunk_len=3)
+    for i in range(7):
+        logger.append('x', np.full(2, i))
+
+    for i in range(7):
+        np.testing.assert_array_equal(logger.get('x', i), [i, i])
+    np.testing.assert_array_equal(logger.get('x', -1), [6, 6])
+    with pytest.raises(IndexError):
+        logger.get('x', 7)
+    with pytest.raises(IndexError):
+        logger.get('x', -8)
+
+
+def test_appended_values_are_copied(tmp_path):
+    logger = StreamingLogger(str(tmp_path), chunk_len=10)
+    value = np.zeros(3)
+    logger.append('x', value)
+    value[:] = 1.0
+    np.testing.assert_array_equal(logger.get('x', 0), np.zeros(3))
+
+
+def test_load_and_flush(tmp_path):
+    logger = StreamingLogger(str(tmp_path), chunk_len=4)
+    for i in range(10):
+        logger.append('iteration', i)
+        logger.append('state', np.full((2, 3), i))
+
+    assert logger.keys() == {'iteration', 'state'}
+    np.testing.assert_array_equal(logger.load('iteration'), np.arange(10))
+
+    logger.flush()
+    assert logger.chunk_lengths['state'] == [4, 4, 2]
+    assert logger.length('state') == 10
+    states = logger.load('state')
+    assert states.shape == (10, 2, 3)
+    np.testing.assert_array_equal(states[:, 0, 0], np.arange(10))
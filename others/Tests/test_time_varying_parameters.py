@@ -0,0 +1,70 @@
+import warnings
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+
+from SI_Toolkit.computation_library import TensorFlowLibrary
+
+from CartPole.state_utilities import ANGLE_COS_IDX, ANGLE_IDX, ANGLE_SIN_IDX, ANGLED_IDX, STATE_VARIABLES
+from SI_Toolkit_ASF.predictors_customization import next_state_predictor_ODE, predictor_ODE_horizon_tf
+
+BATCH_SIZE, HORIZON, DT, INTERMEDIATE_STEPS = 8, 5, 0.02, 10
+
+
+def initial_states_and_inputs():
+    rng = np.random.default_rng(0)
+    s = np.zeros((BATCH_SIZE, len(STATE_VARIABLES)), dtype=np.float32)
+    s[:, ANGLE_IDX] = rng.uniform(-1.0, 1.0, BATCH_SIZE)
+    s[:, ANGLED_IDX] = rng.uniform(-1.0, 1.0, BATCH_SIZE)
+    s[:, ANGLE_COS_IDX], s[:, ANGLE_SIN_IDX] = np.cos(s[:, ANGLE_IDX]), np.sin(s[:, ANGLE_IDX])
+    Q = rng.uniform(-1.0, 1.0, (BATCH_SIZE, HORIZON, 1)).astype(np.float32)
+    return tf.constant(s), tf.constant(Q)
+
+
+def step_predictor(variable_parameters=None):
+    predictor = next_state_predictor_ODE(DT, INTERMEDIATE_STEPS, TensorFlowLibrary, BATCH_SIZE, variable_parameters)
+    return predictor.params, lambda s, Q: predictor.step(s, Q[:, 0, :])
+
+
+def horizon_predictor(variable_parameters=None):
+    predictor = predictor_ODE_horizon_tf(HORIZON, DT, INTERMEDIATE_STEPS, BATCH_SIZE, variable_parameters)
+    return predictor.next_step_predictor.params, predictor.predict
+
+
+@pytest.mark.parametrize('make_predictor', [step_predictor, horizon_predictor])
+def test_changing_pole_length_changes_predictions_without_retracing(make_predictor):
+    s, Q = initial_states_and_inputs()
+    params, predict = make_predictor()
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', RuntimeWarning)  # count_traces warns on every retrace
+        before = predict(s, Q).numpy()
+        params.set_parameters(L=0.5 * float(params.L))
+        after = predict(s, Q).numpy()
+    assert not np.allclose(before, after)
+
+
+@pytest.mark.parametrize('make_predictor', [step_predictor, horizon_predictor])
+def test_changing_pole_length_of_controller_does_not_retrace(make_predictor):
+    s, Q = initial_states_and_inputs()
+    variable_parameters = SimpleNamespace(L=tf.Variable(0.4, dtype=tf.float32))
+    _, predict = make_predictor(variable_parameters)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', RuntimeWarning)
+        before = predict(s, Q).numpy()
+        variable_parameters.L.assign(0.2)
+        after = predict(s, Q).numpy()
+    assert not np.allclose(before, after)
+
+
+def test_xla_compiled_predictors_match_graph_predictors():
+    s, Q = initial_states_and_inputs()
+    step = next_state_predictor_ODE(DT, INTERMEDIATE_STEPS, TensorFlowLibrary, BATCH_SIZE, disable_individual_compilation=True)
+    step_xla = next_state_predictor_ODE(DT, INTERMEDIATE_STEPS, TensorFlowLibrary, BATCH_SIZE, jit_compile=True)
+    np.testing.assert_allclose(step_xla.step(s, Q[:, 0, :]).numpy(), step.step(s, Q[:, 0, :]).numpy(), rtol=1e-5, atol=1e-5)
+
+    horizon = predictor_ODE_horizon_tf(HORIZON, DT, INTERMEDIATE_STEPS, BATCH_SIZE, jit_compile=False)
+    horizon_xla = predictor_ODE_horizon_tf(HORIZON, DT, INTERMEDIATE_STEPS, BATCH_SIZE, jit_compile=True)
+    np.testing.assert_allclose(horizon_xla.predict(s, Q).numpy(), horizon.predict(s, Q).numpy(), rtol=1e-5, atol=1e-5)
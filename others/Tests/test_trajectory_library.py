@@ -0,0 +1,70 @@
+import numpy as np
+
+from CartPole.state_utilities import ANGLE_IDX, ANGLED_IDX, POSITION_IDX, POSITIOND_IDX, create_cartpole_state
+from others.trajectory_library import TrajectoryLibrary, library_features
+
+HORIZON = 5
+
+
+def state(position=0.0, positionD=0.0, angle=0.0, angleD=0.0):
+    s = create_cartpole_state()
+    s[POSITION_IDX], s[POSITIOND_IDX], s[ANGLE_IDX], s[ANGLED_IDX] = position, positionD, angle, angleD
+    return s
+
+
+def test_features_are_continuous_at_pi():
+    below = library_features(0.0, 0.0, np.pi - 1e-3, 0.0, 0.0)
+    above = library_features(0.0, 0.0, -np.pi + 1e-3, 0.0, 0.0)
+    assert np.linalg.norm(below - above) < 0.01
+
+
+def test_sequences_are_fitted_to_horizon():
+    library = TrajectoryLibrary(HORIZON)
+    np.testing.assert_array_equal(library.fit_horizon(np.arange(7)), np.arange(5))
+    np.testing.assert_array_equal(library.fit_horizon([1.0, 2.0]), [1.0, 2.0, 0.0, 0.0, 0.0])
+    assert library.fit_horizon(np.ones((3, 2))).shape == (3, HORIZON)
+
+
+def test_query_returns_nearest_situation():
+    library = TrajectoryLibrary(HORIZON)
+    assert library.query(state(), 0.0) is None
+
+    library.add(state(position=-0.1), 0.0, np.full(HORIZON, -1.0))
+    library.add(state(position=0.1), 0.0, np.full(HORIZON, 1.0))
+    library.add(state(angle=np.pi), 0.0, np.full(HORIZON, 0.5))
+
+    distance, sequence = library.query(state(position=0.09), 0.0)
+    np.testing.assert_array_equal(sequence, np.ones(HORIZON))
+    np.testing.assert_allclose(distance, 0.01 / 0.1, rtol=1e-5)
+    np.testing.assert_array_equal(library.query(state(angle=-3.1), 0.0)[1], np.full(HORIZON, 0.5))
+
+
+def test_tree_is_rebuilt_only_after_enough_new_entries():
+    library = TrajectoryLibrary(HORIZON, rebuild_fraction=0.5)
+    for position in np.linspace(-0.2, 0.2, 10):
+        library.add(state(position=position), 0.0, np.full(HORIZON, position))
+    library.query(state(), 0.0)
+    tree = library.tree
+
+    library.add(state(position=1.0), 0.0, np.full(HORIZON, 1.0))
+    library.query(state(), 0.0)
+    assert library.tree is tree  # One new entry is below half of the tree size
+    assert len(library) == 11
+
+    for _ in range(5):
+        library.add(state(position=1.0), 0.0, np.full(HORIZON, 1.0))
+    np.testing.assert_array_equal(library.query(state(position=1.0), 0.0)[1], np.ones(HORIZON))
+    assert library.tree is not tree
+
+
+def test_save_and_load(tmp_path):
+    library = TrajectoryLibrary(HORIZON)
+    library.add(state(position=0.1), 0.1, np.arange(HORIZON))
+    path = str(tmp_path / 'library.npz')
+    library.save(path)
+
+    loaded = TrajectoryLibrary.load(path, horizon=HORIZON + 2)
+    assert len(loaded) == 1
+    np.testing.assert_array_equal(loaded.sequences[0], list(range(HORIZON)) + [0, 0])
+    np.testing.assert_array_equal(loaded.feature_scales, library.feature_scales)
+    np.testing.assert_array_equal(loaded.query(state(position=0.1), 0.1)[1][:HORIZON], np.arange(HORIZON))
@@ -0,0 +1,65 @@
+"""
+Times the whole-horizon ODE rollouts of the MPC predictors at the batch sizes used by the optimizers:
+Tensorflow graph (tf.function), Tensorflow with XLA (jit_compile=True) and numba, serial and parallel.
+All run on the CPU; the Tensorflow predictions are checked against the numba ones.
+
+Run from the repository root:
+    python -m others.benchmark_ode_predictors
+"""
+
+import os
+import timeit
+
+os.environ.setdefault('CUDA_VISIBLE_DEVICES', '-1')  # CPU timings
+
+import numpy as np
+
+from CartPole.state_utilities import (ANGLE_COS_IDX, ANGLE_IDX, ANGLE_SIN_IDX, ANGLED_IDX, POSITION_IDX,
+                                      POSITIOND_IDX, STATE_VARIABLES)
+from SI_Toolkit_ASF.predictors_customization import predictor_ODE_horizon_tf
+from SI_Toolkit_ASF.predictors_customization_numba import predictor_ODE_horizon_numba
+
+DT = 0.02
+INTERMEDIATE_STEPS = 10
+HORIZON = 35
+BATCH_SIZES = [32, 200, 400, 3500]  # Gradient optimizers, CEM, MPPI-TF, MPPI-cartpole
+REPEAT = 20
+
+
+def random_inputs(batch_size, horizon, rng):
+    s0 = np.zeros(len(STATE_VARIABLES), dtype=np.float32)
+    s0[ANGLE_IDX], s0[ANGLED_IDX] = 0.3, -1.0
+    s0[POSITION_IDX], s0[POSITIOND_IDX] = 0.05, 0.2
+    s0[ANGLE_COS_IDX], s0[ANGLE_SIN_IDX] = np.cos(s0[ANGLE_IDX]), np.sin(s0[ANGLE_IDX])
+    Q = rng.uniform(-1.0, 1.0, (batch_size, horizon, 1)).astype(np.float32)
+    return s0, Q
+
+
+def time_ms(predict, s0, Q):
+    predict(s0, Q)  # Compilation
+    return 1.0e3 * min(timeit.repeat(lambda: predict(s0, Q), number=1, repeat=REPEAT))
+
+
+def run_benchmark():
+    rng = np.random.default_rng(0)
+    print('Horizon {}, {} intermediate steps, best of {} [ms]'.format(HORIZON, INTERMEDIATE_STEPS, REPEAT))
+    print('{:>8} {:>10} {:>10} {:>10} {:>10} {:>12}'.format(
+        'batch', 'tf graph', 'tf xla', 'numba', 'numba par', 'max |xla-nb|'))
+    for batch_size in BATCH_SIZES:
+        s0, Q = random_inputs(batch_size, HORIZON, rng)
+        predictors = {
+            'graph': predictor_ODE_horizon_tf(HORIZON, DT, INTERMEDIATE_STEPS, batch_size, jit_compile=False),
+            'xla': predictor_ODE_horizon_tf(HORIZON, DT, INTERMEDIATE_STEPS, batch_size, jit_compile=True),
+            'numba': predictor_ODE_horizon_numba(HORIZON, DT, INTERMEDIATE_STEPS, batch_size),
+            'numba_parallel': predictor_ODE_horizon_numba(HORIZON, DT, INTERMEDIATE_STEPS, batch_size, parallel=True),
+        }
+        times = {name: time_ms(predictor.predict, s0, Q) for name, predictor in predictors.items()}
+        difference = np.max(np.abs(
+            np.asarray(predictors['xla'].predict(s0, Q)) - predictors['numba'].predict(s0, Q)
+        ))
+        print('{:>8} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f} {:>12.2e}'.format(
+            batch_size, times['graph'], times['xla'], times['numba'], times['numba_parallel'], difference))
+
+
+if __name__ == '__main__':
+    run_benchmark()
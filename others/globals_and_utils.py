@@ -12,6 +12,7 @@ from typing import Tuple
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '0' # all TF messages
 
 import atexit
+import warnings
 # https://stackoverflow.com/questions/35851281/python-finding-the-users-downloads-folder
 import os
 
@@ -226,6 +227,32 @@ class MockSpace:
         self.shape = shape
         
 
+def count_traces(function, name=None, expected_traces=1):
+    """
+    Wraps a function before it is compiled (tf.function, CompileAdaptive with Tensorflow) such that its traces are counted.
+    The Python body of a compiled function runs only while it is traced, so each call of the wrapper is a (re)compilation.
+    Every trace beyond expected_traces raises a warning - a retrace stalls a running experiment,
+    typically because a Python scalar argument or an input shape changed.
+
+    :return: The wrapper, with the number of traces so far in its attribute traces
+    """
+    name = name or getattr(function, '__qualname__', repr(function))
+
+    def traced_function(*args, **kwargs):
+        traced_function.traces += 1
+        if traced_function.traces > expected_traces:
+            shapes = [tuple(a.shape) if hasattr(a, 'shape') else a for a in args]
+            warnings.warn(f'{name} compiled for the {traced_function.traces}. time during the run, '
+                          f'arguments {shapes}. Pass changing values as tensors or variables to avoid retracing.',
+                          RuntimeWarning)
+        return function(*args, **kwargs)
+
+    # Not functools.wraps: with __wrapped__ set, autograph would convert the wrapped function instead of the wrapper
+    traced_function.__name__ = getattr(function, '__name__', 'traced_function')
+    traced_function.traces = 0
+    return traced_function
+
+
 timers = {}
 times = {}
 class Timer:
@@ -1,44 +1,28 @@
 import os
+from functools import partial
+from multiprocessing import Pool
+
 import pandas as pd
-import numpy as np
-from SI_Toolkit.load_and_normalize import load_data, get_paths_to_datafiles
-from CartPole.cartpole_parameters import TrackHalfLength
+from SI_Toolkit.load_and_normalize import get_paths_to_datafiles
+from CartPole.sensor_quantizer import SensorQuantizer, seed_for_file, add_noise
+from others.globals_and_utils import load_config
 
 # Settings
-encoder_precision = 2*TrackHalfLength/4705.0
-ADC_precision = (1.0 / 4096.0)
-measurement_interval = 1.0e-3  # s
-add_noise = 1  # +/- quantised units
+# Precision of the sensors, measurement interval and noise are set in cartpole_physical_parameters.yml (quantization)
+# To quantize the data already while generating it, set quantization_mode: 'ON' there instead of running this script
 path_to_data = './SI_Toolkit_ASF/'
 quantized_folder = path_to_data + '_quantized'
+seed = load_config("cartpole_physical_parameters.yml")["cartpole"]["seed"]  # Each file gets its own seed derived from this one and its path
+number_of_workers = os.cpu_count()
 
-features_precision_dict = {
-    'angle': ADC_precision,
-    'angleD': ADC_precision / measurement_interval,
-    'position': encoder_precision,
-    'positionD': encoder_precision / measurement_interval,
-}
-
-# Ensure the quantized directory exists
-if not os.path.exists(quantized_folder):
-    os.makedirs(quantized_folder)
-
-paths_to_datafiles = get_paths_to_datafiles(path_to_data)
-dfs = load_data(paths_to_datafiles)
-
-
-def quantize_with_noise(value, quantization_value):
-    noise_options = range(-add_noise, add_noise + 1)
-    noise = np.random.choice(noise_options) * quantization_value
-    return np.round(value / quantization_value) * quantization_value + noise
 
+def quantize_file(path, path_to_data, quantized_folder, seed):
+    relative_path = os.path.relpath(path, start=path_to_data)
 
-for path, df in zip(paths_to_datafiles, dfs):
-    for key, quantization_value in features_precision_dict.items():
-        if key in df.columns:
-            df[key] = df[key].apply(quantize_with_noise, args=(quantization_value,))
+    df = pd.read_csv(path, comment='#')
+    SensorQuantizer(seed=seed_for_file(relative_path, seed), add_noise=add_noise).quantize_dataframe(df)
 
-    new_path = os.path.join(quantized_folder, os.path.relpath(path, start=path_to_data))
+    new_path = os.path.join(quantized_folder, relative_path)
     os.makedirs(os.path.dirname(new_path), exist_ok=True)
 
     with open(path, 'r') as original_file, open(new_path, 'w') as new_file:
@@ -52,5 +36,20 @@ for path, df in zip(paths_to_datafiles, dfs):
         new_file.write('# This is a quantized version of the original file with added noise\n')
 
         # Now write the modified DataFrame
-        df.to_csv(new_file, index=False, line_terminator='\n')
+        df.to_csv(new_file, index=False, lineterminator='\n')
+
+    return new_path
+
+
+if __name__ == '__main__':
+    # Ensure the quantized directory exists
+    if not os.path.exists(quantized_folder):
+        os.makedirs(quantized_folder)
+
+    paths_to_datafiles = get_paths_to_datafiles(path_to_data)
 
+    with Pool(number_of_workers) as pool:
+        for new_path in pool.imap_unordered(
+                partial(quantize_file, path_to_data=path_to_data, quantized_folder=quantized_folder, seed=seed),
+                paths_to_datafiles):
+            print('Saved {}'.format(new_path))
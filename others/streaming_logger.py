@@ -0,0 +1,68 @@
+"""
+Logger writing arrays to disk in chunks, so that its memory use does not grow with the length of an experiment.
+
+Every key is stored as a series of .npy files, each holding a chunk of consecutive entries stacked along the first axis.
+At most chunk_len entries per key are kept in memory.
+Single entries can be read back lazily - only the chunk containing them is opened (memory-mapped).
+"""
+
+import os
+
+import numpy as np
+
+
+class StreamingLogger:
+    def __init__(self, path, chunk_len=100):
+        self.path = path
+        self.chunk_len = chunk_len
+
+        os.makedirs(self.path, exist_ok=True)
+
+        self.buffers = {}  # key: entries not yet written to disk
+        self.chunk_lengths = {}  # key: number of entries in each chunk already written to disk
+
+    def chunk_path(self, key, chunk_idx):
+        return os.path.join(self.path, '{}_{:05d}.npy'.format(key, chunk_idx))
+
+    def append(self, key, value):
+        buffer = self.buffers.setdefault(key, [])
+        buffer.append(np.array(value, copy=True))
+        if len(buffer) >= self.chunk_len:
+            self.flush_key(key)
+
+    def flush_key(self, key):
+        buffer = self.buffers.get(key)
+        if buffer:
+            chunk_lengths = self.chunk_lengths.setdefault(key, [])
+            np.save(self.chunk_path(key, len(chunk_lengths)), np.stack(buffer, axis=0))
+            chunk_lengths.append(len(buffer))
+            self.buffers[key] = []
+
+    def flush(self):
+        for key in self.buffers:
+            self.flush_key(key)
+
+    def keys(self):
+        return set(self.buffers) | set(self.chunk_lengths)
+
+    def length(self, key):
+        return sum(self.chunk_lengths.get(key, [])) + len(self.buffers.get(key, []))
+
+    def get(self, key, i):
+        """Returns entry i of key, reading only the chunk which contains it."""
+        if i < 0:
+            i += self.length(key)
+        if i < 0 or i >= self.length(key):
+            raise IndexError('Entry {} of {} not logged'.format(i, key))
+        for chunk_idx, chunk_length in enumerate(self.chunk_lengths.get(key, [])):
+            if i < chunk_length:
+                return np.array(np.load(self.chunk_path(key, chunk_idx), mmap_mode='r')[i])
+            i -= chunk_length
+        return np.array(self.buffers[key][i])
+
+    def load(self, key):
+        """Returns all entries of key stacked along the first axis. Use only for keys with small entries."""
+        chunks = [np.load(self.chunk_path(key, chunk_idx)) for chunk_idx in range(len(self.chunk_lengths.get(key, [])))]
+        if self.buffers.get(key):
+            chunks.append(np.stack(self.buffers[key], axis=0))
+        return np.concatenate(chunks, axis=0)
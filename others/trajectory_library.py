@@ -0,0 +1,156 @@
+"""
+Library of control input sequences indexed by the (state, target position) for which they were computed.
+
+Used to warm start MPC controllers: after a large disturbance or a target jump the input sequence of the nearest stored
+situation is a better first guess than the shifted previous solution.
+The nearest neighbour is found with a KD-tree over scaled features, the tree is rebuilt only when enough entries were added.
+Sequences can come from controller runs or from experiment recordings (e.g. from data generation).
+
+Run this file to build a library from recordings:
+    python -m others.trajectory_library library.npz recording_1.csv recording_2.csv ...
+"""
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from CartPole.state_utilities import ANGLE_IDX, ANGLED_IDX, POSITION_IDX, POSITIOND_IDX
+
+# Scale of each feature [position - target, positionD, cos(angle), sin(angle), angleD, target position]
+DEFAULT_FEATURE_SCALES = np.array([0.1, 0.5, 0.5, 0.5, 5.0, 0.1], dtype=np.float32)
+
+
+def library_features(position, positionD, angle, angleD, target_position, scales=DEFAULT_FEATURE_SCALES):
+    """Features of one or many situations, scaled such that a distance of 1 is a notable difference.
+    The angle enters through its cosine and sine, so that the distance is continuous at +/- pi."""
+    features = np.stack(np.broadcast_arrays(
+        position - target_position, positionD, np.cos(angle), np.sin(angle), angleD, target_position
+    ), axis=-1).astype(np.float32)
+    return features / scales
+
+
+class TrajectoryLibrary:
+    def __init__(self, horizon, feature_scales=DEFAULT_FEATURE_SCALES, rebuild_fraction=0.1):
+        """
+        :param horizon: Length of the stored input sequences, longer sequences are truncated, shorter ones padded with zeros
+        :param feature_scales: See library_features
+        :param rebuild_fraction: The KD-tree is rebuilt at the next query once entries amounting to this fraction of its size were added
+        """
+        self.horizon = horizon
+        self.feature_scales = np.asarray(feature_scales, dtype=np.float32)
+        self.rebuild_fraction = rebuild_fraction
+
+        self.features = np.zeros((0, self.feature_scales.size), dtype=np.float32)
+        self.sequences = np.zeros((0, horizon), dtype=np.float32)
+        self.new_features = []
+        self.new_sequences = []
+
+        self.tree = None
+        self.tree_size = 0
+
+    def __len__(self):
+        return self.features.shape[0] + len(self.new_features)
+
+    def fit_horizon(self, u):
+        u = np.asarray(u, dtype=np.float32)[..., :self.horizon]
+        if u.shape[-1] < self.horizon:
+            u = np.concatenate((u, np.zeros(u.shape[:-1] + (self.horizon - u.shape[-1],), dtype=np.float32)), axis=-1)
+        return u
+
+    def add(self, s, target_position, u):
+        """Store the input sequence u computed in state s for target_position"""
+        self.new_features.append(library_features(
+            s[POSITION_IDX], s[POSITIOND_IDX], s[ANGLE_IDX], s[ANGLED_IDX], target_position, self.feature_scales
+        ))
+        self.new_sequences.append(self.fit_horizon(u))
+
+    def add_many(self, features, sequences):
+        self.new_features.extend(features)
+        self.new_sequences.extend(self.fit_horizon(sequences))
+
+    def merge_new_entries(self):
+        if self.new_features:
+            self.features = np.concatenate((self.features, np.stack(self.new_features)), axis=0)
+            self.sequences = np.concatenate((self.sequences, np.stack(self.new_sequences)), axis=0)
+            self.new_features = []
+            self.new_sequences = []
+
+    def query(self, s, target_position):
+        """Returns (scaled distance, input sequence) of the nearest stored situation, None if the library is empty"""
+        if len(self) == 0:
+            return None
+        if self.tree is None or len(self) - self.tree_size > self.rebuild_fraction * self.tree_size:
+            self.merge_new_entries()
+            self.tree = cKDTree(self.features)
+            self.tree_size = self.features.shape[0]
+
+        features = library_features(
+            s[POSITION_IDX], s[POSITIOND_IDX], s[ANGLE_IDX], s[ANGLED_IDX], target_position, self.feature_scales
+        )
+        distance, idx = self.tree.query(features)
+        return distance, self.sequences[idx]
+
+    def add_recording(self, file_path, dt, every=1):
+        """Add the input sequences applied in an experiment recording.
+        The sequence of row i are the inputs Q recorded at the following horizon control steps of length dt.
+
+        :param dt: Controller time step, the rows of the recording must be spaced by dt or an integer fraction of it
+        :param every: Add only the sequence of every ...-th row
+        :return: Number of added sequences
+        """
+        from CartPole.load import load_csv_recording
+
+        data = load_csv_recording(file_path)
+        if data is False:
+            return 0
+        time = data['time'].to_numpy()
+        stride = max(1, int(round(dt / np.median(np.diff(time)))))
+        Q = data['Q'].to_numpy(dtype=np.float32)
+
+        starts = np.arange(0, Q.size - stride * (self.horizon - 1), every)
+        if starts.size == 0:
+            return 0
+        sequences = Q[starts[:, np.newaxis] + stride * np.arange(self.horizon)]
+        features = library_features(
+            data['position'].to_numpy()[starts], data['positionD'].to_numpy()[starts],
+            data['angle'].to_numpy()[starts], data['angleD'].to_numpy()[starts],
+            data['target_position'].to_numpy()[starts], self.feature_scales,
+        )
+        self.add_many(features, sequences)
+        return starts.size
+
+    def save(self, path):
+        self.merge_new_entries()
+        np.savez_compressed(path, features=self.features, sequences=self.sequences, feature_scales=self.feature_scales)
+
+    @classmethod
+    def load(cls, path, horizon=None, rebuild_fraction=0.1):
+        """Load a library saved with save. The sequences are fitted to horizon if given."""
+        data = np.load(path)
+        sequences = data['sequences']
+        library = cls(horizon or sequences.shape[1], data['feature_scales'], rebuild_fraction)
+        library.features = data['features']
+        library.sequences = library.fit_horizon(sequences)
+        return library
+
+
+if __name__ == '__main__':
+    import sys
+
+    from others.globals_and_utils import load_config
+
+    if len(sys.argv) < 3:
+        print('Usage: python -m others.trajectory_library library.npz recording_1.csv [recording_2.csv ...]')
+        sys.exit(1)
+
+    library_path, recordings = sys.argv[1], sys.argv[2:]
+    dt = load_config('config_data_gen.yml')['dt']['control']
+    horizon = load_config('Control_Toolkit_ASF/config_controllers.yml')['mppi-cartpole']['mpc_horizon']
+
+    try:
+        library = TrajectoryLibrary.load(library_path, horizon)
+    except FileNotFoundError:
+        library = TrajectoryLibrary(horizon)
+    for recording in recordings:
+        print('Added {} sequences from {}'.format(library.add_recording(recording, dt), recording))
+    library.save(library_path)
+    print('Library {} holds {} sequences'.format(library_path, len(library)))
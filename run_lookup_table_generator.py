@@ -0,0 +1,115 @@
+"""
+Tabulates the control input of a controller (typically MPPI) on a regular grid over
+(position - target_position, positionD, angle, angleD) for controller_lookup_table.
+
+The grid and the source controller are set in the "lookup-table" section of Control_Toolkit_ASF/config_controllers.yml.
+The grid points are split into chunks evaluated in parallel processes, each with its own instance of the source controller.
+At every grid point the source controller is stepped steps_per_point times with the same state (target at 0)
+and its last output is stored. The points are visited in serpentine (boustrophedon) order, see serpentine_order,
+so that within a chunk a stateful controller such as MPPI starts from the solution of a neighbouring point.
+The actuator noise of the source controller (p_Q) is switched off.
+"""
+
+import os
+import timeit
+from multiprocessing import Pool
+
+import numpy as np
+
+from CartPole.cartpole_parameters import L
+from CartPole.state_utilities import (ANGLE_COS_IDX, ANGLE_IDX, ANGLE_SIN_IDX, ANGLED_IDX, POSITION_IDX,
+                                      POSITIOND_IDX, create_cartpole_state)
+from others.globals_and_utils import load_config
+
+GRID_AXES = ['position', 'positionD', 'angle', 'angleD']
+
+
+def serpentine_order(shape):
+    """
+    Flat (C order) indices of all points of a grid of the given shape, ordered such that
+    consecutive points are neighbours along a single axis: every axis is traversed back and forth.
+    """
+    order = np.arange(shape[-1])
+    for n in reversed(shape[:-1]):
+        order = np.concatenate([i * order.size + (order if i % 2 == 0 else order[::-1]) for i in range(n)])
+    return order
+
+
+def create_source_controller(controller_name, optimizer_name, dt):
+    from Control_Toolkit.others.globals_and_utils import import_controller_by_name
+
+    Controller = import_controller_by_name(controller_name)
+    controller = Controller(
+        dt=dt,
+        environment_name="CartPole",
+        initial_environment_attributes={
+            "target_position": 0.0,
+            "target_equilibrium": 1.0,
+            "L": float(L),
+        },
+        control_limits=(np.array([-1.0]), np.array([1.0])),
+    )
+    if controller.has_optimizer:
+        controller.configure(optimizer_name)
+    else:
+        controller.configure()
+    if hasattr(controller, 'p_Q'):
+        controller.p_Q = 0.0
+    return controller
+
+
+def evaluate_chunk(arguments):
+    """Returns the control inputs of the source controller at the given grid points, shape (points x 4)"""
+    points, controller_name, optimizer_name, dt, steps_per_point = arguments
+    controller = create_source_controller(controller_name, optimizer_name, dt)
+
+    s = create_cartpole_state()
+    Q = np.zeros(points.shape[0], dtype=np.float32)
+    for i, (position, positionD, angle, angleD) in enumerate(points):
+        s[POSITION_IDX], s[POSITIOND_IDX], s[ANGLE_IDX], s[ANGLED_IDX] = position, positionD, angle, angleD
+        s[ANGLE_COS_IDX], s[ANGLE_SIN_IDX] = np.cos(angle), np.sin(angle)
+        for _ in range(steps_per_point):
+            Q[i] = controller.step(np.copy(s), 0.0, {"target_position": 0.0})
+    return Q
+
+
+def run_lookup_table_generator():
+    config = load_config(os.path.join("Control_Toolkit_ASF", "config_controllers.yml"))["lookup-table"]
+    dt = load_config("config_data_gen.yml")["dt"]["control"]
+
+    grid = config["grid"]
+    lower = np.array([grid[axis][0] for axis in GRID_AXES], dtype=np.float64)
+    upper = np.array([grid[axis][1] for axis in GRID_AXES], dtype=np.float64)
+    shape = tuple(int(grid[axis][2]) for axis in GRID_AXES)
+    axes = [np.linspace(lower[d], upper[d], shape[d]) for d in range(4)]
+    points = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 4)
+    order = serpentine_order(shape)
+
+    processes = config["processes"] or os.cpu_count()
+    chunks = np.array_split(points[order], max(1, min(processes * config["chunks_per_process"], points.shape[0])))
+    arguments = [
+        (chunk, config["source_controller"], config["source_optimizer"], dt, config["steps_per_point"])
+        for chunk in chunks
+    ]
+
+    print('Evaluating {} on {} grid points in {} processes'.format(config["source_controller"], points.shape[0], processes))
+    start = timeit.default_timer()
+    with Pool(processes) as pool:
+        Q = np.empty(points.shape[0], dtype=np.float32)
+        Q[order] = np.concatenate(pool.map(evaluate_chunk, arguments))  # Back to grid order
+    print('Done in {:.1f} s'.format(timeit.default_timer() - start))
+
+    table_path = config["table_path"]
+    os.makedirs(os.path.dirname(table_path) or '.', exist_ok=True)
+    np.savez_compressed(
+        table_path,
+        table=Q.reshape(shape).astype(np.float16),
+        lower=lower,
+        upper=upper,
+        source_controller=config["source_controller"],
+    )
+    print('Saved lookup table of shape {} to {}'.format(shape, table_path))
+
+
+if __name__ == '__main__':
+    run_lookup_table_generator()